@@ -1,28 +1,46 @@
 import asyncio
-
-active_user_lock = asyncio.Lock()
 import os
 import re
 import time
 import asyncio
 import pytz
 import json, random
+import signal
+import socket
+import threading
+from functools import partial
 from datetime import datetime, timezone
 from datetime import datetime, time as dtime
 from datetime import datetime
 from datetime import datetime, timedelta
 from dateutil.parser import isoparse
-from access_db import (
-    get_access_time_for_user,
+from access_db_async import (
     get_user_aprove_status,
     update_user_phone,
     insert_new_user,
     get_user_record,
     set_user_approval_status,
+    get_access_decision,
+    get_cache_stats,
+    disable_user_cache,
+    init_db_pool,
+    close_db_pool,
+    AccessDecision,
+    load_subscriptions,
+    add_subscription,
+    remove_subscription,
+    get_approved_user_ids,
+    get_access_events,
+    get_users_by_status,
+    count_users_by_status,
+    decide_pending,
 )
 
+from access_schedule import get_schedule
+from access_schema import normalize_phone
+
 from dotenv import load_dotenv
-from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
+from telegram import Update
 from telegram.ext import (
     ContextTypes,
     ApplicationBuilder,
@@ -33,22 +51,75 @@ from telegram.ext import (
     CallbackQueryHandler,
     filters,
 )
-from telegram import ReplyKeyboardRemove
-from telegram.error import NetworkError
-from telegram.ext import PicklePersistence
+from telegram import Bot, ReplyKeyboardRemove
+from telegram.error import BadRequest, Forbidden, TelegramError
 
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
-import paho.mqtt.publish as publish
 import paho.mqtt.client as mqtt
-from typing import Optional
+from mqtt_publisher import MqttPublisher, PublishError
+from mqtt_bridge import MqttBridge
+from log_writer import LogWriter
+from audit_log import AuditLog
+from gates import Gate, load_gates
+from gate_state import DeviceEvent
+from gate_store import LeaderLease, SQLiteGateStore
+from keyboards import (
+    CONTACT_KEYBOARD,
+    GATE_CALLBACK_PREFIX,
+    GATE_COMMANDS,
+    NEW_CONTACT_KEYBOARD,
+    KeyboardTable,
+)
+from pending_commands import PendingCommands
+from sqlite_persistence import SQLitePersistence
+from state_fanout import StateFanout
+from status_messages import StatusRenderer
+from timers import TimerScheduler
+from workers import EventRouter, WorkerPool, start_webhook_listener, worker_for
+from admin_digest import (
+    RegistrationDigest,
+    RegistrationRequest,
+    digest_message,
+    remaining_digest_rows,
+)
+from outbox import Outbox, PRIORITY_GATE, PRIORITY_INTERACTIVE, PRIORITY_NOTICE, PRIORITY_BULK
+from rate_limit import RateLimiter, format_retry, rate_from_interval
+from metrics import registry as metrics_registry, start_metrics_server
+from typing import Optional, Tuple
 
 load_dotenv()
 moscow = pytz.timezone("Europe/Moscow")
 min_interval_seconds = int(os.getenv("MIN_INTERVAL_SECONDS", "7"))
 ARDUINO_CONFIRM_TIMEOUT = int(os.getenv("ARDUINO_CONFIRM_TIMEOUT", "10"))
 IDLE_RESET_DELAY = int(os.getenv("IDLE_RESET_DELAY", "90"))
-MIN_INTERVAL = timedelta(seconds=min_interval_seconds)
-last_used_time = {}
+MQTT_COMMAND_QOS = int(os.getenv("MQTT_COMMAND_QOS", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+RATE_USER_BURST = int(os.getenv("RATE_USER_BURST", "3"))
+RATE_GATE_PER_MINUTE = float(os.getenv("RATE_GATE_PER_MINUTE", "20"))
+RATE_GATE_BURST = int(os.getenv("RATE_GATE_BURST", "5"))
+STATE_FANOUT_CONCURRENCY = int(os.getenv("STATE_FANOUT_CONCURRENCY", "16"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_GLOBAL_BURST = int(os.getenv("OUTBOX_GLOBAL_BURST", "5"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+AUDIT_RETENTION_DAYS = float(os.getenv("AUDIT_RETENTION_DAYS", "180"))
+PENDING_PAGE_SIZE = int(os.getenv("PENDING_PAGE_SIZE", "8"))
+ADMIN_DIGEST_WINDOW = float(os.getenv("ADMIN_DIGEST_WINDOW", "30"))
+ADMIN_DIGEST_MAX = int(os.getenv("ADMIN_DIGEST_MAX", "10"))
+ADMIN_DIGEST_QUIET = float(os.getenv("ADMIN_DIGEST_QUIET", "60"))
+WORKERS = int(os.getenv("WORKERS", "1"))
+GATE_LEASE_TTL = float(os.getenv("GATE_LEASE_TTL", "10"))
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "10"))
+# Горячий резерв: аренды калиток и ведущего в access.db (в режиме воркеров — всегда)
+STANDBY = os.getenv("STANDBY", "0") == "1"
+# Владелец аренд в access.db; у резервного экземпляра должен отличаться
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+STATUS_DEBOUNCE = float(os.getenv("STATUS_DEBOUNCE", "0.5"))
+STATUS_MAX_VIEWS = int(os.getenv("STATUS_MAX_VIEWS", "1000"))
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "30"))
+PERSISTENCE_FLUSH_DELAY = float(os.getenv("PERSISTENCE_FLUSH_DELAY", "1"))
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 SHEET_ID = os.getenv("SHEET_ID")
 GOOGLE_CREDENTIALS_FILE = "credentials.json"
@@ -62,54 +133,158 @@ MODE = os.getenv("MODE")
 ASK_NAME, ASK_PHONE = range(2)
 
 
+log_writer = LogWriter(
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    echo=os.getenv("LOG_ECHO", "1") == "1",
+)
+# Журнал команд калитки в access.db (таблица access_events)
+audit_log = AuditLog(retention_days=AUDIT_RETENTION_DAYS)
+
+
 def log(msg):
     now = datetime.now()
     timestamp = now.strftime("%d.%m.%Y %H:%M:%S")
-    date_str = now.strftime("%d-%m-%Y")
-    log_line = f"[{timestamp}] {msg}"
+    log_writer.write(now, f"[{timestamp}] {msg}")
 
-    print(log_line)
 
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
-    log_file_path = os.path.join(log_dir, f"{date_str}.log")
+# user_data и шаги регистрации переживают перезапуск (таблица bot_persistence)
+persistence = SQLitePersistence(
+    update_interval=PERSISTENCE_INTERVAL, flush_delay=PERSISTENCE_FLUSH_DELAY
+)
 
-    try:
-        with open(log_file_path, "a", encoding="utf-8") as f:
-            f.write(log_line + "\n")
-    except Exception as e:
-        print(f"[log error] {e}")
 
+# Все исходящие сообщения — через общую очередь с приоритетами и лимитами Telegram
+outbox = Outbox(
+    global_rate=OUTBOX_GLOBAL_RATE,
+    global_burst=OUTBOX_GLOBAL_BURST,
+    chat_rate=OUTBOX_CHAT_RATE,
+    chat_burst=OUTBOX_CHAT_BURST,
+    concurrency=OUTBOX_CONCURRENCY,
+    observe=lambda priority, wait: OUTBOX_WAIT.observe(wait, priority=priority),
+)
 
-async def schedule_idle_reset(context, user_id, activation_time):
-    await asyncio.sleep(IDLE_RESET_DELAY)
 
-    active_id = context.bot_data.get("active_user_id")
-    since = context.bot_data.get("active_user_since")
+async def send_text(bot, chat_id, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+    chat_id = int(chat_id)
+    return await outbox.send(
+        chat_id, partial(bot.send_message, chat_id=chat_id, text=text, **kwargs), priority
+    )
+
 
+async def reply(message, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+    return await outbox.send(
+        message.chat_id, partial(message.reply_text, text, **kwargs), priority
+    )
+
+
+async def edit_text(query, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+    return await outbox.send(
+        query.message.chat_id, partial(query.edit_message_text, text, **kwargs), priority
+    )
+
+
+async def send_status(bot, chat_id, text, markup, priority):
+    return await send_text(
+        bot, chat_id, text, priority=priority, reply_markup=markup, disable_notification=True
+    )
+
+
+async def edit_status(bot, chat_id, message_id, text, markup, priority):
+    return await outbox.send(
+        chat_id,
+        partial(
+            bot.edit_message_text, text, chat_id=chat_id, message_id=message_id, reply_markup=markup
+        ),
+        priority,
+    )
+
+
+def show_gate_status(
+    user_id, gate: Gate, text: str, state=None, delay=0.0, priority=PRIORITY_GATE
+):
+    """Статус калитки в сообщении, которое правится на месте (status_messages).
+
+    state — для inline-кнопки действия (Открыть/Остановить/Закрыть); None — без кнопки.
+    """
+    if len(gate_registry) > 1:
+        text = f"{text} ({gate.name})"
+    markup = keyboard_table.gate_actions(gate.id, state) if state else None
+    return status_renderer.show(int(user_id), gate.id, text, markup, priority, delay)
+
+
+def idle_reset_key(gate: Gate):
+    return ("idle", gate.id)
+
+
+def lease_renew_key(gate: Gate):
+    return ("lease", gate.id)
+
+
+def clear_active(gate: Gate):
+    """Снимает активного пользователя, его резервный сброс и продление аренды."""
+    gate.set_active(None)
+    timers.cancel(idle_reset_key(gate))
+    timers.cancel(lease_renew_key(gate))
+
+
+async def gate_leased_elsewhere(gate: Gate, user_id: str) -> bool:
+    """Берёт аренду калитки для user_id; True — она у другого пользователя или процесса.
+
+    Хранилище недоступно — False: управляем калиткой как в одном процессе.
+    """
+    if gate_store is None:
+        return False
+    lease = await gate_store.claim(gate.id, user_id)
+    return lease is not None and not lease.mine
+
+
+async def renew_gate_lease(gate: Gate, user_id: str):
+    """Продление аренды активного пользователя раз в треть GATE_LEASE_TTL."""
+    if gate.active_user_id != user_id:
+        return
+    if await gate_store.renew(gate.id) is False:
+        GATE_LEASES_LOST.inc(gate=gate.id)
+        log(f"[⚠️] Аренда калитки [{gate.id}] потеряна: {user_id} больше не активен")
+        clear_active(gate)
+        return
+    timers.schedule(
+        lease_renew_key(gate), GATE_LEASE_TTL / 3, renew_gate_lease, gate, user_id
+    )
+
+
+async def release_active(gate: Gate):
+    """clear_active() без сигнала от устройства: освободить и общую запись калитки."""
+    user_id = gate.active_user_id
+    clear_active(gate)
+    if gate_store is not None and user_id:
+        await gate_store.release(gate.id, user_id)
+
+
+async def idle_reset(context, gate: Gate, user_id, activation_time):
+    """Резервный сброс: устройство не прислало IDLE за IDLE_RESET_DELAY."""
     if (
-        active_id == user_id
-        and since == activation_time
-        and gate_state.get("current") != "IDLE"
+        gate.active_user_id == user_id
+        and gate.active_user_since == activation_time
+        and gate.state != "IDLE"
     ):
-        context.bot_data["active_user_id"] = None
-        gate_state["current"] = "IDLE"
-        log(f"[⏱] Резервный сброс: {user_id} → IDLE")
+        await release_active(gate)
+        gate.state = "IDLE"
+        IDLE_RESET_FALLBACKS.inc(gate=gate.id)
+        log(f"[⏱] Резервный сброс [{gate.id}]: {user_id} → IDLE")
 
         # ♻️ Обновление UI
-        dynamic_buttons = get_dynamic_keyboard(context, user_id, force=True)
-        keyboard = get_main_menu("yes", dynamic_buttons)
-        if keyboard:
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text="⏳ Устройство не прислало сигнал завершения. Возвращаем управление в исходное состояние.",
-                reply_markup=keyboard,
-                disable_notification=True,
-            )
-            log(f"[✅] Резервный сброс: меню отправлено для {user_id}")
+        show_gate_status(
+            user_id,
+            gate,
+            "⏳ Устройство не прислало сигнал завершения. Возвращаем управление в исходное состояние.",
+            state="IDLE",
+        )
+        log(f"[✅] Резервный сброс: статус обновлён для {user_id}")
+        await release_gate(context, gate)
     else:
         log(
-            f"[✅] Резервный сброс отменён: статус уже обновлён или пользователь сменился"
+            f"[✅] Резервный сброс [{gate.id}] отменён: статус уже обновлён или пользователь сменился"
         )
 
 
@@ -118,189 +293,470 @@ async def handle_old_gate_button(update: Update, context: ContextTypes.DEFAULT_T
     await start(update, context)
 
 
-async def is_too_soon(update, context) -> bool:
-    """Проверка антифлуда: возвращает True, если пользователь нажал слишком быстро."""
-    now = datetime.now()
-    last_used = context.user_data.get("last_gate_call")
+async def handle_gate_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-кнопка сообщения-статуса: gate:<id калитки>:<команда>."""
+    query = update.callback_query
+    gate_id, _, command = query.data[len(GATE_CALLBACK_PREFIX):].rpartition(":")
+    gate = gate_registry.get(gate_id)
+    if gate is None or command not in GATE_COMMANDS.values():
+        await query.answer("Кнопка устарела — откройте меню заново.")
+        return
+    await query.answer()
+    await handle_gate_command(command, update, context, gate=gate)
+
+
+def rate_limit_text(retry_after: float) -> str:
+    return f"⚠️ Подождите {format_retry(retry_after)} секунд перед повторной попыткой."
 
-    if last_used and now - last_used < MIN_INTERVAL:
-        await update.message.reply_text(
-            f"⚠️ Подождите {MIN_INTERVAL.total_seconds():.0f} секунд перед повторной попыткой."
-        )
-        user_id = update.effective_user.id
-        log(f"❌ Повторное открытие пользователем: user_id={user_id}")
-        return True
 
-    return False  # 👈 только проверка, больше ничего!
+async def is_rate_limited(update, gate: Gate, user_id: str) -> bool:
+    """Антифлуд: token bucket на пользователя, до любых обращений к БД и MQTT.
+
+    Ведро калитки расходует только реальная публикация (execute_gate_command):
+    объединённые и поставленные в очередь нажатия устройство не нагружают.
+    """
+    allowed, retry_after = user_rate_limiter.try_acquire(user_id)
+    if allowed:
+        return False
+    log(f"❌ Повторное открытие пользователем: user_id={user_id}")
+    await reply(update.effective_message, rate_limit_text(retry_after), priority=PRIORITY_GATE)
+    return True
+
+
+def activate_gate_user(context, gate: Gate, user_id: str, username: str):
+    """Назначает активного пользователя; вызывать под gate.lock."""
+    activation_time = datetime.now()
+    gate.set_active(user_id, activation_time)
+    # Один таймер на калитку: новый активный пользователь заменяет прежний сброс
+    timers.schedule(
+        idle_reset_key(gate), IDLE_RESET_DELAY, idle_reset, context, gate, user_id, activation_time
+    )
+    if gate_store is not None:
+        timers.schedule(
+            lease_renew_key(gate), GATE_LEASE_TTL / 3, renew_gate_lease, gate, user_id
+        )
+    log(f"[🆗] Назначен активный пользователь [{gate.id}]: {user_id}, username={username}")
 
 
 async def handle_gate_command(
-    command: str, update: Update, context: ContextTypes.DEFAULT_TYPE
+    command: str,
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    gate: Optional[Gate] = None,
 ):
+    """Команда калитки с кнопки меню или (gate задан) с inline-кнопки статуса."""
+    started_at = time.monotonic()
+    if update.message and update.message.date:
+        lag = datetime.now(timezone.utc) - update.message.date
+        GATE_STAGE.observe(max(lag.total_seconds(), 0.0), stage="telegram_update")
+
     user = update.effective_user
     user_id = str(user.id)
     username = user.username or "unknown"
 
+    if gate is None:
+        gate = gate_registry.from_button(update.message.text)
+    if gate is None:
+        await reply(update.effective_message, "❓ Выберите калитку кнопкой меню.", priority=PRIORITY_GATE)
+        return
+
+    if update.callback_query:
+        # Статус правится в том же сообщении, где нажали кнопку
+        status_renderer.attach(user_id, gate.id, update.callback_query.message.message_id)
+    else:
+        # Пользователь написал в чат — старый статус выше, новый покажем внизу
+        status_renderer.reset(user_id, gate.id)
+
     # ⛔ Защита от параллельных вызовов
-    if user_id in pending_confirmations:
-        print(f"[BLOCKED] {user_id} уже в очереди — повторный вызов")
-        await update.message.reply_text(
-            "⏳ Уже выполняется команда. Дождитесь ответа от устройства."
+    if user_id in gate.pending:
+        print(f"[BLOCKED] {user_id} уже в очереди [{gate.id}] — повторный вызов")
+        await reply(
+            update.effective_message,
+            "⏳ Уже выполняется команда. Дождитесь ответа от устройства.",
+            priority=PRIORITY_GATE,
         )
         return
 
-    pending_confirmations.add(user_id)
-    print(f"[DEBUG] добавлен в очередь: {user_id}")
+    gate.pending.add(user_id)
+    print(f"[DEBUG] добавлен в очередь [{gate.id}]: {user_id}")
 
     try:
-        if await is_too_soon(update, context):
+        if await is_rate_limited(update, gate, user_id):
+            audit_log.record(user_id, gate.id, command, "rate_limited", started_at)
             return
 
-        if not await is_gate_access_granted(user_id, update):
+        with GATE_STAGE.time(stage="db"):
+            decision = await get_access_decision(user_id)
+        if not await is_gate_access_granted(decision, update):
+            audit_log.record(user_id, gate.id, command, "denied", started_at)
             return
 
-        access_time = get_access_time_for_user(user_id)
+        access_time = decision.access_time
         if not access_time or not check_access_time(access_time):
-            await update.message.reply_text("🕒 Время доступа истекло.")
+            audit_log.record(user_id, gate.id, command, "denied", started_at)
+            await reply(update.effective_message, "🕒 Время доступа истекло.", priority=PRIORITY_GATE)
             return
 
-        async with active_user_lock:
-            current_active = context.bot_data.get("active_user_id")
-            if current_active and current_active != user_id:
-                await update.message.reply_text(
-                    "🚫 Калитка занята другим пользователем."
-                )
-                log(f"[BLOCKED] {user_id=} отклонён: уже активен {current_active}")
-                return
+        async with gate.lock:
+            current_active = gate.active_user_id
+            if current_active is None:
+                # Калитку мог арендовать другой процесс или экземпляр бота
+                busy = await gate_leased_elsewhere(gate, user_id)
+            else:
+                busy = current_active != user_id
+            if busy:
+                outcome, busy_reply = enqueue_gate_command(gate, user_id, username, command)
+            else:
+                busy_reply = None
+                activate_gate_user(context, gate, user_id, username)
+
+        if busy_reply:
+            audit_log.record(user_id, gate.id, command, outcome, started_at)
+            await reply(update.effective_message, busy_reply, priority=PRIORITY_GATE)
+            return
 
-            activation_time = datetime.now()
-            context.bot_data["active_user_id"] = user_id
-            context.bot_data["active_user_since"] = activation_time
-            asyncio.create_task(schedule_idle_reset(context, user_id, activation_time))
-            log(f"[🆗] Назначен активный пользователь: {user_id}, username={username}")
+        return await execute_gate_command(
+            context, gate, user_id, username, command, started_at=started_at
+        )
+    finally:
+        gate.pending.discard(user_id)
+        log(f"[🧹] {user_id} удалён из очереди ожидания [{gate.id}]")
+
+
+def enqueue_gate_command(
+    gate: Gate, user_id: str, username: str, command: str
+) -> Tuple[str, str]:
+    """Калитка занята другим: объединяем с текущим открытием или ставим в очередь.
+
+    Вызывать под gate.lock; возвращает (исход для audit_log, текст ответа).
+    """
+    if command == "OPEN" and gate.state == "OPENING":
+        gate.queue.coalesced += 1
+        log(f"[🔗] {user_id=} [{gate.id}]: OPEN объединён с текущим открытием")
+        return "coalesced", "🔓 Калитка уже открывается — проходите."
+
+    if command != "OPEN":
+        # Остановить/закрыть может только тот, кто управляет текущим циклом
+        log(f"[BLOCKED] {user_id=} [{gate.id}] {command} отклонён: активен {gate.active_user_id}")
+        return "denied", "🚫 Калитка занята другим пользователем."
+
+    position, merged = gate.queue.enqueue(user_id, username, command)
+    log(
+        f"[🧾] {user_id=} [{gate.id}] в очереди: позиция {position}"
+        + (" (объединён)" if merged else "")
+    )
+    return "queued", (
+        f"⏳ Калитка занята. Вы в очереди: {position}.\n"
+        "Откроем автоматически, как только она освободится."
+    )
 
-        timestamp_str = send_gate_command(command, user_id, username)
-        if not timestamp_str:
-            await update.message.reply_text("❌ Ошибка отправки команды.")
+
+async def release_gate(context, gate: Gate):
+    """Калитка освободилась: запускаем следующий билет из очереди."""
+    async with gate.lock:
+        if gate.active_user_id:
             return
+        ticket, expired = gate.queue.pop_next()
+        if ticket and await gate_leased_elsewhere(gate, ticket.user_id):
+            # Калитку арендовал другой процесс — ждём следующего IDLE
+            gate.queue.push_front(ticket)
+            ticket = None
+        if ticket:
+            activate_gate_user(context, gate, ticket.user_id, ticket.username)
+
+    for stale in expired:
+        for user_id in stale.user_ids():
+            audit_log.record(user_id, gate.id, stale.command, "expired", stale.created_at)
+            # Без ожидания: release_gate вызывают и из обработчика MQTT
+            outbox.submit(
+                int(user_id),
+                partial(
+                    context.bot.send_message,
+                    chat_id=int(user_id),
+                    text="⌛ Время ожидания в очереди истекло. Нажмите «Открыть» ещё раз.",
+                    disable_notification=True,
+                ),
+                PRIORITY_NOTICE,
+            ).add_done_callback(_log_notice_failure)
+        log(f"[⌛] [{gate.id}] билет {stale.user_id} просрочен")
 
-        context.user_data["last_command_timestamp"] = isoparse(timestamp_str)
+    if ticket:
+        asyncio.create_task(run_queued_ticket(context, gate, ticket))
 
-        success = await wait_for_arduino_confirmation(
-            context=context,
-            user_id=user_id,
-            update=update,
-            command_name=command,
-        )
 
-        if success:
-            context.user_data["last_gate_call"] = datetime.now()
-            log(f"Команда {command} выполнена.")
-        return success
+async def run_queued_ticket(context, gate: Gate, ticket):
+    # Повторное нажатие владельца билета во время запуска — как при обычной команде
+    owned = ticket.user_id not in gate.pending
+    gate.pending.add(ticket.user_id)
+    try:
+        success = await dispatch_ticket(context, gate, ticket)
     finally:
-        pending_confirmations.discard(user_id)
-        log(f"[🧹] {user_id} удалён из очереди pending_confirmations")
+        if owned:
+            gate.pending.discard(ticket.user_id)
+    if not success:
+        return
+    for rider_id, _ in ticket.riders:
+        audit_log.record(rider_id, gate.id, ticket.command, "coalesced", ticket.created_at)
+    # Разным чатам — параллельно, темп держит outbox
+    await asyncio.gather(
+        *(
+            show_gate_status(
+                rider_id, gate, "🔓 Калитка открывается — ваш запрос объединён с очередью."
+            )
+            for rider_id, _ in ticket.riders
+        ),
+        return_exceptions=True,
+    )
+
+
+gate_registry = load_gates()
+keyboard_table = KeyboardTable(gate_registry)
+# Пользователь: в среднем одна команда за MIN_INTERVAL_SECONDS, но серия
+# «Открыть → Остановить → Закрыть» проходит без ожидания
+user_rate_limiter = RateLimiter(
+    rate_from_interval(min_interval_seconds), RATE_USER_BURST
+)
+# Калитка: суммарный поток команд к устройству от всех жителей
+gate_rate_limiter = RateLimiter(RATE_GATE_PER_MINUTE / 60, RATE_GATE_BURST)
+pending_commands = PendingCommands()
+# Резервные сбросы калиток и таймауты подтверждения — в одной куче сроков
+timers = TimerScheduler()
+# Одно сообщение-статус на пользователя и калитку, новые состояния — правкой
+status_renderer = StatusRenderer(
+    timers, debounce=STATUS_DEBOUNCE, max_views=STATUS_MAX_VIEWS
+)
+# Заявки администратору: по одной, пока тихо, и сводками во время всплеска
+registration_digest = RegistrationDigest(
+    window=ADMIN_DIGEST_WINDOW,
+    max_items=ADMIN_DIGEST_MAX,
+    quiet_interval=ADMIN_DIGEST_QUIET,
+)
+# Подписчики на состояние калиток; рассылка не задерживает активного пользователя
+state_fanout = StateFanout(
+    STATE_FANOUT_CONCURRENCY,
+    observe=lambda lag: GATE_STAGE.observe(lag, stage="fanout"),
+)
+# Режим воркеров (WORKERS > 1): номер этого процесса и его число
+worker_index = 0
+worker_count = 1
+# Аренды калиток в access.db (воркеры или STANDBY=1) и аренда ведущего экземпляра
+gate_store: Optional[SQLiteGateStore] = None
+leader: Optional[LeaderLease] = None
 
 
-gate_state = {"current": "IDLE"}
+def owns_user(user_id) -> bool:
+    """Апдейты пользователя приходят в этот процесс (всегда True без воркеров)."""
+    return worker_for(user_id, worker_count) == worker_index
 
 
-def process_gate_status(data, context):
+async def dispatch_ticket(context, gate: Gate, ticket) -> bool:
+    """Команда билета; доступ и расписание проверяются заново — билет мог ждать долго."""
+    log(
+        f"[▶️] [{gate.id}] очередь: {ticket.command} для {ticket.user_id}"
+        f" (+{len(ticket.riders)} объединено)"
+    )
+    status_renderer.reset(ticket.user_id, gate.id)
+
+    decision = await get_access_decision(ticket.user_id)
+    denial = access_denial(decision)
+    if denial is None and not (decision.access_time and check_access_time(decision.access_time)):
+        denial = "🕒 Время доступа истекло."
+    if denial:
+        log(f"[BLOCKED] [{gate.id}] билет {ticket.user_id} отклонён при запуске: {denial}")
+        audit_log.record(ticket.user_id, gate.id, ticket.command, "denied", ticket.created_at)
+        show_gate_status(ticket.user_id, gate, denial, delay=0)
+        for rider_id, _ in ticket.riders:
+            show_gate_status(
+                rider_id, gate, "🚪 Запрос из очереди не выполнен — нажмите «Открыть» ещё раз."
+            )
+        async with gate.lock:
+            if gate.active_user_id == ticket.user_id:
+                await release_active(gate)
+        await release_gate(context, gate)
+        return False
+
+    show_gate_status(
+        ticket.user_id, gate, "🚪 Ваша очередь подошла — отправляем команду.", delay=0
+    )
+    return await execute_gate_command(
+        context,
+        gate,
+        ticket.user_id,
+        ticket.username,
+        ticket.command,
+        started_at=ticket.created_at,
+        queued=True,
+    )
+
+
+def process_gate_status(data, gate: Gate):
     try:
         status = data.get("status")
         user_id = str(data.get("user_id"))
-        context.bot_data["last_gate_status"] = {
+        gate.last_status = {
             "status": data["status"],
             "user_id": str(data["user_id"]),
             "timestamp": isoparse(data["timestamp"]),
         }
-        active_user = str(context.bot_data.get("active_user_id"))
-        if status == "IDLE" and user_id == active_user:
-            context.bot_data["active_user_id"] = None
-            log(f"[🧹] Активный пользователь {user_id} сброшен — статус IDLE")
+        if status == "IDLE" and user_id == str(gate.active_user_id):
+            clear_active(gate)
+            log(f"[🧹] Активный пользователь {user_id} [{gate.id}] сброшен — статус IDLE")
 
     except Exception as e:
         log(f"[❌] Ошибка обработки status от Arduino: {e}")
 
 
-pending_confirmations = set()
+def get_user_data(context, user_id: str) -> dict:
+    application = getattr(context, "application", context)
+    return application.user_data[int(user_id)]
 
 
-async def send_and_confirm_command(
-    command: str,
+async def execute_gate_command(
+    context,
+    gate: Gate,
     user_id: str,
     username: str,
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
+    command: str,
+    started_at: Optional[float] = None,
+    queued: bool = False,
 ) -> bool:
-    context.bot_data["active_user_id"] = str(user_id)
-    # log(f"[🆗] Назначен активный пользователь: {user_id}, username={username}")
-
-    timestamp_str = send_gate_command(command, user_id, username)
-    if not timestamp_str:
-        await update.message.reply_text("❌ Ошибка отправки команды.")
+    """Отправляет команду от имени активного пользователя и ждёт подтверждения.
+
+    queued=True — билет из очереди: при исчерпанном лимите калитки он ждёт
+    токен, а не отклоняется, иначе отказ опустошил бы всю очередь.
+    """
+    allowed, retry_after = gate_rate_limiter.try_acquire(gate.id)
+    while not allowed and queued:
+        await asyncio.sleep(retry_after)
+        allowed, retry_after = gate_rate_limiter.try_acquire(gate.id)
+    if not allowed:
+        log(f"❌ Лимит команд калитки [{gate.id}] исчерпан: user_id={user_id}")
+        user_rate_limiter.refund(user_id)
+        audit_log.record(user_id, gate.id, command, "rate_limited", started_at or time.monotonic())
+        await send_text(
+            context.bot, chat_id=int(user_id), text=rate_limit_text(retry_after), priority=PRIORITY_GATE
+        )
+        async with gate.lock:
+            if gate.active_user_id == user_id:
+                await release_active(gate)
+        await release_gate(context, gate)
         return False
 
-    context.user_data["last_command_timestamp"] = isoparse(timestamp_str)
-
-    success = await wait_for_arduino_confirmation(
-        context=context,
-        user_id=user_id,
-        update=update,
-        command_name=command,
+    # Запас к таймауту ожидания: запись удаляет сам ожидающий, expire — страховка
+    pending = pending_commands.register(
+        gate.id, user_id, command, timeout=ARDUINO_CONFIRM_TIMEOUT * 2
     )
+    pending.started_at = started_at or pending.created_at
+    outcome = "error"
+    if worker_count > 1:
+        # По request_id фронт вернёт статус устройства в этот процесс
+        await gate_store.add_command(pending.request_id, gate.id, user_id, command)
+    try:
+        with GATE_STAGE.time(stage="publish"):
+            timestamp_str = await send_gate_command(
+                gate, command, user_id, username, pending.request_id
+            )
+        pending.published_at = time.monotonic()
+        if not timestamp_str:
+            await send_text(
+                context.bot,
+                chat_id=int(user_id), text="❌ Ошибка отправки команды.",
+                priority=PRIORITY_GATE,
+            )
+            async with gate.lock:
+                if gate.active_user_id == user_id:
+                    await release_active(gate)
+            await release_gate(context, gate)
+            return False
 
-    if success:
-        context.user_data["last_gate_call"] = datetime.now()
+        outcome = "timeout"
+        user_data = get_user_data(context, user_id)
+        user_data["last_command_timestamp"] = isoparse(timestamp_str)
 
+        success = await wait_for_arduino_confirmation(
+            context=context,
+            gate=gate,
+            user_id=user_id,
+            command_name=command,
+            pending=pending,
+        )
+        if success:
+            outcome = "ok"
+    finally:
+        timers.cancel(("confirm", pending.request_id))
+        pending_commands.discard(pending.request_id)
+        if worker_count > 1:
+            await gate_store.remove_command(pending.request_id)
+        audit_log.record(
+            user_id,
+            gate.id,
+            command,
+            outcome,
+            pending.started_at,
+            pending.published_at,
+            pending.confirmed_at,
+            pending.request_id,
+        )
+
+    if success:
+        log(f"Команда {command} [{gate.id}] выполнена.")
     return success
 
 
 async def wait_for_arduino_confirmation(
     context,
+    gate: Gate,
     user_id: str,
-    update,
     command_name: str,
+    pending,
     timeout: int = ARDUINO_CONFIRM_TIMEOUT,
 ) -> bool:
-    await update.message.reply_text(
+    # Промежуточный статус: если устройство ответит быстрее STATUS_DEBOUNCE,
+    # вместо него сразу покажется ответ
+    show_gate_status(
+        user_id,
+        gate,
         "📤 Команда отправлена. Ожидаем подтверждение от калитки...",
-        disable_notification=True,
+        delay=STATUS_DEBOUNCE,
     )
-    # Создаём событие для ожидания
-    event = asyncio.Event()
-    context.bot_data["confirm_event"] = event
-    context.bot_data["last_command_user"] = str(user_id)
 
+    timers.schedule(
+        ("confirm", pending.request_id), timeout, pending_commands.timeout, pending.request_id
+    )
     try:
-        await asyncio.wait_for(event.wait(), timeout=timeout)
-        log(f"[✅] Arduino подтвердила команду '{command_name}' от user_id={user_id}")
+        await pending.future
+        log(
+            f"[✅] Arduino подтвердила команду '{command_name}' [{gate.id}] "
+            f"от user_id={user_id}, request_id={pending.request_id}"
+        )
         return True
 
     except asyncio.TimeoutError:
-        log(f"[⚠️] Таймаут ожидания ответа от Arduino на '{command_name}'")
+        CONFIRM_TIMEOUTS.inc(gate=gate.id)
+        log(
+            f"[⚠️] Таймаут ожидания ответа от Arduino на '{command_name}' [{gate.id}], "
+            f"request_id={pending.request_id}"
+        )
 
         # 🧹 Сброс состояния
-        context.bot_data["active_user_id"] = None
-        gate_state["current"] = "IDLE"
-        log(f"[🧹] Активный пользователь {user_id} сброшен, состояние → IDLE")
+        await release_active(gate)
+        gate.state = "IDLE"
+        log(f"[🧹] Активный пользователь {user_id} сброшен, [{gate.id}] → IDLE")
 
         # ♻️ Обновление UI
-        dynamic_buttons = get_dynamic_keyboard(context, user_id, force=True)
-        keyboard = get_main_menu("yes", dynamic_buttons)
-        if keyboard:
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text="⏳ Устройство не ответило. Возвращаем управление в исходное состояние.",
-                reply_markup=keyboard,
-                disable_notification=True,
-            )
-            log(f"[✅] Оповещение и меню отправлены для {user_id}")
+        show_gate_status(
+            user_id,
+            gate,
+            "⏳ Устройство не ответило. Возвращаем управление в исходное состояние.",
+            state="IDLE",
+        )
+        log(f"[✅] Оповещение о таймауте отправлено для {user_id}")
 
+        await release_gate(context, gate)
         return False
 
 
-def on_disconnect(client, userdata, rc, properties):
+def on_disconnect(client, userdata, flags, rc, properties):
     if rc != 0:
         log(f"[⚠️] MQTT отключился неожиданно (rc={rc}) — пытаемся переподключиться...")
         try:
@@ -312,158 +768,231 @@ def on_disconnect(client, userdata, rc, properties):
         log("[ℹ️] MQTT отключился по инициативе клиента (rc=0)")
 
 
-def get_dynamic_keyboard(context, user_id=None, force=False):
+def get_button_states(user_id=None) -> tuple:
+    """Состояния кнопок калиток для меню пользователя (в порядке реестра).
+
+    Кнопку, зависящую от состояния, видит только активный пользователь калитки,
+    остальным показывается «Открыть».
+    """
     user_id = str(user_id)
-    state = gate_state.get("current", "IDLE")
-    active_user = str(context.bot_data.get("active_user_id"))
-    # log(f"[📲] Кнопки запрошены: user_id={user_id}, active_user={active_user}")
+    return tuple(
+        gate.state if user_id == str(gate.active_user_id) else "IDLE"
+        for gate in gate_registry
+    )
 
-    # Только активному пользователю отображаем динамическую клавиатуру
-    if not force and user_id != active_user:
-        log(f"[🔒] Пользователь не является активным — кнопки не отображаются")
-        return None
 
-    if state == "IDLE":
-        # log("[🎛️] Отдаем кнопку: 🚪 Открыть (IDLE)")
-        return [["🚪 Открыть"]]
-    elif state == "OPENING":
-        # log("[🎛️] Отдаем кнопку: ⏹ Остановить")
-        return [["⏹ Остановить"]]
-    elif state == "STOPPED":
-        # log("[🎛️] Отдаем кнопку: 🔒 Закрыть")
-        return [["🔒 Закрыть"]]
-    elif state == "CLOSING":
-        # log("[🎛️] Отдаем кнопку: ⏹ Остановить")
-        return [["⏹ Остановить"]]
-    else:
-        # log("[🎛️] Неизвестное состояние — кнопки не отдаем")
+def parse_mqtt_message(msg) -> Optional[dict]:
+    payload_raw = msg.payload.decode()
+    log(f"[MQTT] 📥 Получено сообщение: topic={msg.topic}, payload={payload_raw}")
+
+    # Попытка распарсить JSON
+    try:
+        data = json.loads(payload_raw)
+    except json.JSONDecodeError as e:
+        log(f"[❌] Ошибка при разборе JSON payload: {e}")
         return None
+    if not isinstance(data, dict):
+        data = {"status": payload_raw}
+    return data
 
 
 def on_mqtt_message(client, userdata, msg, properties=None):
-    app = userdata["app"]
-    context = userdata["context"]
-    loop = app.bot_data.get("event_loop")
-
+    # Сетевой поток paho: только разбор и передача в event loop через мост
     try:
-        payload_raw = msg.payload.decode()
-        log(f"[MQTT] 📥 Получено сообщение: topic={msg.topic}, payload={payload_raw}")
+        data = parse_mqtt_message(msg)
+        if data is not None:
+            userdata["bridge"].submit(msg.topic, data)
+    except Exception as e:
+        log(f"[❌] Ошибка в on_mqtt_message: {e}")
 
-        # Попытка распарсить JSON
-        try:
-            data = json.loads(payload_raw)
-            payload = data.get("command") or data.get("status") or payload_raw
-        except json.JSONDecodeError as e:
-            log(f"[❌] Ошибка при разборе JSON payload: {e}")
-            return
 
-        log(f"[MQTT] Состояние: {payload}")
-
-        user_id = data.get("user_id")
-        username = data.get("username")
-        if context and "status" in data and "timestamp" in data and user_id:
-            process_gate_status(data, context)
-            event = context.bot_data.get("confirm_event")
-            expected_user = context.bot_data.get("last_command_user")
-
-            if (
-                event
-                and not event.is_set()
-                and str(data.get("user_id")) == str(expected_user)
-            ):
-                context.bot_data["last_gate_status"] = {
-                    "status": data["status"],
-                    "user_id": str(data["user_id"]),
-                    "timestamp": isoparse(data["timestamp"]),
-                }
-                event.set()
-
-        if user_id:
-            log(
-                f"[MQTT] Устройство прислало статус от user_id={user_id}, username={username}"
-            )
-        else:
-            log("[MQTT] Пользователь в payload не указан")
+def gate_id_for_topic(topic: str) -> Optional[str]:
+    gate = gate_registry.for_topic(topic)
+    return gate.id if gate else None
 
-        # Обновление текущего состояния
-        gate_state["current"] = payload
 
-        # Формируем клавиатуру
-        if payload == "IDLE":
+async def handle_gate_event(app, context, topic: str, data: dict, owner: bool = True):
+    """Обработка статуса устройства; выполняется на event loop потребителем моста.
 
-            async def reset_active_user():
-                async with active_user_lock:
-                    context.bot_data["active_user_id"] = context.bot_data.get(
-                        "active_user_id"
-                    )
-                    context.bot_data["active_user_id"] = None
-                    context.bot_data["active_user_since"] = None
-                    log("[🔁] Сброс активного пользователя (IDLE)")
-                    log("[🔁] Калитка перешла в режим ожидания")
-
-            keyboard = get_main_menu(status="yes", dynamic_buttons=None)
-            text = "🔒"
-
-            future = asyncio.run_coroutine_threadsafe(
-                app.bot.send_message(
-                    chat_id=int(user_id),
-                    text=text,
-                    reply_markup=keyboard,
-                    disable_notification=True,  # 🔕 бесшумно
-                ),
-                loop,
-            )
-            future.result(timeout=10)
-            log(f"[✅] Замочек и меню отправлены для {user_id}, username={username}")
-            return
-        else:
-            # Обновляем last_active_user_id
-            async def update_last_active():
-                async with active_user_lock:
-                    context.bot_data["active_user_id"] = user_id
-
-            dynamic_buttons = get_dynamic_keyboard(context, user_id=user_id)
-            keyboard = get_main_menu("yes", dynamic_buttons)
-
-            text = {
-                "OPENING": "🔓 Калитка начала открываться",
-                "CLOSING": "🔒 Калитка начала закрываться",
-                "STOPPED": "⏹ Калитка остановлена",
-            }.get(payload)
-
-            if not text:
-                return  # ничего не отправлять
-
-        future = asyncio.run_coroutine_threadsafe(
-            app.bot.send_message(
-                chat_id=user_id,
-                text=text,
-                reply_markup=keyboard,
-                disable_notification=False,
-            ),
-            loop,
+    owner=False (режим воркеров) — команду отправил другой процесс: здесь только
+    состояние калитки, свои подписчики и своя очередь.
+    """
+    gate = gate_registry.for_topic(topic)
+    if gate is None:
+        log(f"[MQTT] Статус от неизвестной калитки пропущен: topic={topic}")
+        return
+
+    payload = data.get("status") or data.get("command")
+    if not payload:
+        log(f"[MQTT] Сообщение без command/status пропущено: topic={topic}")
+        return
+
+    # Повторы, запоздавшие события и эхо команд — до любых изменений и сообщений.
+    # В режиме воркеров их уже отсеял фронт
+    event = DeviceEvent.from_payload(payload, data)
+    reason = gate.machine.accept(gate.state, event) if worker_count == 1 else None
+    if reason:
+        GATE_EVENTS_DROPPED.inc(gate=gate.id, reason=reason)
+        log(
+            f"[MQTT] Событие {payload} [{gate.id}] отброшено ({reason}): "
+            f"{gate.machine.device_state or gate.state} → {event.status}, request_id={event.request_id}"
         )
-        future.result(timeout=10)
+        return
+    payload = event.status
+    if worker_count == 1 and gate_store is not None:
+        # В режиме воркеров состояние и IDLE записывает фронт
+        await gate_store.event(gate.id, payload, data.get("user_id"))
+    log(f"[MQTT] Состояние [{gate.id}]: {payload}")
+
+    user_id = data.get("user_id")
+    username = data.get("username")
+    matched = None
+    if owner and "status" in data and "timestamp" in data and user_id:
+        process_gate_status(data, gate)
+
+        request_id = data.get("request_id")
+        if request_id:
+            matched = pending_commands.resolve(str(request_id), data)
+        else:
+            matched = pending_commands.resolve_legacy(gate.id, str(user_id), data)
+        if matched:
+            if matched.published_at:
+                GATE_STAGE.observe(
+                    time.monotonic() - matched.published_at, stage="device"
+                )
+            log(
+                f"[🔗] Статус {payload} [{gate.id}] сопоставлен с request_id={matched.request_id}"
+            )
+
+    if user_id:
         log(
-            f"[✅] Сообщение отправлено Telegram пользователю {user_id}, username={username}"
+            f"[MQTT] Устройство [{gate.id}] прислало статус от user_id={user_id}, username={username}"
         )
+    else:
+        log(f"[MQTT] Пользователь в payload не указан [{gate.id}]")
 
-    except Exception as e:
-        log(f"[❌] Ошибка в on_mqtt_message: {e}")
+    # Обновление текущего состояния
+    previous_state = gate.state
+    gate.state = payload
+    try:
+        if owner:
+            await notify_gate_event(app, context, gate, payload, user_id, username, matched)
+        elif payload == "IDLE":
+            await release_gate(context, gate)
+    finally:
+        # Подписчикам — после ответа активному пользователю
+        if payload != previous_state and payload in STATE_UPDATE_TEXTS:
+            state_fanout.publish(gate.id, payload, exclude=(str(user_id),) if user_id else ())
 
 
-def init_mqtt(application, context):
-    context.bot_data["active_user_id"] = None
-    client_id = f"client_{random.randint(1, 100000)}"
-    client = mqtt.Client(
-        client_id=client_id,
-        protocol=mqtt.MQTTv5,
-        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+async def notify_gate_event(app, context, gate: Gate, payload, user_id, username, matched):
+    """Статус пользователю, от имени которого пришло событие."""
+    if not user_id:
+        if payload == "IDLE":
+            await release_gate(context, gate)
+        return
+
+    if payload == "IDLE":
+        log(f"[🔁] Калитка [{gate.id}] перешла в режим ожидания")
+        show_gate_status(user_id, gate, "🔒 Калитка закрыта", state="IDLE")
+        log(f"[✅] Статус IDLE показан {user_id}, username={username}")
+        await release_gate(context, gate)
+        return
+
+    text = {
+        "OPENING": "🔓 Калитка начала открываться",
+        "CLOSING": "🔒 Калитка начала закрываться",
+        "STOPPED": "⏹ Калитка остановлена",
+    }.get(payload)
+
+    if not text:
+        return  # ничего не отправлять
+
+    # Кнопка по состоянию — только у активного пользователя калитки
+    state = payload if str(user_id) == str(gate.active_user_id) else "IDLE"
+    with GATE_STAGE.time(stage="send_message"):
+        await show_gate_status(user_id, gate, text, state=state)
+    if matched and matched.started_at:
+        GATE_STAGE.observe(time.monotonic() - matched.started_at, stage="end_to_end")
+    log(
+        f"[✅] Статус показан пользователю {user_id}, username={username}"
+    )
+
+
+STATE_UPDATE_TEXTS = {
+    "OPENING": "📡 Калитка открывается",
+    "CLOSING": "📡 Калитка закрывается",
+    "STOPPED": "📡 Калитка остановлена",
+    "IDLE": "📡 Калитка свободна",
+}
+
+
+async def send_state_update(app, user_id: str, gate_id: str, state: str):
+    """Статус подписчику; вызывается воркерами state_fanout.
+
+    Не ждёт отправки: частые смены состояния схлопываются в одну правку.
+    """
+    gate = gate_registry.get(gate_id)
+    if gate is None:
+        return
+    show_gate_status(
+        user_id,
+        gate,
+        STATE_UPDATE_TEXTS[state],
+        state="IDLE",
+        delay=STATUS_DEBOUNCE,
+        priority=PRIORITY_BULK,
     )
+
+
+async def on_status_error(chat_id: int, gate_id: str, error: Exception):
+    if isinstance(error, Forbidden):
+        # Бот заблокирован — подписка больше не нужна
+        if state_fanout.unsubscribe(str(chat_id)):
+            await remove_subscription(str(chat_id))
+            log(f"[🔕] {chat_id} заблокировал бота — подписка снята")
+        return
+    log(f"[❌] Статус [{gate_id}] для {chat_id} не показан: {type(error).__name__} — {error}")
+
+
+mqtt_publisher: Optional[MqttPublisher] = None
+mqtt_bridge: Optional[MqttBridge] = None
+
+
+def on_connect(client, userdata, flags, reason_code, properties):
+    if reason_code.is_failure:
+        log(f"[❌] MQTT отказ в подключении: {reason_code}")
+        return
+    if worker_count > 1:
+        return  # воркер только публикует, статусы принимает фронт
+    # Подписка в on_connect восстанавливается после каждого переподключения
+    for topic in gate_registry.subscriptions():
+        client.subscribe(topic)
+        log(f"[MQTT] ✅ Подписка на {topic} выполнена")
+
+
+def init_mqtt(application, context, client=None):
+    """Подключает MQTT; client можно передать готовый (например, в бенчмарке)."""
+    global mqtt_publisher, mqtt_bridge
+
+    client_id = f"client_{random.randint(1, 100000)}"
+    if client is None:
+        client = mqtt.Client(
+            client_id=client_id,
+            protocol=mqtt.MQTTv5,
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        )
     client.username_pw_set(username=MQTT_USER, password=MQTT_PASS)
-    client.user_data_set({"app": application, "context": context})
+    mqtt_bridge = MqttBridge(
+        partial(handle_gate_event, application, context), key=gate_id_for_topic
+    )
+    mqtt_bridge.start()
+    state_fanout.start(partial(send_state_update, application))
+    client.user_data_set({"app": application, "context": context, "bridge": mqtt_bridge})
+    client.on_connect = on_connect
     client.on_message = on_mqtt_message
     client.on_disconnect = on_disconnect
+    mqtt_publisher = MqttPublisher(client)
 
     try:
         client.connect(HOST, port=1883, keepalive=60)
@@ -471,138 +1000,78 @@ def init_mqtt(application, context):
         log(f"[❌] Ошибка MQTT подключения: {e}")
         return
 
-    client.subscribe("gate/status")
-    log(f"[MQTT] Подписка вызвана (в init_mqtt) → client_id={client_id}")
-    log("[MQTT] ✅ Подписка на gate/status выполнена")
+    log(f"[MQTT] Подключение (в init_mqtt) → client_id={client_id}")
     client.loop_start()
 
 
-def send_gate_command(command: str, user_id: str, username: str) -> Optional[str]:
+async def send_gate_command(
+    gate: Gate, command: str, user_id: str, username: str, request_id: str
+) -> Optional[str]:
     if not MQTT_USER or not MQTT_PASS:
         log("❌ MQTT переменные окружения не заданы.")
         return False
+    if mqtt_publisher is None:
+        log("❌ MQTT клиент не инициализирован.")
+        return False
 
     payload = {
         "command": command,
+        "gate": gate.id,
+        "request_id": request_id,
         "user_id": user_id,
         "username": username,
         # "timestamp": datetime.now(timezone.utc).isoformat()
         "timestamp": datetime.now(moscow).isoformat(),
     }
+    if gate_store is not None:
+        # Ограждение: команда уходит, только пока аренда калитки наша
+        if await gate_store.renew(gate.id) is False:
+            GATE_LEASES_LOST.inc(gate=gate.id)
+            log(f"[⛔] Аренда калитки [{gate.id}] потеряна — {command} от {user_id} не отправлена")
+            return False
+        fence = gate_store.fence(gate.id)
+        if fence is not None:
+            payload["fence"] = fence
 
     try:
-        publish.single(
-            topic="gate/command",
-            payload=json.dumps(payload),
-            hostname=HOST,
-            port=1883,
-            auth={"username": MQTT_USER, "password": MQTT_PASS},
-            qos=0,  # “Fire and forget” Не получит и не восстановится
-            retain=False,  # Не сохранит последнее сообщение по теме не передаёт его после переподключения
+        # QoS 0 — “Fire and forget”; QoS 1 — ждём PUBACK от брокера.
+        # retain=False: брокер не передаст команду после переподключения
+        puback_latency = await mqtt_publisher.publish(
+            gate.command_topic, json.dumps(payload), qos=MQTT_COMMAND_QOS
         )
-        log(f"[📤] MQTT: отправлено {payload}")
+        if puback_latency is not None:
+            log(f"[📤] MQTT: отправлено {payload}, PUBACK за {puback_latency * 1000:.1f} мс")
+        else:
+            log(f"[📤] MQTT: отправлено {payload}")
         return payload["timestamp"]
-    except Exception as e:
+    except PublishError as e:
         print(f"[❌] MQTT ошибка: {e}")
         return False
 
 
 def check_access_time(access_time_str: str) -> bool:
-    tz = pytz.timezone("Europe/Moscow")
-    now = datetime.now(tz)
-    current_day = now.strftime("%a").lower()  # например, 'mon'
-    current_time = now.time()
-
-    if access_time_str.strip().lower() == "always":
-        return True
-
-    try:
-        days_part, time_range = access_time_str.strip().split()
-        start_str, end_str = time_range.split("-")
-        start_time = datetime.strptime(start_str, "%H:%M").time()
-        end_time = datetime.strptime(end_str, "%H:%M").time()
-
-        # Расширяем дни: 'mon-fri', 'sat', 'sun' и т.п.
-        day_map = {
-            "mon": 0,
-            "tue": 1,
-            "wed": 2,
-            "thu": 3,
-            "fri": 4,
-            "sat": 5,
-            "sun": 6,
-            "weekdays": (0, 1, 2, 3, 4),
-            "weekends": (5, 6),
-        }
-
-        allowed_days = set()
-        for part in days_part.split(","):
-            part = part.strip().lower()
-            if part in ("weekdays", "weekends"):
-                allowed_days.update(day_map[part])
-            elif "-" in part:
-                start_day, end_day = part.split("-")
-                start_idx = day_map[start_day]
-                end_idx = day_map[end_day]
-                for i in range(start_idx, end_idx + 1):
-                    allowed_days.add(i)
-            elif part in day_map:
-                allowed_days.add(day_map[part])
-
-        today_idx = now.weekday()
-
-        if today_idx in allowed_days:
-            if start_time <= current_time <= end_time:
-                return True
-    except Exception as e:
-        log(f"[⚠️] Ошибка в access_time: {e}")
-
-    return False
-
-
-def normalize_phone(phone):
-    return re.sub(r"\D", "", str(phone))[-10:] if phone else ""
-
-
-def get_user_status(user_id: str) -> str:
-    return get_user_aprove_status(user_id) or "none"
+    schedule = get_schedule(access_time_str)
+    if schedule is None:
+        log(f"[⚠️] Некорректное расписание access_time: {access_time_str!r}")
+        return False
+    return schedule.allows(datetime.now(moscow))
 
 
-def get_main_menu(status: str = "none", dynamic_buttons=None):
-    keyboard = []
+async def get_user_status(user_id: str) -> str:
+    return await get_user_aprove_status(user_id) or "none"
 
-    if status == "yes":
-        if dynamic_buttons is not None and len(dynamic_buttons) > 0:
-            keyboard.append(dynamic_buttons[0])
-        else:
-            keyboard.append(["🚪 Открыть"])  # fallback только на открытие
 
-        keyboard.append(["🔁 Изменить номер"])
-        keyboard.append(["ℹ️ Помощь", "🏁 Начало"])
+def get_main_menu(status: str = "none", states: Optional[tuple] = None):
+    """Готовая клавиатура из таблицы keyboards; states — из get_button_states."""
+    return keyboard_table.get(status, states)
 
-    elif status == "no":
-        keyboard = [["🔄 Проверить статус", "ℹ️ Помощь", "🏁 Начало"]]
 
-    elif status == "pending":
-        keyboard = [["🔄 Проверить статус", "🔁 Изменить номер", "ℹ️ Помощь", "🏁 Начало"]]
-
-    else:
-        keyboard = [
-            ["📋 Зарегистрироваться"],
-            ["🔄 Проверить статус", "ℹ️ Помощь", "🏁 Начало"],
-        ]
-
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-
-async def safe_reply(message, text, retries=3, delay=2, **kwargs):
-    for attempt in range(retries):
-        try:
-            return await message.reply_text(text, **kwargs)
-        except NetworkError as e:
-            log(f"[⚠️] NetworkError ({attempt+1}/{retries}): {type(e).__name__} — {e}")
-            await asyncio.sleep(delay)
-    log("[❌] Не удалось отправить сообщение после повторов.")
+async def safe_reply(message, text, **kwargs):
+    """Ответ без исключения наружу; повторы при сетевых ошибках делает outbox."""
+    try:
+        return await reply(message, text, **kwargs)
+    except TelegramError as e:
+        log(f"[❌] Не удалось отправить сообщение: {type(e).__name__} — {e}")
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -615,7 +1084,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     log(f"[🔄] Пользователь активен (start): {user_id}")
 
-    status = get_user_aprove_status(user_id) or "none"
+    status = await get_user_aprove_status(user_id) or "none"
     context.user_data["access_status"] = status
 
     msg = update.message or (update.callback_query and update.callback_query.message)
@@ -624,7 +1093,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         log("⚠️ Нет сообщения, куда можно отправить reply_text.")
         return
 
-    await msg.reply_text(
+    await reply(
+        msg,
         f"👋 Привет, {user.first_name or username}!", reply_markup=get_main_menu(status)
     )
     # log("📲 Старт: выход из ConversationHandler")
@@ -640,7 +1110,7 @@ async def handle_start_button(update, context):
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await safe_reply(
         update.message,
-        "ℹ️ Доступные команды:\n/start — начать\n📋 Зарегистрироваться\n🔁 Изменить номер\n🔄 Проверить статус\nℹ️ Помощь — информация об администраторе",
+        "ℹ️ Доступные команды:\n/start — начать\n📋 Зарегистрироваться\n🔁 Изменить номер\n🔄 Проверить статус\nℹ️ Помощь — информация об администраторе\n/subscribe — следить за состоянием калитки\n/unsubscribe — отключить уведомления",
     )
 
 
@@ -652,17 +1122,11 @@ async def help_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Получаем текущий статус пользователя
-    status = get_user_status(user_id)
-
-    # Проверяем, активен ли пользователь по статусу И назначен ли он last_active
-    active_user = str(context.bot_data.get("active_user_id"))
-    is_active = status == "yes" and user_id == active_user
+    status = await get_user_status(user_id)
 
-    # Формируем клавиатуру
-    dynamic_buttons = (
-        get_dynamic_keyboard(context, user_id=user_id) if is_active else None
-    )
-    keyboard = get_main_menu(status=status, dynamic_buttons=dynamic_buttons)
+    # Формируем клавиатуру: кнопки состояния видит только активный пользователь
+    states = get_button_states(user_id) if status == "yes" else None
+    keyboard = get_main_menu(status=status, states=states)
 
     await safe_reply(
         update.message or update.callback_query.message,
@@ -673,7 +1137,8 @@ async def help_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
-    await update.message.reply_text(
+    await reply(
+        update.message,
         "Введите вашу Фамилию и Имя:",
         reply_markup=ReplyKeyboardRemove(),  # ⬅️ Скрываем клавиатуру
     )
@@ -682,23 +1147,19 @@ async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def ask_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["fio"] = update.message.text.strip()
-    button = KeyboardButton("📱 Отправить номер", request_contact=True)
-    keyboard = ReplyKeyboardMarkup(
-        [[button], ["🏁 Начало"]], resize_keyboard=True, one_time_keyboard=True
-    )
     await safe_reply(
-        update.message, "Теперь отправьте номер телефона:", reply_markup=keyboard
+        update.message,
+        "Теперь отправьте номер телефона:",
+        reply_markup=CONTACT_KEYBOARD,
     )
     return ASK_PHONE
 
 
 async def change_phone_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["change_mode"] = True
-    button = KeyboardButton("📱 Отправить новый номер", request_contact=True)
-    keyboard = ReplyKeyboardMarkup(
-        [[button], ["🏁 Начало"]], resize_keyboard=True, one_time_keyboard=True
+    await safe_reply(
+        update.message, "⬇️ Отправьте новый номер:", reply_markup=NEW_CONTACT_KEYBOARD
     )
-    await safe_reply(update.message, "⬇️ Отправьте новый номер:", reply_markup=keyboard)
     return ASK_PHONE
 
 
@@ -728,10 +1189,10 @@ async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # === Смена номера ===
     if context.user_data.get("change_mode"):
-        result = update_user_phone(user_id, phone)
+        result = await update_user_phone(user_id, phone)
         if result == "same":
             log(f"[🔁] {user_id} отправил тот же номер ({phone}), статус не изменён")
-            status = get_user_aprove_status(user_id)
+            status = await get_user_aprove_status(user_id)
             await safe_reply(
                 update.message,
                 "ℹ️ Вы отправили тот же номер. Изменений не внесено.",
@@ -741,7 +1202,11 @@ async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         elif result == "updated":
             log(f"[🔁] {user_id} сменил номер на {phone}, статус сброшен")
-            status = get_user_aprove_status(user_id)
+            record = await get_user_record(user_id) or {}
+            notify_admin_about_request(
+                user_id, record.get("fio") or "", username, phone, kind="phone"
+            )
+            status = await get_user_aprove_status(user_id)
             await safe_reply(
                 update.message,
                 "✅ Номер успешно обновлён! Заявка отправлена повторно, ожидайте одобрения.",
@@ -756,7 +1221,7 @@ async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ConversationHandler.END
 
     # === Новая регистрация ===
-    status = get_user_aprove_status(user_id)
+    status = await get_user_aprove_status(user_id)
     if status:
         log(f"[ℹ️] Повторная попытка — уже зарегистрирован: {user_id}, phone: {phone}")
         await safe_reply(
@@ -770,7 +1235,7 @@ async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     telegram_link = f"https://t.me/{username}" if username else ""
 
-    insert_new_user(
+    await insert_new_user(
         user_id=user_id,
         username=username,
         fio=fio,
@@ -784,29 +1249,8 @@ async def ask_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log(f"[📋] Новая заявка от {user_id}: {fio}, {phone}")
     context.user_data["is_registering"] = False
 
-    # 👇 Отправка админу
-    admin_chat_id = int(os.getenv("ADMIN_CHAT_ID"))
-    keyboard = InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton(
-                    "✅ Подтвердить", callback_data=f"approve:{user_id}"
-                ),
-                InlineKeyboardButton("❌ Отклонить", callback_data=f"reject:{user_id}"),
-                InlineKeyboardButton("🕓 Оставить в ожидании", callback_data="pending"),
-            ]
-        ]
-    )
-
-    await context.bot.send_message(
-        chat_id=admin_chat_id,
-        text=(
-            f"👤 Пользователь *{fio}* (`{user_id}`) просит доступ\n"
-            f"🔗 [Профиль](https://t.me/{username})"
-        ),
-        reply_markup=keyboard,
-        parse_mode="Markdown",
-    )
+    # 👇 Отправка админу (сразу или в сводке)
+    notify_admin_about_request(user_id, fio, username, phone)
 
     # ✅ Ответ пользователю
     await safe_reply(
@@ -822,7 +1266,7 @@ async def check_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(user.id)
     username = user.username or "unknown"
 
-    status = get_user_aprove_status(user_id)
+    status = await get_user_aprove_status(user_id)
 
     if status == "yes":
         log(f"[✅] Доступ разрешён — user_id: {user_id}")
@@ -865,11 +1309,112 @@ async def unknown_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def my_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    await update.message.reply_text(
+    await reply(
+        update.message,
         f"Ваш `chat_id`: `{chat_id}`", parse_mode="Markdown"
     )
 
 
+def describe_gate_state(gate: Gate) -> str:
+    text = STATE_UPDATE_TEXTS.get(gate.state, STATE_UPDATE_TEXTS["IDLE"])
+    return f"{text} ({gate.name})" if len(gate_registry) > 1 else text
+
+
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/subscribe [калитка] — присылать изменения состояния калитки (или всех)."""
+    user_id = str(update.effective_user.id)
+    decision = await get_access_decision(user_id)
+    if decision.status not in ("yes", ""):
+        await safe_reply(update.message, "🚫 Подписка доступна только одобренным жителям.")
+        return
+
+    if context.args:
+        gate = gate_registry.get(context.args[0])
+        if gate is None:
+            known = ", ".join(g.id for g in gate_registry)
+            await safe_reply(update.message, f"❓ Нет такой калитки. Доступны: {known}")
+            return
+        gates = [gate]
+    else:
+        gates = list(gate_registry)
+
+    for gate in gates:
+        if state_fanout.subscribe(user_id, gate.id):
+            await add_subscription(user_id, gate.id)
+    log(f"[🔔] {user_id} подписался на {', '.join(g.id for g in gates)}")
+    current = "\n".join(describe_gate_state(gate) for gate in gates)
+    await safe_reply(
+        update.message,
+        "🔔 Буду присылать изменения состояния. Отписаться — /unsubscribe\n\n" + current,
+    )
+
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    state_fanout.unsubscribe(user_id)
+    await remove_subscription(user_id)
+    log(f"[🔕] {user_id} отписался от состояния калиток")
+    await safe_reply(update.message, "🔕 Уведомления о состоянии калитки отключены.")
+
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast текст — рассылка всем одобренным жителям (только администратор)."""
+    if not is_admin_chat(update):
+        return
+    text = update.message.text.partition(" ")[2].strip()
+    if not text:
+        await safe_reply(update.message, "✍️ Использование: /broadcast текст сообщения")
+        return
+
+    user_ids = await get_approved_user_ids()
+    futures = [
+        outbox.submit(
+            int(user_id), partial(context.bot.send_message, chat_id=int(user_id), text=text), PRIORITY_BULK
+        )
+        for user_id in user_ids
+    ]
+    log(f"[📣] Рассылка поставлена в очередь: {len(futures)} получателей")
+    admin_chat_id = update.effective_chat.id
+    await safe_reply(update.message, f"📣 Рассылка поставлена в очередь: {len(futures)} получателей.")
+    asyncio.create_task(report_broadcast(context.bot, admin_chat_id, futures))
+
+
+async def events_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/events [user_id] — последние команды калитки из журнала (только администратор)."""
+    if not is_admin_chat(update):
+        return
+    user_id = context.args[0] if context.args else None
+    events = await get_access_events(user_id=user_id, limit=20)
+    if not events:
+        await safe_reply(update.message, "📭 Событий нет.")
+        return
+
+    lines = []
+    for event in events:
+        when = datetime.fromtimestamp(event["requested_at"], moscow).strftime("%d.%m %H:%M:%S")
+        line = f"{when} {event['gate_id']} {event['command']} → {event['outcome']}"
+        if event["confirmed_at"]:
+            line += f" ({event['confirmed_at'] - event['requested_at']:.1f} с)"
+        if user_id is None:
+            line += f" · {event['user_id']}"
+        lines.append(line)
+    await safe_reply(update.message, "🗂 Последние команды:\n" + "\n".join(lines))
+
+
+async def report_broadcast(bot, admin_chat_id: int, futures):
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    failed = [r for r in results if isinstance(r, BaseException)]
+    blocked = sum(isinstance(r, Forbidden) for r in failed)
+    text = f"📣 Рассылка завершена: доставлено {len(results) - len(failed)}, ошибок {len(failed)}"
+    if blocked:
+        text += f" (заблокировали бота: {blocked})"
+    log(f"[📣] {text}")
+    try:
+        await send_text(bot, chat_id=admin_chat_id, text=text, priority=PRIORITY_NOTICE)
+    except TelegramError as e:
+        log(f"[❌] Отчёт о рассылке не отправлен: {e}")
+
+
 async def open_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await handle_gate_command("OPEN", update, context)
 
@@ -878,8 +1423,6 @@ async def stop_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     success = await handle_gate_command("STOP", update, context)
     if success:
-        dynamic_buttons = get_dynamic_keyboard(context, user_id=user_id)
-        keyboard = get_main_menu("yes", dynamic_buttons)
         log(
             f"[🟥] Команда STOP завершена для user_id={user_id}, username={update.effective_user.username}"
         )
@@ -893,8 +1436,6 @@ async def close_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     success = await handle_gate_command("CLOSE", update, context)
     user_id = str(update.effective_user.id)
     if success:
-        dynamic_buttons = get_dynamic_keyboard(context, user_id=user_id)
-        keyboard = get_main_menu("yes", dynamic_buttons)
         log(
             f"Команда CLOSE завершена для user_id={user_id}, username={update.effective_user.username}"
         )
@@ -904,34 +1445,193 @@ async def close_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-async def notify_admin_about_request(
-    user_id: str, fio: str, username: str, context: ContextTypes.DEFAULT_TYPE
+def notify_admin_about_request(
+    user_id: str, fio: str, username: str, phone: str = "", kind: str = "new"
 ):
-    admin_chat_id = int(os.getenv("ADMIN_CHAT_ID", "YOUR_CHAT_ID"))
-
-    link = f"https://t.me/{username}" if username else "нет ссылки"
-    text = (
-        f"📩 Новый запрос на доступ:\n\n"
-        f"👤 ФИО: {fio}\n"
-        f"🆔 user_id: {user_id}\n"
-        f"🔗 Профиль: {link}\n\n"
-        f"🕒 Статус: ⏳ Ожидание решения"
-    )
+    """Заявка уходит администратору через registration_digest; не ждёт отправки."""
+    registration_digest.add(RegistrationRequest(str(user_id), fio, username, phone, kind))
+
 
+async def send_registration_requests(bot, batch):
+    admin_chat_id = int(os.getenv("ADMIN_CHAT_ID"))
+    if len(batch) > 1:
+        text, keyboard = digest_message(batch)
+        log(f"[📩] Сводка заявок администратору: {len(batch)}")
+        await send_text(
+            bot, chat_id=admin_chat_id, text=text, reply_markup=keyboard, priority=PRIORITY_NOTICE
+        )
+        return
+
+    request = batch[0]
     keyboard = InlineKeyboardMarkup(
         [
             [
                 InlineKeyboardButton(
-                    "✅ Подтвердить", callback_data=f"approve:{user_id}"
+                    "✅ Подтвердить", callback_data=f"approve:{request.user_id}"
                 ),
-                InlineKeyboardButton("❌ Отклонить", callback_data=f"reject:{user_id}"),
+                InlineKeyboardButton("❌ Отклонить", callback_data=f"reject:{request.user_id}"),
+                InlineKeyboardButton("🕓 Оставить в ожидании", callback_data="pending"),
             ]
         ]
     )
+    action = "сменил номер и снова просит доступ" if request.kind == "phone" else "просит доступ"
+    await send_text(
+        bot,
+        chat_id=admin_chat_id,
+        text=(
+            f"👤 Пользователь *{request.fio}* (`{request.user_id}`) {action}\n"
+            f"🔗 [Профиль](https://t.me/{request.username})"
+        ),
+        reply_markup=keyboard,
+        parse_mode="Markdown",
+        priority=PRIORITY_NOTICE,
+    )
+
+
+APPROVAL_TEXT = "✅ Ваша заявка одобрена! Доступ открыт. Добро пожаловать!"
+APPROVAL_HELP_TEXT = (
+    "ℹ️ Как работает ворота:\n\n"
+    "– Нажмите «Открыть», чтобы начать движение.\n"
+    "– Ворота автоматически дойдёт до конца, затем закроется.\n"
+    "– Кнопка «Остановить» нужна только если хотите прервать движение.\n"
+    "– После остановки появляется кнопка «Закрыть» — она работает как «Открыть в обратную сторону».\n\n"
+    "⚠️ Иногда кнопки могут не совпадать с реальным состоянием калитки — это нормально."
+    "После завершения движения бот сам обновит состояние и покажет «замочек», когда ворота вернётся в режим ожидания.\n\n"
+    "Если вы видите кнопку «Открыть» — всё готово 👍"
+)
+
+
+def queue_approval_messages(bot, user_id: str):
+    """Ставит уведомления об одобрении в outbox, не дожидаясь отправки."""
+    chat_id = int(user_id)
+    for kwargs in (
+        {"text": APPROVAL_TEXT, "reply_markup": get_main_menu("yes")},
+        {"text": APPROVAL_HELP_TEXT},
+    ):
+        future = outbox.submit(
+            chat_id, partial(bot.send_message, chat_id=chat_id, **kwargs), PRIORITY_NOTICE
+        )
+        future.add_done_callback(_log_notice_failure)
+
 
-    await context.bot.send_message(
-        chat_id=admin_chat_id, text=text, reply_markup=keyboard, parse_mode="HTML"
+def _log_notice_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        log(f"[❌] Уведомление не доставлено: {future.exception()}")
+
+
+def is_admin_chat(update: Update) -> bool:
+    return update.effective_chat.id == int(os.getenv("ADMIN_CHAT_ID", "0"))
+
+
+async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/pending — заявки в ожидании постранично, с выбором нескольких."""
+    if not is_admin_chat(update):
+        return
+    state = context.user_data["pending_view"] = {"pages": [""], "selected": set()}
+    text, keyboard = await render_pending_page(state)
+    await safe_reply(update.message, text, reply_markup=keyboard)
+
+
+async def render_pending_page(state: dict, note: str = ""):
+    """Текст и клавиатура текущей страницы; state — context.user_data["pending_view"]."""
+    after = state["pages"][-1]
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = await get_users_by_status("pending", after, PENDING_PAGE_SIZE + 1)
+    has_next = len(rows) > PENDING_PAGE_SIZE
+    rows = rows[:PENDING_PAGE_SIZE]
+    state["page_ids"] = [row["user_id"] for row in rows]
+    total = await count_users_by_status("pending")
+    selected = state["selected"]
+
+    lines = [f"🗂 Заявки в ожидании: {total}. Выбрано: {len(selected)}."]
+    if note:
+        lines.insert(0, note)
+    buttons = []
+    for row in rows:
+        mark = "☑️" if row["user_id"] in selected else "⬜"
+        name = row["fio"] or row["username"] or row["user_id"]
+        contact = f"@{row['username']}" if row["username"] else row["user_id"]
+        lines.append(f"{mark} {name} — {contact}, {row['phone'] or 'без телефона'}")
+        buttons.append(
+            [InlineKeyboardButton(f"{mark} {name}"[:60], callback_data=f"pend:t:{row['user_id']}")]
+        )
+    if not rows:
+        lines.append("📭 На этой странице заявок нет.")
+
+    nav = []
+    if len(state["pages"]) > 1:
+        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data="pend:prev"))
+    if has_next:
+        nav.append(InlineKeyboardButton("➡️ Далее", callback_data="pend:next"))
+    if nav:
+        buttons.append(nav)
+    buttons.append(
+        [
+            InlineKeyboardButton("☑️ Все на странице", callback_data="pend:all"),
+            InlineKeyboardButton("⬜ Снять выбор", callback_data="pend:clear"),
+        ]
     )
+    if selected:
+        buttons.append(
+            [
+                InlineKeyboardButton(f"✅ Одобрить ({len(selected)})", callback_data="pend:yes"),
+                InlineKeyboardButton(f"❌ Отклонить ({len(selected)})", callback_data="pend:no"),
+            ]
+        )
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
+
+
+async def handle_pending_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not is_admin_chat(update):
+        await query.answer()
+        return
+    state = context.user_data.get("pending_view")
+    if state is None:
+        await query.answer("Список устарел — откройте /pending заново.")
+        return
+
+    action = query.data.split(":", 2)[1:]
+    selected = state["selected"]
+    note = ""
+    if action[0] == "t":
+        selected.symmetric_difference_update({action[1]})
+    elif action[0] == "all":
+        selected.update(state.get("page_ids", ()))
+    elif action[0] == "clear":
+        selected.clear()
+    elif action[0] == "next" and state.get("page_ids"):
+        state["pages"].append(state["page_ids"][-1])
+    elif action[0] == "prev" and len(state["pages"]) > 1:
+        state["pages"].pop()
+    elif action[0] in ("yes", "no") and selected:
+        status = action[0]
+        decided = await decide_pending(sorted(selected), status)
+        if decided is None:
+            await query.answer("❌ Ошибка при сохранении в базе.", show_alert=True)
+            return
+        for row in decided:
+            if status == "yes":
+                queue_approval_messages(context.bot, row["user_id"])
+            else:
+                state_fanout.unsubscribe(row["user_id"])
+        verb = "одобрено" if status == "yes" else "отклонено"
+        skipped = len(selected) - len(decided)
+        note = f"{'✅' if status == 'yes' else '❌'} {verb.capitalize()}: {len(decided)}."
+        if skipped:
+            note += f" Уже решены ранее: {skipped}."
+        log(f"[🗂] Пакетно {verb} {len(decided)}: {', '.join(r['user_id'] for r in decided)}")
+        selected.clear()
+        # Текущая страница могла опустеть — начинаем заново
+        state["pages"] = [""]
+    await query.answer()
+
+    text, keyboard = await render_pending_page(state, note)
+    try:
+        await edit_text(query, text, reply_markup=keyboard)
+    except BadRequest as e:
+        # «message is not modified» — повторное нажатие той же кнопки
+        log(f"[🗂] Список заявок не обновлён: {e}")
 
 
 async def handle_admin_decision(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -940,14 +1640,14 @@ async def handle_admin_decision(update: Update, context: ContextTypes.DEFAULT_TY
 
     data = query.data
     if ":" not in data:
-        await query.edit_message_text("ℹ️ Решение отложено.")
+        await edit_text(query, "ℹ️ Решение отложено.")
         return
 
     action, user_id = data.split(":", 1)
-    row = get_user_record(user_id)
+    row = await get_user_record(user_id)
 
     if not row:
-        await query.edit_message_text("⚠️ Пользователь не найден в базе.")
+        await show_admin_result(query, user_id, "⚠️ Пользователь не найден в базе.")
         return
 
     fio = row.get("fio", "Неизвестно")
@@ -955,72 +1655,279 @@ async def handle_admin_decision(update: Update, context: ContextTypes.DEFAULT_TY
     mention = f"@{username}" if username else f"user_id={user_id}"
 
     if action == "approve":
-        if set_user_approval_status(user_id, "yes"):
+        if await set_user_approval_status(user_id, "yes"):
             log(f"[✅] Пользователь одобрен — {fio} ({mention})")
-            await query.edit_message_text(f"✅ Пользователь {fio} ({mention}) одобрен.")
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text="✅ Ваша заявка одобрена! Доступ открыт. Добро пожаловать!",
-                reply_markup=get_main_menu("yes"),
-            )
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text=(
-                    "ℹ️ Как работает ворота:\n\n"
-                    "– Нажмите «Открыть», чтобы начать движение.\n"
-                    "– Ворота автоматически дойдёт до конца, затем закроется.\n"
-                    "– Кнопка «Остановить» нужна только если хотите прервать движение.\n"
-                    "– После остановки появляется кнопка «Закрыть» — она работает как «Открыть в обратную сторону».\n\n"
-                    "⚠️ Иногда кнопки могут не совпадать с реальным состоянием калитки — это нормально."
-                    "После завершения движения бот сам обновит состояние и покажет «замочек», когда ворота вернётся в режим ожидания.\n\n"
-                    "Если вы видите кнопку «Открыть» — всё готово 👍"
-                ),
-            )
+            await show_admin_result(query, user_id, f"✅ Пользователь {fio} ({mention}) одобрен.")
+            queue_approval_messages(context.bot, user_id)
         else:
-            await query.edit_message_text("❌ Ошибка при сохранении в базе.")
+            await edit_text(query, "❌ Ошибка при сохранении в базе.")
     elif action == "reject":
-        if set_user_approval_status(user_id, "no"):
+        if await set_user_approval_status(user_id, "no"):
             log(f"[❌] Пользователь отклонён — {fio} ({mention})")
-            await query.edit_message_text(f"❌ Пользователь {fio} ({mention}) отклонён.")
+            state_fanout.unsubscribe(user_id)
+            await remove_subscription(user_id)
+            await show_admin_result(query, user_id, f"❌ Пользователь {fio} ({mention}) отклонён.")
         else:
-            await query.edit_message_text("❌ Ошибка при сохранении в базе.")
+            await edit_text(query, "❌ Ошибка при сохранении в базе.")
     else:
-        await query.edit_message_text("ℹ️ Неизвестное действие.")
+        await edit_text(query, "ℹ️ Неизвестное действие.")
 
 
-async def is_gate_access_granted(user_id: str, update: Update) -> bool:
-    # 1. Получаем статус approve (yes / no / "" / None)
-    status = get_user_aprove_status(user_id)
+async def show_admin_result(query, user_id: str, text: str):
+    """Итог решения: в сводке убираем только строку этого пользователя."""
+    rows = remaining_digest_rows(query.message.reply_markup, user_id)
+    if rows is None:
+        await edit_text(query, text)
+        return
+    await edit_text(
+        query, f"{query.message.text}\n{text}", reply_markup=InlineKeyboardMarkup(rows)
+    )
+
+
+def access_denial(decision: AccessDecision) -> Optional[str]:
+    """Текст отказа для пользователя или None, если доступ есть."""
+    # 1. Статус approve (yes / no / "" / None) — из уже прочитанной строки
+    status = decision.status
 
     if status is None:
-        await update.message.reply_text("🚫 Вы не зарегистрированы.")
-        return False
+        return "🚫 Вы не зарегистрированы."
 
     if status == "no":
-        await update.message.reply_text("🚫 Ваш доступ был отклонён.")
-        return False
+        return "🚫 Ваш доступ был отклонён."
 
     if status not in ("yes", ""):
-        await update.message.reply_text("⏳ Ваша заявка ещё рассматривается.")
-        return False
+        return "⏳ Ваша заявка ещё рассматривается."
 
     # 2. Если статус "yes" — проверяем access_time
-    access_time_str = get_access_time_for_user(user_id)
+    access_time_str = decision.access_time
 
     if access_time_str is None:
         # Если поле пустое — считаем, что доступ разрешён всегда
-        return True
+        return None
 
-    if check_access_time(access_time_str):
-        return True
-    else:
-        await update.message.reply_text("⏱ Сейчас вход запрещён по расписанию.")
+    if not check_access_time(access_time_str):
+        return "⏱ Сейчас вход запрещён по расписанию."
+    return None
+
+
+async def is_gate_access_granted(decision: AccessDecision, update: Update) -> bool:
+    denial = access_denial(decision)
+    if denial:
+        await reply(update.effective_message, denial, priority=PRIORITY_GATE)
         return False
+    return True
 
 
-async def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(True).build()
-    app.bot_data["event_loop"] = asyncio.get_event_loop()
+GATE_STAGE = metrics_registry.histogram(
+    "gate_stage_seconds",
+    "Длительность этапов команды: telegram_update, db, publish, device, send_message, end_to_end, fanout",
+    ("stage",),
+)
+CONFIRM_TIMEOUTS = metrics_registry.counter(
+    "gate_confirm_timeouts_total",
+    "Таймауты ожидания подтверждения от устройства",
+    ("gate",),
+)
+GATE_EVENTS_DROPPED = metrics_registry.counter(
+    "gate_events_dropped_total",
+    "Отброшенные события устройства: unknown, stale, duplicate, transition",
+    ("gate", "reason"),
+)
+IDLE_RESET_FALLBACKS = metrics_registry.counter(
+    "gate_idle_reset_fallbacks_total",
+    "Резервные сбросы в IDLE без сигнала от устройства",
+    ("gate",),
+)
+GATE_LEASES_LOST = metrics_registry.counter(
+    "gate_leases_lost_total",
+    "Аренды калитки, которые забрал другой процесс, пока пользователь был активен",
+    ("gate",),
+)
+metrics_registry.gauge_func(
+    "bot_leader",
+    "1 — этот экземпляр ведущий (держит аренду LeaderLease)",
+    lambda: 1 if leader is not None and leader.is_leader else 0,
+)
+metrics_registry.gauge_func(
+    "gate_pending_confirmations",
+    "Пользователи, чья команда ждёт подтверждения",
+    lambda: {(gate.id,): len(gate.pending) for gate in gate_registry},
+    ("gate",),
+)
+metrics_registry.gauge_func(
+    "gate_commands_in_flight",
+    "Команды в реестре ожидания подтверждения",
+    lambda: len(pending_commands),
+)
+metrics_registry.gauge_func(
+    "timers_pending",
+    "Запланированные резервные сбросы и таймауты подтверждения",
+    lambda: timers.pending,
+)
+metrics_registry.counter_func(
+    "timers_total",
+    "Таймеры: fired — сработали, cancelled — сняты до срока",
+    lambda: {("fired",): timers.fired, ("cancelled",): timers.cancelled},
+    ("result",),
+)
+metrics_registry.counter_func(
+    "gate_claims_total",
+    "Режим воркеров: claimed — калитка занята, conflict — её держит другой процесс",
+    lambda: (
+        {("claimed",): gate_store.claims, ("conflict",): gate_store.conflicts}
+        if gate_store is not None
+        else {}
+    ),
+    ("result",),
+)
+metrics_registry.counter_func(
+    "status_messages_total",
+    "Статусы калиток: sent — новым сообщением, edited — правкой, coalesced — схлопнуты",
+    lambda: {
+        ("sent",): status_renderer.sent,
+        ("edited",): status_renderer.edited,
+        ("coalesced",): status_renderer.coalesced,
+    },
+    ("result",),
+)
+metrics_registry.gauge_func(
+    "gate_queue_waiting",
+    "Билеты в очереди калитки",
+    lambda: {(gate.id,): len(gate.queue) for gate in gate_registry},
+    ("gate",),
+)
+metrics_registry.gauge_func(
+    "gate_state_subscribers",
+    "Жители, подписанные на состояние калитки",
+    lambda: {(gate.id,): state_fanout.subscriber_count(gate.id) for gate in gate_registry},
+    ("gate",),
+)
+metrics_registry.gauge_func(
+    "gate_state_fanout_backlog",
+    "Неотправленные обновления состояния подписчикам",
+    lambda: state_fanout.backlog,
+)
+metrics_registry.counter_func(
+    "gate_state_fanout_total",
+    "Обновления состояния подписчикам: sent, superseded (заменены более новым), failed",
+    lambda: {
+        ("sent",): state_fanout.sent,
+        ("superseded",): state_fanout.superseded,
+        ("failed",): state_fanout.failed,
+    },
+    ("result",),
+)
+OUTBOX_WAIT = metrics_registry.histogram(
+    "outbox_wait_seconds",
+    "Ожидание сообщения в исходящей очереди до первой попытки отправки",
+    ("priority",),
+)
+metrics_registry.gauge_func(
+    "outbox_queued",
+    "Сообщения в исходящей очереди",
+    lambda: {(name,): count for name, count in outbox.queued_by_priority().items()},
+    ("priority",),
+)
+metrics_registry.counter_func(
+    "outbox_messages_total",
+    "Исходящие сообщения: sent, failed, retried (повторные попытки)",
+    lambda: {
+        ("sent",): outbox.sent,
+        ("failed",): outbox.failed,
+        ("retried",): outbox.retried,
+    },
+    ("result",),
+)
+metrics_registry.counter_func(
+    "outbox_retry_after_total",
+    "Ответы Telegram 429 (RetryAfter)",
+    lambda: outbox.retry_after_events,
+)
+metrics_registry.gauge_func(
+    "outbox_paused_seconds",
+    "Сколько ещё отправка приостановлена по RetryAfter",
+    lambda: outbox.paused_for,
+)
+metrics_registry.gauge_func(
+    "mqtt_connected",
+    "Подключение к MQTT-брокеру (1 — есть)",
+    lambda: int(mqtt_publisher is not None and mqtt_publisher.client.is_connected()),
+)
+metrics_registry.gauge_func(
+    "mqtt_bridge_backlog",
+    "Сообщения MQTT, ожидающие обработки на event loop",
+    lambda: mqtt_bridge.backlog if mqtt_bridge else 0,
+)
+metrics_registry.counter_func(
+    "access_cache_requests_total",
+    "Обращения к кэшу решений о доступе",
+    lambda: {
+        ("hit",): get_cache_stats()["hits"],
+        ("miss",): get_cache_stats()["misses"],
+    },
+    ("result",),
+)
+metrics_registry.counter_func(
+    "rate_limit_rejected_total",
+    "Отклонённые антифлудом команды",
+    lambda: {
+        ("user",): user_rate_limiter.rejected,
+        ("gate",): gate_rate_limiter.rejected,
+    },
+    ("scope",),
+)
+metrics_registry.counter_func(
+    "audit_events_total",
+    "События журнала команд: written, dropped (очередь переполнена), failed",
+    lambda: {
+        ("written",): audit_log.written,
+        ("dropped",): audit_log.dropped,
+        ("failed",): audit_log.failed,
+    },
+    ("result",),
+)
+metrics_registry.counter_func(
+    "persistence_rows_total",
+    "Строки user_data/bot_data/разговоров: written — записаны, skipped — не менялись",
+    lambda: {
+        ("written",): persistence.rows_written,
+        ("skipped",): persistence.rows_skipped,
+    },
+    ("result",),
+)
+metrics_registry.counter_func(
+    "log_records_dropped_total",
+    "Строки лога, отброшенные из-за переполнения очереди",
+    lambda: log_writer.dropped,
+)
+
+
+async def on_stop(app):
+    # HTTP-клиент бота ещё открыт: outbox успевает отправить очередь
+    await timers.stop()
+    await status_renderer.stop()
+    if mqtt_bridge:
+        await mqtt_bridge.stop()
+    await state_fanout.stop()
+    await registration_digest.stop()
+    await outbox.stop()
+
+
+async def on_shutdown(app):
+    audit_log.stop()
+    # Резервный экземпляр подхватит калитки и апдейты сразу, без ожидания срока
+    if gate_store is not None:
+        await gate_store.release_all()
+    if leader is not None:
+        await leader.release()
+    await close_db_pool()
+
+
+def register_handlers(app):
+    registration_digest.start(partial(send_registration_requests, app.bot))
+    status_renderer.start(
+        partial(send_status, app.bot), partial(edit_status, app.bot), on_status_error
+    )
 
     conv_handler = ConversationHandler(
         entry_points=[
@@ -1042,12 +1949,23 @@ async def main():
             MessageHandler(filters.Regex("^🏁 Начало$"), handle_start_button),
             CommandHandler("cancel", cancel),
         ],
+        name="registration",
+        persistent=app.persistence is not None,
     )
 
     app.add_handler(conv_handler)
     app.add_handler(CallbackQueryHandler(handle_old_gate_button, pattern="ON"))
+    app.add_handler(
+        CallbackQueryHandler(handle_gate_button, pattern=f"^{GATE_CALLBACK_PREFIX}")
+    )
+    app.add_handler(CallbackQueryHandler(handle_pending_action, pattern="^pend:"))
     app.add_handler(CallbackQueryHandler(handle_admin_decision))
     app.add_handler(CommandHandler("myid", my_id))
+    app.add_handler(CommandHandler("subscribe", subscribe_command))
+    app.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    app.add_handler(CommandHandler("broadcast", broadcast_command))
+    app.add_handler(CommandHandler("events", events_command))
+    app.add_handler(CommandHandler("pending", pending_command))
     app.add_handler(MessageHandler(filters.Regex("🏁 Начало"), start))
     app.add_handler(
         MessageHandler(filters.Regex("🔄 Проверить статус"), check_status)
@@ -1060,6 +1978,191 @@ async def main():
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown_input))
 
+
+async def run_worker(index: int, count: int, inbox):
+    """Воркер: апдейты и статусы MQTT приходят от фронта через inbox (workers.py)."""
+    global worker_index, worker_count, gate_store
+    worker_index, worker_count = index, count
+    gate_store = SQLiteGateStore(index, INSTANCE_ID, GATE_LEASE_TTL)
+    log_writer.log_dir = os.path.join(log_writer.log_dir, f"worker{index}")
+    persistence.bot_data_key = f"worker{index}"
+    outbox.share_global(1 / count)
+
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .updater(None)
+        .concurrent_updates(True)
+        .persistence(persistence)
+        .build()
+    )
+    await init_db_pool()
+    disable_user_cache()
+    # Команда ждёт подтверждения не дольше 2 × ARDUINO_CONFIRM_TIMEOUT
+    await gate_store.reset(ARDUINO_CONFIRM_TIMEOUT * 2)
+    state_fanout.load(
+        (user_id, gate_id)
+        for user_id, gate_id in await load_subscriptions()
+        if gate_registry.get(gate_id) is not None and owns_user(user_id)
+    )
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_HOST, METRICS_PORT + 1 + index)
+
+    register_handlers(app)
+    await app.initialize()
+    await app.start()
+    init_mqtt(app, app)
+
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+
+    def deliver(message):
+        if message is None:
+            if not stopped.done():
+                stopped.set_result(None)
+        elif message[0] == "update":
+            app.update_queue.put_nowait(Update.de_json(message[1], app.bot))
+        else:
+            _, topic, data, owner = message
+            mqtt_bridge.submit(topic, data, owner)
+
+    def pump():
+        # multiprocessing.Queue блокирует — читаем в потоке, обработка на loop
+        while True:
+            message = inbox.get()
+            loop.call_soon_threadsafe(deliver, message)
+            if message is None:
+                return
+
+    threading.Thread(target=pump, name="worker-inbox", daemon=True).start()
+    log(f"🚀 Воркер {index + 1}/{count} запущен")
+    try:
+        await stopped
+    finally:
+        await app.stop()
+        await on_stop(app)
+        await app.shutdown()
+        await on_shutdown(app)
+
+
+def worker_process(index: int, count: int, inbox):
+    # Цель для spawn: модуль в дочернем процессе импортируется как __mp_main__
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # останавливает фронт
+    asyncio.run(run_worker(index, count, inbox))
+
+
+async def run_front():
+    """Фронт режима воркеров: вебхук и подписка MQTT, обработка — в WORKERS процессах."""
+    await init_db_pool()
+    lost = asyncio.Event()
+    if STANDBY:
+        await become_leader()
+        leader.keep(lost.set)
+
+    pool = WorkerPool(WORKERS, worker_process)
+    pool.start()
+    router = EventRouter(pool, gate_registry)
+    # Сетевой поток paho только разбирает JSON; фильтр и запись в БД — на loop
+    bridge = MqttBridge(router.route, key=gate_id_for_topic)
+    bridge.start()
+
+    client = mqtt.Client(
+        client_id=f"front_{random.randint(1, 100000)}",
+        protocol=mqtt.MQTTv5,
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+    )
+    client.username_pw_set(username=MQTT_USER, password=MQTT_PASS)
+    client.user_data_set({"bridge": bridge})
+    client.on_connect = on_connect
+    client.on_message = on_mqtt_message
+    client.on_disconnect = on_disconnect
+    try:
+        client.connect(HOST, port=1883, keepalive=60)
+        client.loop_start()
+    except Exception as e:
+        log(f"[❌] Ошибка MQTT подключения: {e}")
+
+    PORT = int(os.getenv("PORT", 8443))
+    webhook_url = f"https://{DOMAIN_IP}:{PORT}/bot{BOT_TOKEN}"
+    server = await start_webhook_listener(
+        "0.0.0.0",
+        PORT,
+        f"/bot{BOT_TOKEN}",
+        pool.dispatch_update,
+        cert="certs/webhook.crt",
+        key="certs/webhook.key",
+    )
+    async with Bot(BOT_TOKEN) as bot:
+        with open("certs/webhook.crt", "rb") as cert:
+            await bot.set_webhook(webhook_url, certificate=cert)
+    log(f"🚀 Фронт запущен: {WORKERS} воркеров, вебхук на порту {PORT}")
+
+    try:
+        await lost.wait()
+        log("[⚠️] Аренда ведущего потеряна — останавливаем фронт и воркеры")
+    finally:
+        server.close()
+        client.loop_stop()
+        client.disconnect()
+        await bridge.stop()
+        pool.stop()
+        log(f"🛑 Воркеры остановлены: {pool.stats()}")
+        if leader is not None:
+            await leader.release()
+        await close_db_pool()
+
+
+def on_standby(current: Optional[dict]):
+    holder = current["holder"] if current else "?"
+    log(f"🕒 Резервный экземпляр {INSTANCE_ID}: ведущий {holder}, ждём его аренду")
+
+
+async def become_leader() -> LeaderLease:
+    """STANDBY=1: ждёт аренды ведущего, два экземпляра не принимают апдейты одновременно."""
+    global leader
+    leader = LeaderLease(INSTANCE_ID, LEADER_LEASE_TTL)
+    await leader.wait(on_standby)
+    log(f"👑 Экземпляр {INSTANCE_ID} ведущий (fence={leader.fence})")
+    return leader
+
+
+async def main():
+    global gate_store
+    if MODE == "webhook" and WORKERS > 1:
+        await run_front()
+        return
+
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .persistence(persistence)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    await init_db_pool()
+    if STANDBY:
+        # Без резерва калитки — в памяти процесса, без записей в access.db на каждое нажатие
+        gate_store = SQLiteGateStore(0, INSTANCE_ID, GATE_LEASE_TTL)
+        await become_leader()
+
+        def on_leader_lost():
+            log("[⚠️] Аренда ведущего потеряна — останавливаемся, управление у резервного")
+            app.stop_running()
+
+        leader.keep(on_leader_lost)
+    state_fanout.load(
+        (user_id, gate_id)
+        for user_id, gate_id in await load_subscriptions()
+        if gate_registry.get(gate_id) is not None
+    )
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        log(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    register_handlers(app)
+
     if MODE == "webhook":
         print("🚀 Запуск в WEBHOOK режиме. Введите /start в Telegram.")
 
@@ -1,6 +1,27 @@
 import sqlite3
 import time
-from typing import Optional
+from typing import List, Optional, Tuple
+
+from access_schedule import validate_access_time
+from access_schema import apply_pragmas, migrate, normalize_phone
+
+DB_PATH = "access.db"
+
+_migrated = set()
+
+
+def connect(path: str = DB_PATH, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    apply_pragmas(conn)
+    return conn
+
+
+def ensure_schema(conn: sqlite3.Connection, path: str = DB_PATH):
+    """Миграции — один раз на процесс для каждого файла БД."""
+    if path not in _migrated:
+        migrate(conn)
+        _migrated.add(path)
 
 
 def get_db_connection(
@@ -8,8 +29,8 @@ def get_db_connection(
 ) -> Optional[sqlite3.Connection]:
     for attempt in range(1, retries + 1):
         try:
-            conn = sqlite3.connect("access.db")
-            conn.row_factory = sqlite3.Row
+            conn = connect()
+            ensure_schema(conn)
             return conn
         except sqlite3.Error as e:
             print(f"[DB Error] Attempt {attempt}/{retries}: {e}")
@@ -18,19 +39,464 @@ def get_db_connection(
     return None
 
 
+# --- Запросы: принимают готовое соединение, ошибки sqlite3 пробрасывают ---
+
+
+def query_access_time(conn: sqlite3.Connection, user_id: str) -> Optional[str]:
+    row = conn.execute(
+        "SELECT access_time FROM access_control WHERE user_id = ?", (str(user_id),)
+    ).fetchone()
+    if row and row["access_time"]:
+        return row["access_time"].strip().lower()
+    return None
+
+
+def query_aprove_status(conn: sqlite3.Connection, user_id: str) -> Optional[str]:
+    row = conn.execute(
+        "SELECT aprove FROM access_control WHERE user_id = ?", (str(user_id),)
+    ).fetchone()
+    if row and row["aprove"]:
+        return row["aprove"].strip().lower()
+    return None
+
+
+def query_user_record(conn: sqlite3.Connection, user_id: str) -> Optional[dict]:
+    row = conn.execute(
+        "SELECT * FROM access_control WHERE user_id = ?", (str(user_id),)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def exec_update_user_phone(
+    conn: sqlite3.Connection, user_id: str, new_phone: str
+) -> str:
+    row = conn.execute(
+        "SELECT phone FROM access_control WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if not row:
+        return "not_found"
+    if new_phone == (row["phone"] or ""):
+        return "same"
+    conn.execute(
+        "UPDATE access_control SET phone = ?, phone_norm = ?, aprove = 'pending' WHERE user_id = ?",
+        (new_phone, normalize_phone(new_phone), user_id),
+    )
+    return "updated"
+
+
+def exec_insert_new_user(
+    conn: sqlite3.Connection,
+    user_id,
+    username,
+    fio,
+    phone,
+    aprove,
+    access_time,
+    updated_at,
+    telegram_link,
+):
+    # Некорректное расписание отклоняется до записи (ScheduleError)
+    access_time = validate_access_time(access_time)
+    conn.execute(
+        """
+        INSERT INTO access_control (
+            user_id, username, fio, phone, phone_norm,
+            aprove, access_time, updated_at, telegram_link
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+        (
+            user_id,
+            username,
+            fio,
+            phone,
+            normalize_phone(phone),
+            aprove,
+            access_time,
+            updated_at,
+            telegram_link,
+        ),
+    )
+
+
+def exec_set_user_approval_status(
+    conn: sqlite3.Connection, user_id: str, status: str
+) -> bool:
+    cursor = conn.execute(
+        "UPDATE access_control SET aprove = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+        (status.lower(), str(user_id)),
+    )
+    return cursor.rowcount > 0
+
+
+def exec_set_user_access_time(
+    conn: sqlite3.Connection, user_id: str, access_time: str
+) -> bool:
+    access_time = validate_access_time(access_time)
+    cursor = conn.execute(
+        "UPDATE access_control SET access_time = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+        (access_time, str(user_id)),
+    )
+    return cursor.rowcount > 0
+
+
+def query_approved_user_ids(conn: sqlite3.Connection) -> List[str]:
+    rows = conn.execute(
+        "SELECT user_id FROM access_control WHERE lower(trim(aprove)) = 'yes'"
+    ).fetchall()
+    return [str(row["user_id"]) for row in rows]
+
+
+def query_users_by_status(
+    conn: sqlite3.Connection, status: str, after_user_id: str = "", limit: int = 10
+) -> List[dict]:
+    """Страница пользователей со статусом: keyset по user_id, а не OFFSET."""
+    rows = conn.execute(
+        """
+        SELECT user_id, username, fio, phone FROM access_control
+        WHERE lower(trim(aprove)) = ? AND user_id > ?
+        ORDER BY user_id LIMIT ?
+    """,
+        (status, after_user_id, limit),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def query_count_by_status(conn: sqlite3.Connection, status: str) -> int:
+    return conn.execute(
+        "SELECT count(*) FROM access_control WHERE lower(trim(aprove)) = ?", (status,)
+    ).fetchone()[0]
+
+
+def exec_decide_pending(
+    conn: sqlite3.Connection, user_ids: List[str], status: str
+) -> List[dict]:
+    """Ставит статус тем из user_ids, кто ещё ждёт решения; возвращает их строки.
+
+    Отклонённые сразу теряют подписки. Выполнять одной транзакцией (pool.write).
+    """
+    decided = []
+    ids = [str(user_id) for user_id in user_ids]
+    for start in range(0, len(ids), 500):
+        chunk = ids[start : start + 500]
+        marks = ", ".join("?" * len(chunk))
+        rows = conn.execute(
+            f"""
+            SELECT user_id, username, fio FROM access_control
+            WHERE user_id IN ({marks}) AND lower(trim(aprove)) = 'pending'
+        """,
+            chunk,
+        ).fetchall()
+        decided.extend(dict(row) for row in rows)
+
+    params = [(status.lower(), row["user_id"]) for row in decided]
+    conn.executemany(
+        "UPDATE access_control SET aprove = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+        params,
+    )
+    if status.lower() == "no":
+        conn.executemany(
+            "DELETE FROM gate_subscriptions WHERE user_id = ?",
+            [(row["user_id"],) for row in decided],
+        )
+    return decided
+
+
+# --- Подписки на состояние калиток ---
+
+
+def query_subscriptions(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    rows = conn.execute("SELECT user_id, gate_id FROM gate_subscriptions").fetchall()
+    return [(row["user_id"], row["gate_id"]) for row in rows]
+
+
+def exec_add_subscription(conn: sqlite3.Connection, user_id: str, gate_id: str) -> bool:
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO gate_subscriptions (user_id, gate_id) VALUES (?, ?)",
+        (str(user_id), gate_id),
+    )
+    return cursor.rowcount > 0
+
+
+def exec_remove_subscription(
+    conn: sqlite3.Connection, user_id: str, gate_id: Optional[str] = None
+) -> int:
+    if gate_id is None:
+        cursor = conn.execute(
+            "DELETE FROM gate_subscriptions WHERE user_id = ?", (str(user_id),)
+        )
+    else:
+        cursor = conn.execute(
+            "DELETE FROM gate_subscriptions WHERE user_id = ? AND gate_id = ?",
+            (str(user_id), gate_id),
+        )
+    return cursor.rowcount
+
+
+# --- Журнал команд (пишет audit_log) ---
+
+
+def query_access_events(
+    conn: sqlite3.Connection,
+    user_id: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 50,
+) -> List[dict]:
+    """Последние события, новые первыми; since/until — секунды Unix."""
+    clauses, params = [], []
+    if user_id is not None:
+        clauses.append("user_id = ?")
+        params.append(str(user_id))
+    if since is not None:
+        clauses.append("requested_at >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("requested_at < ?")
+        params.append(until)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = conn.execute(
+        f"SELECT * FROM access_events {where} ORDER BY requested_at DESC LIMIT ?",
+        (*params, limit),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+# --- Состояние PTB (sqlite_persistence) ---
+
+
+def query_persistence_kind(conn: sqlite3.Connection, kind: str) -> List[Tuple[str, bytes]]:
+    rows = conn.execute(
+        "SELECT key, data FROM bot_persistence WHERE kind = ?", (kind,)
+    ).fetchall()
+    return [(row["key"], row["data"]) for row in rows]
+
+
+def query_persistence_row(conn: sqlite3.Connection, kind: str, key: str) -> Optional[bytes]:
+    row = conn.execute(
+        "SELECT data FROM bot_persistence WHERE kind = ? AND key = ?", (kind, key)
+    ).fetchone()
+    return row["data"] if row else None
+
+
+def exec_persistence_write(
+    conn: sqlite3.Connection, rows: List[Tuple[str, str, Optional[bytes]]]
+):
+    """rows — (kind, key, data); data=None удаляет строку."""
+    now = time.time()
+    conn.executemany(
+        """
+        INSERT INTO bot_persistence (kind, key, data, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (kind, key) DO UPDATE SET
+            data = excluded.data, updated_at = excluded.updated_at
+    """,
+        [(kind, key, data, now) for kind, key, data in rows if data is not None],
+    )
+    conn.executemany(
+        "DELETE FROM bot_persistence WHERE kind = ? AND key = ?",
+        [(kind, key) for kind, key, data in rows if data is None],
+    )
+
+
+# --- Общее состояние калиток (gate_store, режим нескольких процессов) ---
+
+
+def query_gate_state(conn: sqlite3.Connection, gate_id: str) -> Optional[dict]:
+    row = conn.execute("SELECT * FROM gate_state WHERE gate_id = ?", (gate_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def exec_claim_gate(
+    conn: sqlite3.Connection, gate_id: str, user_id: str, worker: int, holder: str, ttl: float
+) -> Optional[dict]:
+    """Аренда калитки одним upsert: свободна, срок вышел или уже наша — берём.
+
+    Токен ограждения (fence) растёт при каждой смене владельца аренды;
+    возвращает строку калитки после попытки (active_user_id, holder, fence, lease_until).
+    """
+    now = time.time()
+    conn.execute(
+        """
+        INSERT INTO gate_state
+            (gate_id, active_user_id, active_since, worker, holder, fence, lease_until, updated_at)
+        VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+        ON CONFLICT (gate_id) DO UPDATE SET
+            fence = CASE
+                WHEN gate_state.holder IS excluded.holder
+                    AND gate_state.active_user_id IS excluded.active_user_id
+                THEN gate_state.fence ELSE gate_state.fence + 1 END,
+            active_since = CASE
+                WHEN gate_state.active_user_id IS excluded.active_user_id
+                THEN gate_state.active_since ELSE excluded.active_since END,
+            active_user_id = excluded.active_user_id,
+            worker = excluded.worker,
+            holder = excluded.holder,
+            lease_until = excluded.lease_until,
+            updated_at = excluded.updated_at
+        WHERE gate_state.active_user_id IS NULL
+            OR gate_state.lease_until IS NULL
+            OR gate_state.lease_until <= excluded.updated_at
+            OR (gate_state.active_user_id = excluded.active_user_id
+                AND gate_state.holder IS excluded.holder)
+    """,
+        (gate_id, str(user_id), now, worker, holder, now + ttl, now),
+    )
+    row = conn.execute(
+        "SELECT active_user_id, holder, fence, lease_until FROM gate_state WHERE gate_id = ?",
+        (gate_id,),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def exec_renew_gate(
+    conn: sqlite3.Connection, gate_id: str, holder: str, fence: int, ttl: float
+) -> bool:
+    """Продлевает аренду; False — её уже забрали (другой fence) или сняли."""
+    now = time.time()
+    cursor = conn.execute(
+        """
+        UPDATE gate_state SET lease_until = ?, updated_at = ?
+        WHERE gate_id = ? AND holder = ? AND fence = ? AND active_user_id IS NOT NULL
+    """,
+        (now + ttl, now, gate_id, holder, fence),
+    )
+    return cursor.rowcount > 0
+
+
+def exec_release_gate(
+    conn: sqlite3.Connection, gate_id: str, user_id: str, fence: Optional[int] = None
+) -> bool:
+    """Снимает аренду пользователя; с fence — только если аренда всё ещё та же."""
+    sql = """
+        UPDATE gate_state SET active_user_id = NULL, active_since = NULL, worker = NULL,
+            holder = NULL, lease_until = NULL, updated_at = ?
+        WHERE gate_id = ? AND active_user_id = ?
+    """
+    params = [time.time(), gate_id, str(user_id)]
+    if fence is not None:
+        sql += " AND fence = ?"
+        params.append(fence)
+    return conn.execute(sql, params).rowcount > 0
+
+
+def exec_gate_event(
+    conn: sqlite3.Connection, gate_id: str, state: str, user_id: Optional[str]
+):
+    """Статус устройства: новое состояние; IDLE активного пользователя освобождает калитку."""
+    now = time.time()
+    conn.execute(
+        """
+        INSERT INTO gate_state (gate_id, state, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (gate_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+    """,
+        (gate_id, state, now),
+    )
+    if state == "IDLE" and user_id:
+        exec_release_gate(conn, gate_id, user_id)
+
+
+def exec_add_gate_command(
+    conn: sqlite3.Connection,
+    request_id: str,
+    gate_id: str,
+    user_id: str,
+    command: str,
+    worker: int,
+    holder: Optional[str] = None,
+):
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO gate_commands
+            (request_id, gate_id, user_id, command, worker, holder, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+        (request_id, gate_id, str(user_id), command, worker, holder, time.time()),
+    )
+
+
+def exec_remove_gate_command(conn: sqlite3.Connection, request_id: str):
+    conn.execute("DELETE FROM gate_commands WHERE request_id = ?", (request_id,))
+
+
+def query_gate_command_worker(conn: sqlite3.Connection, request_id: str) -> Optional[int]:
+    row = conn.execute(
+        "SELECT worker FROM gate_commands WHERE request_id = ?", (request_id,)
+    ).fetchone()
+    return row["worker"] if row else None
+
+
+def exec_reset_worker(
+    conn: sqlite3.Connection, worker: int, holder: str, stale_after: float
+) -> int:
+    """Процесс перезапущен: снять свои записи и просроченные записи воркера с тем же номером.
+
+    Номера воркеров у экземпляров бота совпадают, поэтому живая аренда
+    другого экземпляра (holder другой, срок не вышел) не трогается, а его
+    команды — пока они моложе stale_after секунд.
+    """
+    now = time.time()
+    conn.execute(
+        """
+        DELETE FROM gate_commands
+        WHERE worker = ? AND (holder IS ? OR created_at <= ?)
+    """,
+        (worker, holder, now - stale_after),
+    )
+    cursor = conn.execute(
+        """
+        UPDATE gate_state SET active_user_id = NULL, active_since = NULL, worker = NULL,
+            holder = NULL, lease_until = NULL, updated_at = ?
+        WHERE worker = ? AND (holder IS ? OR lease_until IS NULL OR lease_until <= ?)
+    """,
+        (now, worker, holder, now),
+    )
+    return cursor.rowcount
+
+
+def exec_acquire_lease(
+    conn: sqlite3.Connection, name: str, holder: str, ttl: float
+) -> Optional[int]:
+    """Берёт или продлевает аренду name; fence, если она у holder, иначе None."""
+    now = time.time()
+    conn.execute(
+        """
+        INSERT INTO leases (name, holder, fence, lease_until) VALUES (?, ?, 1, ?)
+        ON CONFLICT (name) DO UPDATE SET
+            fence = CASE WHEN leases.holder = excluded.holder
+                THEN leases.fence ELSE leases.fence + 1 END,
+            holder = excluded.holder,
+            lease_until = excluded.lease_until
+        WHERE leases.holder = excluded.holder OR leases.lease_until <= ?
+    """,
+        (name, holder, now + ttl, now),
+    )
+    row = conn.execute(
+        "SELECT holder, fence FROM leases WHERE name = ?", (name,)
+    ).fetchone()
+    return row["fence"] if row and row["holder"] == holder else None
+
+
+def query_lease(conn: sqlite3.Connection, name: str) -> Optional[dict]:
+    row = conn.execute("SELECT * FROM leases WHERE name = ?", (name,)).fetchone()
+    return dict(row) if row else None
+
+
+def exec_release_lease(conn: sqlite3.Connection, name: str, holder: str) -> bool:
+    """Срок аренды — сейчас; строка остаётся, чтобы fence следующего владельца вырос."""
+    cursor = conn.execute(
+        "UPDATE leases SET lease_until = 0 WHERE name = ? AND holder = ?", (name, holder)
+    )
+    return cursor.rowcount > 0
+
+
+# --- Синхронный API: отдельное соединение на вызов ---
+
+
 def get_access_time_for_user(user_id: str) -> Optional[str]:
     conn = get_db_connection()
     if not conn:
         return None
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT access_time FROM access_control WHERE user_id = ?", (str(user_id),)
-        )
-        row = cursor.fetchone()
-        if row and row["access_time"]:
-            return row["access_time"].strip().lower()
-        return None
+        return query_access_time(conn, user_id)
     except sqlite3.Error as e:
         print(f"[DB access_time error] {e}")
         return None
@@ -43,14 +509,7 @@ def get_user_aprove_status(user_id: str) -> Optional[str]:
     if not conn:
         return None
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT aprove FROM access_control WHERE user_id = ?", (str(user_id),)
-        )
-        row = cursor.fetchone()
-        if row and row["aprove"]:
-            return row["aprove"].strip().lower()
-        return None
+        return query_aprove_status(conn, user_id)
     except sqlite3.Error as e:
         print(f"[DB aprove error] {e}")
         return None
@@ -63,19 +522,9 @@ def update_user_phone(user_id: str, new_phone: str) -> str:
     if not conn:
         return "error"
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT phone FROM access_control WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
-        if not row:
-            return "not_found"
-        if new_phone == (row["phone"] or ""):
-            return "same"
-        cursor.execute(
-            "UPDATE access_control SET phone = ?, aprove = 'pending' WHERE user_id = ?",
-            (new_phone, user_id),
-        )
+        result = exec_update_user_phone(conn, user_id, new_phone)
         conn.commit()
-        return "updated"
+        return result
     except sqlite3.Error as e:
         print(f"[DB update_user_phone error] {e}")
         return "error"
@@ -90,24 +539,16 @@ def insert_new_user(
     if not conn:
         return
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO access_control (
-                user_id, username, fio, phone,
-                aprove, access_time, updated_at, telegram_link
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                user_id,
-                username,
-                fio,
-                phone,
-                aprove,
-                access_time,
-                updated_at,
-                telegram_link,
-            ),
+        exec_insert_new_user(
+            conn,
+            user_id,
+            username,
+            fio,
+            phone,
+            aprove,
+            access_time,
+            updated_at,
+            telegram_link,
         )
         conn.commit()
     except sqlite3.Error as e:
@@ -121,13 +562,9 @@ def set_user_approval_status(user_id: str, status: str) -> bool:
     if not conn:
         return False
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE access_control SET aprove = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
-            (status.lower(), str(user_id)),
-        )
+        result = exec_set_user_approval_status(conn, user_id, status)
         conn.commit()
-        return cursor.rowcount > 0
+        return result
     except sqlite3.Error as e:
         print(f"[DB set_user_approval_status error] {e}")
         return False
@@ -135,17 +572,28 @@ def set_user_approval_status(user_id: str, status: str) -> bool:
         conn.close()
 
 
+def set_user_access_time(user_id: str, access_time: str) -> bool:
+    """Бросает ScheduleError, если строка расписания некорректна."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        result = exec_set_user_access_time(conn, user_id, access_time)
+        conn.commit()
+        return result
+    except sqlite3.Error as e:
+        print(f"[DB set_user_access_time error] {e}")
+        return False
+    finally:
+        conn.close()
+
+
 def get_user_record(user_id: str) -> Optional[dict]:
     conn = get_db_connection()
     if not conn:
         return None
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM access_control WHERE user_id = ?", (str(user_id),)
-        )
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return query_user_record(conn, user_id)
     except sqlite3.Error as e:
         print(f"[DB get_user_record error] {e}")
         return None
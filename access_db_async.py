@@ -0,0 +1,329 @@
+"""Асинхронный доступ к access.db.
+
+Держит долгоживущие соединения: небольшой пул читателей и одного писателя.
+Запросы выполняются в отдельном пуле потоков, event loop бота не блокируется.
+Функции повторяют сигнатуры access_db, но их нужно await-ить.
+
+Строка пользователя кэшируется (AccessDecision); записи через этот модуль
+сразу сбрасывают кэш, изменения из других процессов видны через ACCESS_CACHE_TTL.
+В режиме воркеров кэш выключен (disable_user_cache): одобрение приходит в
+процесс администратора, а нажатия пользователя — в его собственный.
+"""
+
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import access_db
+from access_cache import TTLCache
+
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+ACCESS_CACHE_SIZE = int(os.getenv("ACCESS_CACHE_SIZE", "1024"))
+ACCESS_CACHE_TTL = float(os.getenv("ACCESS_CACHE_TTL", "30"))
+
+
+class ConnectionPool:
+    def __init__(self, path: str = access_db.DB_PATH, readers: int = DB_READERS):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._all_readers: list = []
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _connect(self, retries: int = 3, delay: float = 0.5):
+        for attempt in range(1, retries + 1):
+            try:
+                return await self._run(access_db.connect, self.path, False)
+            except sqlite3.Error as e:
+                print(f"[DB Error] Attempt {attempt}/{retries}: {e}")
+                if attempt < retries:
+                    await asyncio.sleep(delay)
+        raise sqlite3.OperationalError(f"не удалось открыть {self.path}")
+
+    async def open(self):
+        async with self._open_lock:
+            if self.is_open:
+                return
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.readers_count + 1, thread_name_prefix="access_db"
+            )
+            self._readers = asyncio.Queue()
+            # Сначала писатель и миграции схемы, затем читатели
+            writer = await self._connect()
+            try:
+                await self._run(access_db.ensure_schema, writer, self.path)
+            except BaseException:
+                await self._run(writer.close)
+                raise
+            self._writer = writer
+            for _ in range(self.readers_count):
+                conn = await self._connect()
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+
+    async def close(self):
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            async with self._writer_lock:
+                for conn in self._all_readers + [self._writer]:
+                    await self._run(conn.close)
+                self._all_readers.clear()
+                self._writer = None
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def read(self, fn, *args):
+        """Выполняет fn(conn, *args) на свободном соединении-читателе."""
+        await self.open()
+        conn = await self._readers.get()
+        try:
+            return await self._run(fn, conn, *args)
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def write(self, fn, *args):
+        """Выполняет fn(conn, *args) на писателе и коммитит (или откатывает)."""
+        await self.open()
+        async with self._writer_lock:
+            return await self._run(self._write_tx, fn, args)
+
+    def _write_tx(self, fn, args):
+        try:
+            result = fn(self._writer, *args)
+            self._writer.commit()
+            return result
+        except BaseException:
+            self._writer.rollback()
+            raise
+
+
+@dataclass(frozen=True)
+class AccessDecision:
+    """Снимок строки access_control, прочитанный одним запросом."""
+
+    user_id: str
+    record: Optional[dict]
+
+    @property
+    def registered(self) -> bool:
+        return self.record is not None
+
+    @property
+    def status(self) -> Optional[str]:
+        aprove = self.record and self.record.get("aprove")
+        return aprove.strip().lower() if aprove else None
+
+    @property
+    def access_time(self) -> Optional[str]:
+        access_time = self.record and self.record.get("access_time")
+        return access_time.strip().lower() if access_time else None
+
+
+_pool = ConnectionPool()
+_user_cache = TTLCache(maxsize=ACCESS_CACHE_SIZE, ttl=ACCESS_CACHE_TTL)
+
+
+def get_pool() -> ConnectionPool:
+    return _pool
+
+
+async def init_db_pool():
+    await _pool.open()
+
+
+async def close_db_pool():
+    await _pool.close()
+
+
+def get_cache_stats() -> dict:
+    return _user_cache.stats()
+
+
+def disable_user_cache():
+    """Каждое решение о доступе — из БД: invalidate_user() не видна другим процессам."""
+    global _user_cache
+    _user_cache = TTLCache(maxsize=0, ttl=ACCESS_CACHE_TTL)
+
+
+def invalidate_user(user_id: str):
+    _user_cache.invalidate(str(user_id))
+
+
+async def get_access_decision(user_id: str) -> AccessDecision:
+    user_id = str(user_id)
+    cached = _user_cache.get(user_id, None)
+    if cached is not None:
+        return cached
+    generation = _user_cache.generation
+    try:
+        record = await _pool.read(access_db.query_user_record, user_id)
+    except sqlite3.Error as e:
+        print(f"[DB access_decision error] {e}")
+        return AccessDecision(user_id, None)
+    decision = AccessDecision(user_id, record)
+    _user_cache.put(user_id, decision, generation)
+    return decision
+
+
+async def get_access_time_for_user(user_id: str) -> Optional[str]:
+    return (await get_access_decision(user_id)).access_time
+
+
+async def get_user_aprove_status(user_id: str) -> Optional[str]:
+    return (await get_access_decision(user_id)).status
+
+
+async def get_user_record(user_id: str) -> Optional[dict]:
+    try:
+        return await _pool.read(access_db.query_user_record, user_id)
+    except sqlite3.Error as e:
+        print(f"[DB get_user_record error] {e}")
+        return None
+
+
+async def update_user_phone(user_id: str, new_phone: str) -> str:
+    try:
+        return await _pool.write(access_db.exec_update_user_phone, user_id, new_phone)
+    except sqlite3.Error as e:
+        print(f"[DB update_user_phone error] {e}")
+        return "error"
+    finally:
+        invalidate_user(user_id)
+
+
+async def insert_new_user(
+    user_id, username, fio, phone, aprove, access_time, updated_at, telegram_link
+):
+    try:
+        await _pool.write(
+            access_db.exec_insert_new_user,
+            user_id,
+            username,
+            fio,
+            phone,
+            aprove,
+            access_time,
+            updated_at,
+            telegram_link,
+        )
+    except sqlite3.Error as e:
+        print(f"[DB insert_new_user error] {e}")
+    finally:
+        invalidate_user(user_id)
+
+
+async def set_user_approval_status(user_id: str, status: str) -> bool:
+    try:
+        return await _pool.write(
+            access_db.exec_set_user_approval_status, user_id, status
+        )
+    except sqlite3.Error as e:
+        print(f"[DB set_user_approval_status error] {e}")
+        return False
+    finally:
+        invalidate_user(user_id)
+
+
+async def set_user_access_time(user_id: str, access_time: str) -> bool:
+    """Бросает ScheduleError, если строка расписания некорректна."""
+    try:
+        return await _pool.write(
+            access_db.exec_set_user_access_time, user_id, access_time
+        )
+    except sqlite3.Error as e:
+        print(f"[DB set_user_access_time error] {e}")
+        return False
+    finally:
+        invalidate_user(user_id)
+
+
+async def get_approved_user_ids() -> List[str]:
+    try:
+        return await _pool.read(access_db.query_approved_user_ids)
+    except sqlite3.Error as e:
+        print(f"[DB get_approved_user_ids error] {e}")
+        return []
+
+
+async def get_users_by_status(
+    status: str, after_user_id: str = "", limit: int = 10
+) -> List[dict]:
+    try:
+        return await _pool.read(access_db.query_users_by_status, status, after_user_id, limit)
+    except sqlite3.Error as e:
+        print(f"[DB get_users_by_status error] {e}")
+        return []
+
+
+async def count_users_by_status(status: str) -> int:
+    try:
+        return await _pool.read(access_db.query_count_by_status, status)
+    except sqlite3.Error as e:
+        print(f"[DB count_users_by_status error] {e}")
+        return 0
+
+
+async def decide_pending(user_ids: List[str], status: str) -> Optional[List[dict]]:
+    """Пакетное решение по заявкам одной транзакцией; None — ошибка БД."""
+    try:
+        return await _pool.write(access_db.exec_decide_pending, user_ids, status)
+    except sqlite3.Error as e:
+        print(f"[DB decide_pending error] {e}")
+        return None
+    finally:
+        for user_id in user_ids:
+            invalidate_user(user_id)
+
+
+async def get_access_events(
+    user_id: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 50,
+) -> List[dict]:
+    try:
+        return await _pool.read(access_db.query_access_events, user_id, since, until, limit)
+    except sqlite3.Error as e:
+        print(f"[DB get_access_events error] {e}")
+        return []
+
+
+async def load_subscriptions() -> List[Tuple[str, str]]:
+    try:
+        return await _pool.read(access_db.query_subscriptions)
+    except sqlite3.Error as e:
+        print(f"[DB load_subscriptions error] {e}")
+        return []
+
+
+async def add_subscription(user_id: str, gate_id: str) -> bool:
+    try:
+        await _pool.write(access_db.exec_add_subscription, user_id, gate_id)
+        return True
+    except sqlite3.Error as e:
+        print(f"[DB add_subscription error] {e}")
+        return False
+
+
+async def remove_subscription(user_id: str, gate_id: Optional[str] = None) -> bool:
+    try:
+        await _pool.write(access_db.exec_remove_subscription, user_id, gate_id)
+        return True
+    except sqlite3.Error as e:
+        print(f"[DB remove_subscription error] {e}")
+        return False
@@ -0,0 +1,138 @@
+"""Расписания доступа (поле access_time).
+
+Формат: "always" или одно/несколько правил через ";":
+    "<дни> HH:MM-HH:MM", например "mon-fri 08:00-20:00; sat 10:00-14:00".
+Дни: mon..sun, диапазоны (mon-fri, fri-mon), weekdays, weekends, через запятую.
+Если конец раньше начала ("mon-fri 22:00-06:00"), интервал переходит через
+полночь на следующий день. Обе границы включительно с точностью до минуты.
+
+Строка компилируется один раз в битовую карту минут недели (7 * 1440 бит),
+после чего проверка "можно ли сейчас" — одно обращение к байту.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+import pytz
+
+MOSCOW = pytz.timezone("Europe/Moscow")
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DAYS = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+DAY_GROUPS = {"weekdays": (0, 1, 2, 3, 4), "weekends": (5, 6)}
+
+
+class ScheduleError(ValueError):
+    pass
+
+
+class Schedule:
+    __slots__ = ("source", "_bits", "always")
+
+    def __init__(self, source: str, bits: bytes, always: bool = False):
+        self.source = source
+        self._bits = bits
+        self.always = always
+
+    def allows_minute(self, week_minute: int) -> bool:
+        return self.always or bool(self._bits[week_minute >> 3] >> (week_minute & 7) & 1)
+
+    def allows(self, when: Optional[datetime] = None) -> bool:
+        if self.always:
+            return True
+        when = when or datetime.now(MOSCOW)
+        if when.tzinfo is not None:
+            when = when.astimezone(MOSCOW)
+        return self.allows_minute(
+            when.weekday() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+        )
+
+    def __repr__(self):
+        return f"Schedule({self.source!r})"
+
+
+def _parse_days(days_part: str) -> set:
+    days = set()
+    for part in days_part.split(","):
+        part = part.strip()
+        if part in DAY_GROUPS:
+            days.update(DAY_GROUPS[part])
+        elif part in DAYS:
+            days.add(DAYS[part])
+        elif "-" in part:
+            start_day, _, end_day = part.partition("-")
+            if start_day not in DAYS or end_day not in DAYS:
+                raise ScheduleError(f"неизвестный диапазон дней: {part!r}")
+            idx = DAYS[start_day]
+            while True:
+                days.add(idx)
+                if idx == DAYS[end_day]:
+                    break
+                idx = (idx + 1) % 7
+        else:
+            raise ScheduleError(f"неизвестный день: {part!r}")
+    return days
+
+
+def _parse_minute(value: str) -> int:
+    hours, sep, minutes = value.partition(":")
+    if not sep or not hours.isdigit() or not minutes.isdigit() or len(minutes) != 2:
+        raise ScheduleError(f"время должно быть в формате HH:MM: {value!r}")
+    hours, minutes = int(hours), int(minutes)
+    if hours > 23 or minutes > 59:
+        raise ScheduleError(f"некорректное время: {value!r}")
+    return hours * 60 + minutes
+
+
+def normalize(access_time_str: str) -> str:
+    return " ".join(str(access_time_str).strip().lower().split())
+
+
+@lru_cache(maxsize=512)
+def compile_schedule(access_time_str: str) -> Schedule:
+    """Компилирует строку access_time; при ошибке бросает ScheduleError."""
+    source = normalize(access_time_str)
+    if source == "always":
+        return Schedule(source, b"", always=True)
+
+    bits = bytearray(MINUTES_PER_WEEK // 8)
+    rules = [rule.strip() for rule in source.split(";") if rule.strip()]
+    if not rules:
+        raise ScheduleError("пустое расписание")
+
+    for rule in rules:
+        try:
+            days_part, time_range = rule.split()
+        except ValueError:
+            raise ScheduleError(f"ожидается '<дни> HH:MM-HH:MM': {rule!r}") from None
+        start_str, sep, end_str = time_range.partition("-")
+        if not sep:
+            raise ScheduleError(f"ожидается диапазон HH:MM-HH:MM: {time_range!r}")
+        start, end = _parse_minute(start_str), _parse_minute(end_str)
+        # Через полночь — хвост интервала попадает на следующий день
+        length = (end - start) % MINUTES_PER_DAY + 1
+        for day in _parse_days(days_part):
+            first = day * MINUTES_PER_DAY + start
+            for minute in range(first, first + length):
+                minute %= MINUTES_PER_WEEK
+                bits[minute >> 3] |= 1 << (minute & 7)
+
+    return Schedule(source, bytes(bits))
+
+
+def validate_access_time(access_time_str: str) -> str:
+    """Проверяет строку перед записью в БД и возвращает её нормализованной."""
+    if access_time_str is None:
+        raise ScheduleError("расписание не задано")
+    return compile_schedule(access_time_str).source
+
+
+@lru_cache(maxsize=512)
+def get_schedule(access_time_str: str) -> Optional[Schedule]:
+    """Как compile_schedule, но для некорректной строки кэширует и возвращает None."""
+    try:
+        return compile_schedule(access_time_str)
+    except ScheduleError:
+        return None
@@ -0,0 +1,269 @@
+"""Схема access.db: версии и миграции.
+
+Номер версии хранится в PRAGMA user_version. При открытии пула
+access_db_async вызывает migrate(): недостающие миграции применяются по
+порядку, каждая в своей транзакции BEGIN IMMEDIATE — второй процесс,
+запущенный одновременно, дождётся первого и увидит уже новую версию.
+
+Миграции только добавляются в конец MIGRATIONS; менять применённые нельзя.
+"""
+
+import os
+import re
+import sqlite3
+from typing import Callable, List, Tuple
+
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+ACCESS_CONTROL_COLUMNS = (
+    ("user_id", "TEXT PRIMARY KEY NOT NULL"),
+    ("username", "TEXT"),
+    ("fio", "TEXT"),
+    ("phone", "TEXT"),
+    ("aprove", "TEXT"),
+    ("access_time", "TEXT"),
+    ("updated_at", "TEXT"),
+    ("telegram_link", "TEXT"),
+)
+
+
+def normalize_phone(phone) -> str:
+    """Последние 10 цифр номера: +7 (900) 123-45-67 и 89001234567 совпадают."""
+    return re.sub(r"\D", "", str(phone))[-10:] if phone else ""
+
+
+def apply_pragmas(conn: sqlite3.Connection):
+    """Настройки соединения: WAL задаётся в migrate() и хранится в файле БД."""
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[sqlite3.Row]:
+    return conn.execute(f"PRAGMA table_info({table})").fetchall()
+
+
+# --- Миграции ---
+
+
+def _m1_access_control(conn: sqlite3.Connection):
+    """access_control с PRIMARY KEY (user_id); старая таблица без ключа пересобирается."""
+    existing = _columns(conn, "access_control")
+    if not existing:
+        columns = ", ".join(f"{name} {decl}" for name, decl in ACCESS_CONTROL_COLUMNS)
+        conn.execute(f"CREATE TABLE access_control ({columns})")
+        return
+    if any(col[1] == "user_id" and col[5] for col in existing):
+        return
+
+    # Таблица создавалась вручную: без ключа, возможны дубликаты user_id.
+    # Остаётся последняя по rowid строка, лишние колонки сохраняются.
+    known = {name for name, _ in ACCESS_CONTROL_COLUMNS}
+    present = {col[1] for col in existing}
+    extra = [(col[1], col[2] or "") for col in existing if col[1] not in known]
+    definitions = [f"{name} {decl}" for name, decl in ACCESS_CONTROL_COLUMNS]
+    definitions += [f"{name} {decl}".strip() for name, decl in extra]
+    conn.execute(f"CREATE TABLE access_control_new ({', '.join(definitions)})")
+
+    copied = [name for name, _ in ACCESS_CONTROL_COLUMNS if name in present]
+    copied += [name for name, _ in extra]
+    names = ", ".join(copied)
+    conn.execute(
+        f"""
+        INSERT OR REPLACE INTO access_control_new ({names})
+        SELECT {names} FROM access_control
+        WHERE user_id IS NOT NULL AND trim(user_id) != ''
+        ORDER BY rowid
+    """
+    )
+    dropped = conn.execute(
+        "SELECT (SELECT count(*) FROM access_control) - (SELECT count(*) FROM access_control_new)"
+    ).fetchone()[0]
+    conn.execute("DROP TABLE access_control")
+    conn.execute("ALTER TABLE access_control_new RENAME TO access_control")
+    print(f"[DB migrate] access_control пересобрана с PRIMARY KEY, отброшено строк: {dropped}")
+
+
+def _m2_indexes(conn: sqlite3.Connection):
+    """Индекс статуса (в том виде, как его сравнивают запросы) и нормализованного телефона."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_access_control_aprove "
+        "ON access_control (lower(trim(aprove)))"
+    )
+    if not any(col[1] == "phone_norm" for col in _columns(conn, "access_control")):
+        conn.execute("ALTER TABLE access_control ADD COLUMN phone_norm TEXT")
+    rows = conn.execute("SELECT user_id, phone FROM access_control").fetchall()
+    conn.executemany(
+        "UPDATE access_control SET phone_norm = ? WHERE user_id = ?",
+        [(normalize_phone(row[1]), row[0]) for row in rows],
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_access_control_phone_norm "
+        "ON access_control (phone_norm)"
+    )
+
+
+def _m3_gate_subscriptions(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS gate_subscriptions (
+            user_id TEXT NOT NULL,
+            gate_id TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, gate_id)
+        )
+    """
+    )
+
+
+def _m4_access_events(conn: sqlite3.Connection):
+    """Журнал команд калитки (audit_log); время — секунды Unix."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS access_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            gate_id TEXT NOT NULL,
+            command TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            request_id TEXT,
+            requested_at REAL NOT NULL,
+            published_at REAL,
+            confirmed_at REAL
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_access_events_user_time "
+        "ON access_events (user_id, requested_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_access_events_time "
+        "ON access_events (requested_at)"
+    )
+
+
+def _m5_aprove_user_index(conn: sqlite3.Connection):
+    """Статус + user_id: постраничный список заявок идёт по индексу без сортировки."""
+    conn.execute("DROP INDEX IF EXISTS idx_access_control_aprove")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_access_control_aprove_user "
+        "ON access_control (lower(trim(aprove)), user_id)"
+    )
+
+
+def _m6_bot_persistence(conn: sqlite3.Connection):
+    """user_data, bot_data и состояния разговоров PTB — строка на ключ (sqlite_persistence)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bot_persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data BLOB NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+    """
+    )
+
+
+def _m7_gate_state(conn: sqlite3.Connection):
+    """Общее состояние калиток и команды в полёте для режима нескольких процессов."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS gate_state (
+            gate_id TEXT PRIMARY KEY NOT NULL,
+            state TEXT NOT NULL DEFAULT 'IDLE',
+            active_user_id TEXT,
+            active_since REAL,
+            worker INTEGER,
+            updated_at REAL NOT NULL
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS gate_commands (
+            request_id TEXT PRIMARY KEY NOT NULL,
+            gate_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            command TEXT NOT NULL,
+            worker INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_gate_commands_worker ON gate_commands (worker)"
+    )
+
+
+def _m8_gate_lease(conn: sqlite3.Connection):
+    """Аренда калитки со сроком и токеном ограждения; аренда ведущего экземпляра бота."""
+    columns = {col[1] for col in _columns(conn, "gate_state")}
+    for name, decl in (
+        ("holder", "TEXT"),
+        ("fence", "INTEGER NOT NULL DEFAULT 0"),
+        ("lease_until", "REAL"),
+    ):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE gate_state ADD COLUMN {name} {decl}")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY NOT NULL,
+            holder TEXT NOT NULL,
+            fence INTEGER NOT NULL,
+            lease_until REAL NOT NULL
+        )
+    """
+    )
+
+
+def _m9_gate_command_holder(conn: sqlite3.Connection):
+    """Процесс, отправивший команду: номера воркеров у экземпляров бота совпадают."""
+    if not any(col[1] == "holder" for col in _columns(conn, "gate_commands")):
+        conn.execute("ALTER TABLE gate_commands ADD COLUMN holder TEXT")
+
+
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (1, _m1_access_control),
+    (2, _m2_indexes),
+    (3, _m3_gate_subscriptions),
+    (4, _m4_access_events),
+    (5, _m5_aprove_user_index),
+    (6, _m6_bot_persistence),
+    (7, _m7_gate_state),
+    (8, _m8_gate_lease),
+    (9, _m9_gate_command_holder),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Включает WAL и применяет недостающие миграции; возвращает итоговую версию."""
+    if conn.in_transaction:
+        conn.commit()
+    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    if mode.lower() != "wal":
+        print(f"[DB migrate] journal_mode={mode}: WAL недоступен для этого файла")
+
+    for version, step in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Другой процесс мог применить миграцию, пока ждали блокировку
+            if schema_version(conn) < version:
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                print(f"[DB migrate] схема → v{version} ({step.__name__})")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return schema_version(conn)
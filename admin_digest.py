@@ -0,0 +1,151 @@
+"""Сводка новых заявок для администратора.
+
+Пока заявки приходят редко, каждая отправляется сразу отдельным сообщением.
+Если следующая приходит раньше чем через quiet_interval после предыдущей,
+начинается «всплеск»: заявки копятся и уходят одним сообщением — через
+window секунд после первой отложенной или сразу, как наберётся max_items.
+Так массовая регистрация даёт несколько сводок вместо сотни сообщений
+в чат администратора.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+@dataclass
+class RegistrationRequest:
+    user_id: str
+    fio: str
+    username: str
+    phone: str
+    kind: str = "new"  # new — новая заявка, phone — смена номера
+    created_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def title(self) -> str:
+        return self.fio or (f"@{self.username}" if self.username else self.user_id)
+
+
+Sender = Callable[[List[RegistrationRequest]], Awaitable[None]]
+
+
+def digest_message(requests: List[RegistrationRequest]):
+    """Текст и клавиатура сводки: по строке кнопок на каждого пользователя."""
+    lines = [f"📩 Новые заявки на доступ: {len(requests)}", ""]
+    buttons = []
+    for idx, request in enumerate(requests, 1):
+        link = f"@{request.username}" if request.username else "без username"
+        note = " — сменил номер" if request.kind == "phone" else ""
+        lines.append(
+            f"{idx}. {request.fio or 'без имени'} ({link}), {request.phone}, "
+            f"id {request.user_id}{note}"
+        )
+        name = request.title[:24]
+        buttons.append(
+            [
+                InlineKeyboardButton(f"✅ {idx}. {name}", callback_data=f"approve:{request.user_id}"),
+                InlineKeyboardButton(f"❌ {idx}", callback_data=f"reject:{request.user_id}"),
+            ]
+        )
+    lines += ["", "🗂 Все ожидающие — /pending"]
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
+
+
+def remaining_digest_rows(markup: Optional[InlineKeyboardMarkup], user_id: str):
+    """Кнопки сводки без строки user_id; None — в сообщении больше никого нет."""
+    decided = {f"approve:{user_id}", f"reject:{user_id}"}
+    rows = markup.inline_keyboard if markup else ()
+    keep = [row for row in rows if not any(b.callback_data in decided for b in row)]
+    others = any(
+        (b.callback_data or "").startswith(("approve:", "reject:")) for row in keep for b in row
+    )
+    return keep if others else None
+
+
+class RegistrationDigest:
+    def __init__(
+        self,
+        window: float = 30.0,
+        max_items: int = 10,
+        quiet_interval: float = 60.0,
+    ):
+        self._send: Optional[Sender] = None
+        self.window = window
+        self.max_items = max(1, max_items)
+        self.quiet_interval = quiet_interval
+        self._buffer: List[RegistrationRequest] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._last_request_at: Optional[float] = None
+        self._tasks: set = set()
+        self.sent_immediately = 0
+        self.digests = 0
+        self.batched = 0
+
+    def start(self, send: Sender):
+        """send(batch) отправляет одну заявку или сводку; вызывается на event loop."""
+        self._send = send
+
+    def add(self, request: RegistrationRequest):
+        """Не ждёт отправки; вызывать на event loop."""
+        now = request.created_at
+        quiet = (
+            not self._buffer
+            and (self._last_request_at is None or now - self._last_request_at >= self.quiet_interval)
+        )
+        self._last_request_at = now
+        if quiet:
+            self.sent_immediately += 1
+            self._spawn([request])
+            return
+
+        # Заявки одного пользователя в сводке не дублируются — остаётся последняя
+        self._buffer = [r for r in self._buffer if r.user_id != request.user_id]
+        self._buffer.append(request)
+        if len(self._buffer) >= self.max_items:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        self.digests += 1
+        self.batched += len(batch)
+        self._spawn(batch)
+
+    def _spawn(self, batch: List[RegistrationRequest]):
+        task = asyncio.get_running_loop().create_task(self._deliver(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, batch: List[RegistrationRequest]):
+        try:
+            await self._send(batch)
+        except Exception as e:
+            print(f"[digest] не удалось отправить заявки ({len(batch)}): {e}")
+
+    async def stop(self):
+        """Отправляет накопленное и дожидается отправок."""
+        self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "sent_immediately": self.sent_immediately,
+            "digests": self.digests,
+            "batched": self.batched,
+        }
@@ -0,0 +1,214 @@
+"""Журнал команд калитки в таблице access_events.
+
+record() только кладёт событие в ограниченную очередь — его можно звать из
+event loop без ожидания диска. Поток-писатель забирает события пачками и
+пишет каждую пачку одной транзакцией (group commit): под нагрузкой на сотню
+событий приходится один fsync, а не сто. Раз в prune_interval тот же поток
+удаляет события старше retention_days небольшими порциями, не задерживая
+надолго блокировку записи.
+
+Время в таблице — секунды Unix (REAL); в record() передаются отметки
+time.monotonic() из PendingCommand, перевод выполняется при постановке.
+"""
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import access_db
+
+OUTCOMES = (
+    "ok",  # устройство подтвердило
+    "timeout",  # подтверждения не дождались
+    "denied",  # не зарегистрирован, отклонён, вне расписания, калитка у другого
+    "rate_limited",  # антифлуд
+    "coalesced",  # объединено с уже идущим открытием
+    "queued",  # поставлено в очередь калитки (итог запишется отдельным событием)
+    "expired",  # билет очереди устарел, команда не отправлялась
+    "error",  # не удалось отправить в MQTT
+)
+
+_STOP = object()
+
+_INSERT = """
+    INSERT INTO access_events (
+        user_id, gate_id, command, outcome, request_id,
+        requested_at, published_at, confirmed_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def wall_time(monotonic_ts: Optional[float]) -> Optional[float]:
+    """Отметка time.monotonic() → секунды Unix."""
+    if monotonic_ts is None:
+        return None
+    return time.time() - (time.monotonic() - monotonic_ts)
+
+
+class AuditLog:
+    def __init__(
+        self,
+        path: str = access_db.DB_PATH,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        retention_days: float = 180,
+        prune_interval: float = 3600,
+        prune_chunk: int = 5000,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self.prune_chunk = prune_chunk
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        self.pruned = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._next_prune = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="audit-log", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0):
+        """Дописывает очередь и закрывает соединение."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def record(
+        self,
+        user_id: str,
+        gate_id: str,
+        command: str,
+        outcome: str,
+        requested_at: Optional[float] = None,
+        published_at: Optional[float] = None,
+        confirmed_at: Optional[float] = None,
+        request_id: Optional[str] = None,
+    ):
+        """Отметки времени — time.monotonic(); requested_at по умолчанию — сейчас."""
+        if self._thread is None:
+            self.start()
+        row = (
+            str(user_id),
+            gate_id,
+            command,
+            outcome,
+            request_id,
+            wall_time(requested_at) if requested_at is not None else time.time(),
+            wall_time(published_at),
+            wall_time(confirmed_at),
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._maybe_prune()
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            rows = []
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                else:
+                    rows.append(item)
+            if rows:
+                self._write_batch(rows)
+            if stop:
+                self._close()
+                return
+            self._maybe_prune()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = access_db.connect(self.path)
+            access_db.ensure_schema(self._conn, self.path)
+        return self._conn
+
+    def _write_batch(self, rows):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.executemany(_INSERT, rows)
+            self.written += len(rows)
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.failed += len(rows)
+            print(f"[DB audit_log error] {e}")
+            self._close()
+
+    def _maybe_prune(self):
+        now = time.monotonic()
+        if self.retention_days <= 0 or now < self._next_prune:
+            return
+        self._next_prune = now + self.prune_interval
+        cutoff = time.time() - self.retention_days * 86400
+        try:
+            conn = self._connection()
+            while True:
+                with conn:
+                    cursor = conn.execute(
+                        """
+                        DELETE FROM access_events WHERE id IN (
+                            SELECT id FROM access_events WHERE requested_at < ?
+                            ORDER BY requested_at LIMIT ?
+                        )
+                    """,
+                        (cutoff, self.prune_chunk),
+                    )
+                self.pruned += cursor.rowcount
+                if cursor.rowcount < self.prune_chunk:
+                    break
+        except sqlite3.Error as e:
+            print(f"[DB audit_log prune error] {e}")
+            self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "pruned": self.pruned,
+            "queued": self._queue.qsize(),
+        }
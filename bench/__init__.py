@@ -0,0 +1 @@
+"""Оффлайн-бенчмарк бота: заглушки Telegram Bot API и MQTT, симуляция жителей."""
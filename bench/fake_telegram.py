@@ -0,0 +1,161 @@
+"""Локальная замена Telegram Bot API для бенчмарка.
+
+Минимальный HTTP/1.1-сервер на asyncio с keep-alive: принимает запросы вида
+POST /bot<token>/<method> (form-urlencoded или JSON), отвечает так, чтобы
+python-telegram-bot разобрал результат, и записывает каждое исходящее
+сообщение бота с монотонным временем. Задержка ответа настраивается, чтобы
+имитировать сеть до api.telegram.org.
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+BOT_INFO = {
+    "id": 100000,
+    "is_bot": True,
+    "first_name": "Bench",
+    "username": "bench_gate_bot",
+    "can_join_groups": False,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+# Методы, которые отправляют или меняют сообщение в чате
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup"}
+
+
+class FakeTelegramAPI:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.calls: Counter = Counter()
+        self.errors = 0
+        # chat_id -> [(monotonic, method, text)]
+        self.messages: Dict[int, List[tuple]] = defaultdict(list)
+        self._listeners: List[Callable[[int, str, str, float], None]] = []
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def subscribe(self, listener: Callable[[int, str, str, float], None]):
+        """listener(chat_id, method, text, monotonic) вызывается на каждое сообщение."""
+        self._listeners.append(listener)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._server = await asyncio.start_server(self._serve, host=host, port=port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line or line in (b"\r\n", b"\n"):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0") or 0)
+                body = await reader.readexactly(length) if length else b""
+
+                parts = request_line.decode("latin-1").split()
+                path = parts[1] if len(parts) > 1 else "/"
+                method = path.rstrip("/").rsplit("/", 1)[-1]
+                params = _parse_body(body, headers.get("content-type", ""))
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, result = self._dispatch(method, params)
+
+                payload = json.dumps(result, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1")
+                    + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def _dispatch(self, method: str, params: dict):
+        self.calls[method] += 1
+        if method == "getMe":
+            return "200 OK", {"ok": True, "result": BOT_INFO}
+        if method == "getUpdates":
+            return "200 OK", {"ok": True, "result": []}
+        if method not in MESSAGE_METHODS:
+            return "200 OK", {"ok": True, "result": True}
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            return "429 Too Many Requests", {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }
+
+        chat_id = int(params.get("chat_id", 0))
+        text = params.get("text", "")
+        now = time.monotonic()
+        self.messages[chat_id].append((now, method, text))
+        for listener in self._listeners:
+            listener(chat_id, method, text, now)
+
+        message_id = int(params.get("message_id") or next(self._message_ids))
+        return "200 OK", {
+            "ok": True,
+            "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_INFO,
+                "text": text,
+            },
+        }
+
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "messages": sum(len(items) for items in self.messages.values()),
+            "errors": self.errors,
+        }
+
+
+def _parse_body(body: bytes, content_type: str) -> dict:
+    if not body:
+        return {}
+    text = body.decode("utf-8", errors="replace")
+    if "json" in content_type:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            return {}
+        return data if isinstance(data, dict) else {}
+    return dict(parse_qsl(text, keep_blank_values=True))
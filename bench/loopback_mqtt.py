@@ -0,0 +1,249 @@
+"""MQTT без сети: брокер-заглушка в процессе, клиент с интерфейсом paho и устройство.
+
+LoopbackBroker доставляет сообщения подписчикам из своего потока — так же,
+как сетевой поток paho вызывает on_message, поэтому путь
+on_mqtt_message → MqttBridge → event loop проверяется без изменений.
+LoopbackClient реализует ту часть paho.mqtt.client.Client, которой пользуются
+init_mqtt и MqttPublisher. SimulatedDevice отвечает на команды статусами
+с настраиваемыми задержками и долей «потерянных» команд.
+"""
+
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+Deliver = Callable[[str, bytes], None]
+
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    pattern_parts = pattern.split("/")
+    topic_parts = topic.split("/")
+    for idx, part in enumerate(pattern_parts):
+        if part == "#":
+            return True
+        if idx >= len(topic_parts):
+            return False
+        if part != "+" and part != topic_parts[idx]:
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+class LoopbackBroker:
+    """Маршрутизация по подпискам и отложенная доставка в отдельном потоке."""
+
+    def __init__(self):
+        self._subscriptions: List[Tuple[str, Deliver]] = []
+        self._timers: List[tuple] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self.delivered = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="loopback-mqtt", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def subscribe(self, pattern: str, deliver: Deliver):
+        with self._cond:
+            self._subscriptions.append((pattern, deliver))
+
+    def call_later(self, delay: float, fn: Callable, *args):
+        with self._cond:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._seq), fn, args))
+            self._cond.notify()
+
+    def publish(self, topic: str, payload: bytes, delay: float = 0.0):
+        self.call_later(delay, self._route, topic, payload)
+
+    def _route(self, topic: str, payload: bytes):
+        with self._cond:
+            targets = [deliver for pattern, deliver in self._subscriptions if topic_matches(pattern, topic)]
+        for deliver in targets:
+            self.delivered += 1
+            deliver(topic, payload)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and (
+                    not self._timers or self._timers[0][0] > time.monotonic()
+                ):
+                    timeout = self._timers[0][0] - time.monotonic() if self._timers else None
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                _, _, fn, args = heapq.heappop(self._timers)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[loopback] ошибка в обработчике: {e}")
+
+
+@dataclass
+class MessageInfo:
+    rc: int
+    mid: int
+
+
+@dataclass
+class Message:
+    topic: str
+    payload: bytes
+    qos: int = 0
+    retain: bool = False
+
+
+class _ReasonCode:
+    is_failure = False
+
+    def __str__(self):
+        return "Success"
+
+
+class LoopbackClient:
+    """Подмножество paho.mqtt.client.Client поверх LoopbackBroker."""
+
+    def __init__(self, broker: LoopbackBroker, puback_latency: float = 0.0):
+        self.broker = broker
+        self.puback_latency = puback_latency
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self.on_publish = None
+        self._userdata = None
+        self._connected = False
+        self._mids = itertools.count(1)
+        self.published = 0
+
+    def username_pw_set(self, username=None, password=None):
+        pass
+
+    def user_data_set(self, userdata):
+        self._userdata = userdata
+
+    def connect(self, host=None, port=1883, keepalive=60):
+        self._connected = True
+        if self.on_connect:
+            self.broker.call_later(0, self.on_connect, self, self._userdata, {}, _ReasonCode(), None)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        return self.connect()
+
+    def disconnect(self):
+        self._connected = False
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def subscribe(self, topic: str, qos: int = 0):
+        self.broker.subscribe(topic, self._deliver)
+        return mqtt.MQTT_ERR_SUCCESS, next(self._mids)
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False):
+        if not self._connected:
+            return MessageInfo(mqtt.MQTT_ERR_NO_CONN, 0)
+        mid = next(self._mids)
+        data = payload.encode() if isinstance(payload, str) else (payload or b"")
+        self.broker.publish(topic, data)
+        self.published += 1
+        if self.on_publish:
+            # paho вызывает on_publish и для QoS 0 (сразу после отправки)
+            delay = self.puback_latency if qos > 0 else 0.0
+            self.broker.call_later(delay, self.on_publish, self, self._userdata, mid, _ReasonCode(), None)
+        return MessageInfo(mqtt.MQTT_ERR_SUCCESS, mid)
+
+    def _deliver(self, topic: str, payload: bytes):
+        if self.on_message:
+            self.on_message(self, self._userdata, Message(topic, payload))
+
+
+class SimulatedDevice:
+    """Контроллер калиток: на команду отвечает статусом, после цикла — IDLE.
+
+    topics: {command_topic: status_topic}. Ответ повторяет request_id, как
+    текущая прошивка; drop_rate — доля команд, оставленных без ответа.
+    """
+
+    def __init__(
+        self,
+        broker: LoopbackBroker,
+        topics: Dict[str, str],
+        ack_delay: float = 0.05,
+        cycle_time: float = 1.0,
+        drop_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.broker = broker
+        self.topics = topics
+        self.ack_delay = ack_delay
+        self.cycle_time = cycle_time
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._cycles: Dict[str, int] = {}
+        self.commands = 0
+        self.dropped = 0
+
+    def start(self):
+        for command_topic in self.topics:
+            self.broker.subscribe(command_topic, self._on_command)
+
+    def _on_command(self, topic: str, payload: bytes):
+        self.commands += 1
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            self.dropped += 1
+            return
+
+        status_topic = self.topics[topic]
+        command = data.get("command")
+        status = {"OPEN": "OPENING", "STOP": "STOPPED", "CLOSE": "CLOSING"}.get(command)
+        if status is None:
+            return
+        cycle = self._cycles[status_topic] = self._cycles.get(status_topic, 0) + 1
+        self._emit(status_topic, data, status, self.ack_delay)
+        if status != "STOPPED":
+            self.broker.call_later(
+                self.ack_delay + self.cycle_time, self._finish, status_topic, data, cycle
+            )
+
+    def _finish(self, status_topic: str, data: dict, cycle: int):
+        # Новая команда во время цикла продлевает его
+        if self._cycles.get(status_topic) == cycle:
+            self._emit(status_topic, data, "IDLE", 0.0)
+
+    def _emit(self, status_topic: str, data: dict, status: str, delay: float):
+        message = {
+            "status": status,
+            "user_id": data.get("user_id"),
+            "username": data.get("username"),
+            "request_id": data.get("request_id"),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }
+        self.broker.publish(status_topic, json.dumps(message).encode(), delay=delay)
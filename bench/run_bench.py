@@ -0,0 +1,542 @@
+"""Нагрузочный бенчмарк бота без сети.
+
+    python -m bench.run_bench --residents 50 --rate 0.2 --duration 20 --out bench.json
+    python -m bench.run_bench --compare bench.json
+
+Бот собирается из тех же обработчиков, что и в main(), но Bot API отвечает
+локальный FakeTelegramAPI, а MQTT — LoopbackBroker с SimulatedDevice.
+Каждый житель — отдельная задача: пауза с экспоненциальным распределением
+(в среднем 1/rate секунд), нажатие кнопки, ожидание итогового ответа бота.
+Задержка считается от постановки update в очередь приложения до того, как
+итоговое сообщение пришло в Bot API.
+
+Кроме сценария измеряются отдельно проверка доступа (кэш + расписание) и приём
+MQTT-сообщений через on_mqtt_message → MqttBridge. Результат — JSON на stdout
+или в --out; --compare печатает разницу с сохранённым прогоном.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from bench.fake_telegram import FakeTelegramAPI  # noqa: E402
+from bench.loopback_mqtt import LoopbackBroker, LoopbackClient, Message, SimulatedDevice  # noqa: E402
+
+SCHEMA_VERSION = 1
+BOT_TOKEN = "100000:bench-token"
+RESIDENT_ID_BASE = 1_000_000
+
+# Итоговые ответы бота на нажатие: префикс текста → исход.
+# Промежуточные («Команда отправлена», «Вы в очереди») итогом не считаются.
+FINAL_REPLIES = (
+    ("🔓 Калитка начала открываться", "ok"),
+    ("🔒 Калитка начала закрываться", "ok"),
+    ("⏹ Калитка остановлена", "ok"),
+    ("🔓 Калитка уже открывается", "coalesced"),
+    ("🔓 Калитка открывается — ваш запрос объединён", "coalesced"),
+    ("⚠️ Подождите", "rate_limited"),
+    ("⏳ Уже выполняется команда", "busy"),
+    ("🚫 Калитка занята", "busy"),
+    ("⏳ Устройство не ответило", "timeout"),
+    ("⌛ Время ожидания в очереди истекло", "timeout"),
+    ("❌ Ошибка отправки", "error"),
+    ("🚫", "denied"),
+    ("⏱", "denied"),
+    ("🕒", "denied"),
+)
+SUCCESS_OUTCOMES = {"ok", "coalesced"}
+TIMEOUT_OUTCOMES = {"timeout", "no_reply"}
+ERROR_OUTCOMES = {"error", "failed"}
+
+
+def classify(text: str) -> Optional[str]:
+    for prefix, outcome in FINAL_REPLIES:
+        if text.startswith(prefix):
+            return outcome
+    return None
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Ближайший ранг: значение, не превышенное pct% наблюдений."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_latencies(values: List[float]) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else None,
+    }
+
+
+def configure_environment(args, workdir: Path):
+    """Переменные окружения читаются ботом при импорте — задаём их заранее."""
+    env = {
+        "BOT_TOKEN": BOT_TOKEN,
+        "user_mosquitto": "bench",
+        "password_mosquitto": "bench",
+        "HOST": "127.0.0.1",
+        "ADMIN_CHAT_ID": "1",
+        "METRICS_PORT": "0",
+        "LOG_ECHO": "0",
+        "MIN_INTERVAL_SECONDS": str(args.min_interval),
+        "RATE_USER_BURST": str(args.user_burst),
+        "RATE_GATE_PER_MINUTE": str(args.gate_rate_per_minute),
+        "RATE_GATE_BURST": str(args.gate_burst),
+        "ARDUINO_CONFIRM_TIMEOUT": str(args.confirm_timeout),
+        "IDLE_RESET_DELAY": str(args.idle_reset_delay),
+        "MQTT_COMMAND_QOS": str(args.qos),
+        "GATES": ",".join(f"g{idx}:Калитка {idx}" for idx in range(1, args.gates + 1))
+        if args.gates > 1
+        else "",
+    }
+    os.environ.update(env)
+    os.chdir(workdir)
+
+
+def seed_database(path: Path, residents: int):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS access_control (
+                user_id TEXT, username TEXT, fio TEXT, phone TEXT,
+                aprove TEXT, access_time TEXT, updated_at TEXT, telegram_link TEXT
+            )
+            """
+        )
+        conn.executemany(
+            "INSERT INTO access_control VALUES (?, ?, ?, ?, 'yes', 'always', '', '')",
+            [
+                (str(RESIDENT_ID_BASE + idx), f"resident{idx}", f"Житель {idx}", f"9{idx:09d}")
+                for idx in range(residents)
+            ],
+        )
+    conn.close()
+
+
+class Resident:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.waiter: Optional[asyncio.Future] = None
+
+
+class Scenario:
+    def __init__(self, bot_module, app, api: FakeTelegramAPI, args):
+        self.bot = bot_module
+        self.app = app
+        self.api = api
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.residents: Dict[int, Resident] = {}
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.latencies: List[float] = []
+        self.success_latencies: List[float] = []
+        self.outcomes: Counter = Counter()
+        self.presses = 0
+        api.subscribe(self._on_bot_message)
+
+    def _on_bot_message(self, chat_id: int, method: str, text: str, now: float):
+        resident = self.residents.get(chat_id)
+        if resident is None or resident.waiter is None or resident.waiter.done():
+            return
+        outcome = classify(text)
+        if outcome is not None:
+            resident.waiter.set_result((outcome, now))
+
+    def _make_update(self, user_id: int, text: str):
+        from telegram import Update
+
+        return Update.de_json(
+            {
+                "update_id": next(self.update_ids),
+                "message": {
+                    "message_id": next(self.message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {
+                        "id": user_id,
+                        "is_bot": False,
+                        "first_name": "Житель",
+                        "username": f"resident{user_id - RESIDENT_ID_BASE}",
+                    },
+                    "text": text,
+                },
+            },
+            self.app.bot,
+        )
+
+    async def _press(self, resident: Resident, text: str):
+        loop = asyncio.get_running_loop()
+        resident.waiter = loop.create_future()
+        self.presses += 1
+        started_at = time.monotonic()
+        await self.app.update_queue.put(self._make_update(resident.user_id, text))
+        try:
+            outcome, finished_at = await asyncio.wait_for(
+                resident.waiter, timeout=self.args.request_timeout
+            )
+        except asyncio.TimeoutError:
+            outcome, finished_at = "no_reply", time.monotonic()
+        finally:
+            resident.waiter = None
+        latency = finished_at - started_at
+        self.outcomes[outcome] += 1
+        self.latencies.append(latency)
+        if outcome in SUCCESS_OUTCOMES:
+            self.success_latencies.append(latency)
+
+    async def _resident_loop(self, resident: Resident, stop_at: float, rng: random.Random):
+        gates = list(self.bot.gate_registry)
+        while True:
+            delay = rng.expovariate(self.args.rate)
+            if time.monotonic() + delay >= stop_at:
+                return
+            await asyncio.sleep(delay)
+            gate = rng.choice(gates)
+            await self._press(resident, self.bot.gate_registry.button("🚪 Открыть", gate))
+
+    async def run(self) -> dict:
+        for idx in range(self.args.residents):
+            user_id = RESIDENT_ID_BASE + idx
+            self.residents[user_id] = Resident(user_id)
+
+        started_at = time.monotonic()
+        stop_at = started_at + self.args.duration
+        await asyncio.gather(
+            *(
+                self._resident_loop(resident, stop_at, random.Random(self.random.random()))
+                for resident in self.residents.values()
+            )
+        )
+        elapsed = time.monotonic() - started_at
+
+        completed = sum(self.outcomes.values())
+        succeeded = sum(self.outcomes[o] for o in SUCCESS_OUTCOMES)
+        return {
+            "elapsed_s": elapsed,
+            "presses": self.presses,
+            "completed": completed,
+            "succeeded": succeeded,
+            "throughput_rps": completed / elapsed if elapsed else 0.0,
+            "success_throughput_rps": succeeded / elapsed if elapsed else 0.0,
+            "latency_s": summarize_latencies(self.latencies),
+            "success_latency_s": summarize_latencies(self.success_latencies),
+            "outcomes": dict(self.outcomes),
+            "error_rate": _rate(self.outcomes, ERROR_OUTCOMES, completed),
+            "timeout_rate": _rate(self.outcomes, TIMEOUT_OUTCOMES, completed),
+            "rejection_rate": _rate(
+                self.outcomes, {"rate_limited", "busy", "denied"}, completed
+            ),
+        }
+
+
+def _rate(outcomes: Counter, keys, total: int) -> float:
+    return sum(outcomes[key] for key in keys) / total if total else 0.0
+
+
+async def bench_access_checks(bot_module, residents: int, iterations: int) -> dict:
+    """Решение о доступе из кэша/БД плюс проверка расписания."""
+    latencies = []
+    started_at = time.perf_counter()
+    for idx in range(iterations):
+        user_id = str(RESIDENT_ID_BASE + idx % residents)
+        t0 = time.perf_counter()
+        decision = await bot_module.get_access_decision(user_id)
+        bot_module.check_access_time(decision.access_time)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started_at
+    return {
+        "iterations": iterations,
+        "ops_per_s": iterations / elapsed if elapsed else 0.0,
+        "latency_s": summarize_latencies(latencies),
+    }
+
+
+async def bench_mqtt_ingest(bot_module, client: LoopbackClient, messages: int) -> dict:
+    """on_mqtt_message из стороннего потока → мост → обработчик на event loop.
+
+    Статус IDLE без user_id: разбор, маршрутизация по калитке и проверка
+    GateStateMachine. Все сообщения, кроме первого, — повторы и отсеиваются
+    до release_gate; сообщений в Telegram нет.
+    """
+    bridge = bot_module.mqtt_bridge
+    gate = bot_module.gate_registry.default
+    payload = json.dumps({"status": "IDLE"}).encode()
+    target = bridge.processed + bridge.failed + messages
+    userdata = client._userdata
+
+    def produce():
+        for _ in range(messages):
+            bot_module.on_mqtt_message(client, userdata, Message(gate.status_topic, payload))
+
+    started_at = time.perf_counter()
+    producer = threading.Thread(target=produce, name="bench-mqtt-producer")
+    producer.start()
+    while bridge.processed + bridge.failed < target:
+        await asyncio.sleep(0.001)
+        if time.perf_counter() - started_at > 60:
+            break
+    elapsed = time.perf_counter() - started_at
+    producer.join()
+    return {
+        "messages": messages,
+        "msgs_per_s": messages / elapsed if elapsed else 0.0,
+        "elapsed_s": elapsed,
+        "bridge": bridge.stats(),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "-C", str(ROOT), "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+async def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="gatebot-bench-"))
+    configure_environment(args, workdir)
+    seed_database(workdir / "access.db", args.residents)
+
+    import OpenGateBot as bot_module
+    from telegram.ext import ApplicationBuilder
+
+    api = FakeTelegramAPI(latency=args.telegram_latency, error_rate=args.telegram_error_rate, seed=args.seed)
+    await api.start()
+
+    broker = LoopbackBroker()
+    broker.start()
+    device = SimulatedDevice(
+        broker,
+        {gate.command_topic: gate.status_topic for gate in bot_module.gate_registry},
+        ack_delay=args.device_latency,
+        cycle_time=args.cycle_time,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    )
+    device.start()
+
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(api.base_url)
+        .updater(None)
+        .concurrent_updates(True)
+        .persistence(bot_module.persistence)
+        .build()
+    )
+    bot_module.register_handlers(app)
+    await bot_module.init_db_pool()
+    await app.initialize()
+    await app.start()
+
+    client = LoopbackClient(broker, puback_latency=args.puback_latency)
+    bot_module.init_mqtt(app, app, client=client)
+    for idx in range(min(args.subscribers, args.residents)):
+        for gate in bot_module.gate_registry:
+            bot_module.state_fanout.subscribe(str(RESIDENT_ID_BASE + idx), gate.id)
+    await asyncio.sleep(0.05)  # on_connect и подписки в потоке брокера
+
+    try:
+        scenario = await Scenario(bot_module, app, api, args).run()
+        # Дать устройству завершить циклы, прежде чем мерить приём MQTT
+        await asyncio.sleep(args.cycle_time + args.device_latency + 0.1)
+        micro = {
+            "access_check": await bench_access_checks(
+                bot_module, args.residents, args.access_iterations
+            ),
+            "mqtt_ingest": await bench_mqtt_ingest(bot_module, client, args.mqtt_messages),
+        }
+        bot_stats = {
+            "pending_commands": bot_module.pending_commands.stats(),
+            "publisher": bot_module.mqtt_publisher.stats(),
+            "user_rate_limit": bot_module.user_rate_limiter.stats(),
+            "gate_rate_limit": bot_module.gate_rate_limiter.stats(),
+            "queues": {gate.id: gate.queue.stats() for gate in bot_module.gate_registry},
+            "access_cache": bot_module.get_cache_stats(),
+            "state_fanout": bot_module.state_fanout.stats(),
+            "outbox": bot_module.outbox.stats(),
+            "audit_log": bot_module.audit_log.stats(),
+            "persistence": bot_module.persistence.stats(),
+            "timers": bot_module.timers.stats(),
+            "status_messages": bot_module.status_renderer.stats(),
+            "gate_events": {gate.id: gate.machine.stats() for gate in bot_module.gate_registry},
+        }
+    finally:
+        await app.stop()
+        await bot_module.on_stop(app)
+        await app.shutdown()
+        await bot_module.on_shutdown(app)
+        broker.stop()
+        await api.stop()
+        current = asyncio.current_task()
+        leftovers = [t for t in asyncio.all_tasks() if t is not current]
+        for task in leftovers:
+            task.cancel()
+        await asyncio.gather(*leftovers, return_exceptions=True)
+
+    return {
+        "schema": SCHEMA_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {
+            key: getattr(args, key)
+            for key in (
+                "residents", "subscribers", "rate", "duration", "gates", "device_latency", "cycle_time",
+                "drop_rate", "telegram_latency", "telegram_error_rate", "puback_latency",
+                "qos", "min_interval", "user_burst", "gate_rate_per_minute", "gate_burst",
+                "confirm_timeout", "request_timeout", "seed",
+            )
+        },
+        "scenario": scenario,
+        "micro": micro,
+        "bot": bot_stats,
+        "telegram": api.stats(),
+        "device": {"commands": device.commands, "dropped": device.dropped},
+        "broker": {"delivered": broker.delivered},
+    }
+
+
+# Что сравнивать между прогонами и в какую сторону лучше
+COMPARE_KEYS = (
+    ("scenario.throughput_rps", "higher"),
+    ("scenario.success_throughput_rps", "higher"),
+    ("scenario.latency_s.p50", "lower"),
+    ("scenario.latency_s.p95", "lower"),
+    ("scenario.latency_s.p99", "lower"),
+    ("scenario.error_rate", "lower"),
+    ("scenario.timeout_rate", "lower"),
+    ("micro.access_check.ops_per_s", "higher"),
+    ("micro.access_check.latency_s.p99", "lower"),
+    ("micro.mqtt_ingest.msgs_per_s", "higher"),
+)
+
+
+def _lookup(data: dict, dotted: str):
+    for part in dotted.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def compare(baseline: dict, current: dict) -> List[dict]:
+    rows = []
+    for key, better in COMPARE_KEYS:
+        before, after = _lookup(baseline, key), _lookup(current, key)
+        change = None
+        if isinstance(before, (int, float)) and isinstance(after, (int, float)) and before:
+            change = (after - before) / before
+        rows.append({"metric": key, "baseline": before, "current": after, "change": change, "better": better})
+    return rows
+
+
+def print_comparison(rows: List[dict]):
+    for row in rows:
+        change = row["change"]
+        if change is None:
+            verdict, change_text = "", "n/a"
+        else:
+            improved = change > 0 if row["better"] == "higher" else change < 0
+            verdict = "" if abs(change) < 0.05 else ("лучше" if improved else "хуже")
+            change_text = f"{change:+.1%}"
+        print(
+            f"{row['metric']:<40} {_fmt(row['baseline']):>12} → {_fmt(row['current']):>12}"
+            f"  {change_text:>8} {verdict}",
+            file=sys.stderr,
+        )
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Оффлайн-бенчмарк OpenGateBot")
+    parser.add_argument("--residents", type=int, default=50, help="число жителей")
+    parser.add_argument(
+        "--subscribers", type=int, default=0, help="сколько жителей подписаны на состояние"
+    )
+    parser.add_argument("--rate", type=float, default=0.2, help="нажатий в секунду на жителя")
+    parser.add_argument("--duration", type=float, default=20.0, help="длительность сценария, с")
+    parser.add_argument("--gates", type=int, default=1, help="число калиток")
+    parser.add_argument("--device-latency", type=float, default=0.05, help="ответ устройства, с")
+    parser.add_argument("--cycle-time", type=float, default=1.0, help="цикл до IDLE, с")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="доля команд без ответа")
+    parser.add_argument("--telegram-latency", type=float, default=0.005, help="задержка Bot API, с")
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--puback-latency", type=float, default=0.002, help="задержка PUBACK, с")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1))
+    parser.add_argument("--min-interval", type=int, default=1, help="MIN_INTERVAL_SECONDS")
+    parser.add_argument("--user-burst", type=int, default=3, help="RATE_USER_BURST")
+    parser.add_argument("--gate-rate-per-minute", type=float, default=600, help="RATE_GATE_PER_MINUTE")
+    parser.add_argument("--gate-burst", type=int, default=20, help="RATE_GATE_BURST")
+    parser.add_argument("--confirm-timeout", type=int, default=3, help="ARDUINO_CONFIRM_TIMEOUT")
+    parser.add_argument("--idle-reset-delay", type=int, default=15, help="IDLE_RESET_DELAY")
+    parser.add_argument("--request-timeout", type=float, default=30.0, help="ожидание итога нажатия, с")
+    parser.add_argument("--access-iterations", type=int, default=20000)
+    parser.add_argument("--mqtt-messages", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="записать JSON в файл вместо stdout")
+    parser.add_argument("--compare", help="сравнить с сохранённым JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+    out = Path(args.out).resolve() if args.out else None
+
+    # Бот печатает отладку в stdout — там должен остаться только JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        result = asyncio.run(run(args))
+    if baseline is not None:
+        result["comparison"] = compare(baseline, result)
+        print_comparison(result["comparison"])
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if out:
+        out.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
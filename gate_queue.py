@@ -0,0 +1,88 @@
+"""Очередь команд к одной калитке.
+
+Пока калиткой управляет другой житель, новые запросы не отклоняются, а встают
+в FIFO-очередь; следующий запрос запускается, когда устройство вернулось в IDLE.
+Одинаковые команды, пришедшие подряд, объединяются в один билет: несколько
+«Открыть» в очереди дают один физический цикл открытия, а все их авторы
+получают уведомление.
+"""
+
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+
+@dataclass
+class Ticket:
+    user_id: str
+    username: str
+    command: str
+    created_at: float = field(default_factory=time.monotonic)
+    # Присоединившиеся к этому билету: [(user_id, username)]
+    riders: List[Tuple[str, str]] = field(default_factory=list)
+
+    def user_ids(self) -> List[str]:
+        return [self.user_id] + [user_id for user_id, _ in self.riders]
+
+
+class GateQueue:
+    def __init__(self, ttl: float = 120.0):
+        self.ttl = ttl
+        self._waiting: "deque[Ticket]" = deque()
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dispatched = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def position(self, user_id: str) -> Optional[int]:
+        for idx, ticket in enumerate(self._waiting, start=1):
+            if user_id in ticket.user_ids():
+                return idx
+        return None
+
+    def enqueue(self, user_id: str, username: str, command: str) -> Tuple[int, bool]:
+        """Ставит запрос в очередь. Возвращает (позиция, объединён ли с соседним)."""
+        position = self.position(user_id)
+        if position is not None:
+            return position, True
+
+        if self._waiting and self._waiting[-1].command == command:
+            self._waiting[-1].riders.append((user_id, username))
+            self.coalesced += 1
+            return len(self._waiting), True
+
+        self._waiting.append(Ticket(user_id, username, command))
+        self.enqueued += 1
+        return len(self._waiting), False
+
+    def pop_next(self) -> Tuple[Optional[Ticket], List[Ticket]]:
+        """Следующий билет и список билетов, просроченных по ttl."""
+        expired = []
+        now = time.monotonic()
+        while self._waiting:
+            ticket = self._waiting.popleft()
+            if now - ticket.created_at > self.ttl:
+                expired.append(ticket)
+                self.expired += 1
+                continue
+            self.dispatched += 1
+            return ticket, expired
+        return None, expired
+
+    def push_front(self, ticket: Ticket):
+        """Вернуть выданный билет первым (калитку занял другой процесс)."""
+        self._waiting.appendleft(ticket)
+        self.dispatched -= 1
+
+    def stats(self) -> dict:
+        return {
+            "waiting": len(self._waiting),
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "dispatched": self.dispatched,
+            "expired": self.expired,
+        }
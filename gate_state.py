@@ -0,0 +1,165 @@
+"""Состояния калитки и фильтр событий устройства.
+
+Устройство сообщает одно из STATES; переходы между ними ограничены
+TRANSITIONS. По MQTT события могут прийти повторно (QoS 1, переподключение)
+или не по порядку (задержка у брокера), поэтому каждое событие сначала
+проверяет GateStateMachine калитки — до смены состояния, сопоставления
+с ожидающей командой и сообщений в Telegram:
+
+- unknown — статус не из STATES (эхо команды OPEN/STOP/CLOSE, мусор);
+- stale — seq или timestamp меньше, чем у последнего принятого события;
+- duplicate — тот же seq или то же событие (статус, request_id, user_id),
+  что и последнее принятое;
+- transition — переход, которого не бывает (остановить стоящую калитку).
+
+Переход проверяется от последнего статуса самого устройства: бот сбрасывает
+состояние калитки в IDLE по таймауту подтверждения и резервному сбросу, а
+устройство в это время может ещё открываться, и его STOPPED/IDLE не должны
+отбрасываться как невозможные.
+
+Порядок определяется полем seq, если прошивка его присылает, иначе
+timestamp. Сильный откат (seq снова с 0–1, часы назад больше чем на
+resync_after секунд) считается перезагрузкой устройства: событие
+принимается, отсчёт начинается заново.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, FrozenSet, Optional
+
+from dateutil.parser import isoparse
+
+STATES = ("IDLE", "OPENING", "CLOSING", "STOPPED")
+
+TRANSITIONS: Dict[str, FrozenSet[str]] = {
+    "IDLE": frozenset({"OPENING", "CLOSING"}),
+    "OPENING": frozenset({"STOPPED", "CLOSING", "IDLE"}),
+    "CLOSING": frozenset({"STOPPED", "OPENING", "IDLE"}),
+    "STOPPED": frozenset({"OPENING", "CLOSING", "IDLE"}),
+}
+
+DROP_REASONS = ("unknown", "stale", "duplicate", "transition")
+
+
+@dataclass(frozen=True)
+class DeviceEvent:
+    status: str
+    user_id: Optional[str] = None
+    request_id: Optional[str] = None
+    seq: Optional[int] = None
+    timestamp: Optional[datetime] = None
+
+    @classmethod
+    def from_payload(cls, status: str, data: dict) -> "DeviceEvent":
+        user_id = data.get("user_id")
+        request_id = data.get("request_id")
+        return cls(
+            status=str(status).strip().upper(),
+            user_id=str(user_id) if user_id else None,
+            request_id=str(request_id) if request_id else None,
+            seq=_parse_seq(data.get("seq")),
+            timestamp=_parse_timestamp(data.get("timestamp")),
+        )
+
+    @property
+    def identity(self) -> tuple:
+        return (self.status, self.request_id, self.user_id)
+
+
+def _parse_seq(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return isoparse(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _seconds_between(earlier: datetime, later: datetime) -> Optional[float]:
+    """later - earlier в секундах; None, если отметки несравнимы (naive и aware)."""
+    try:
+        return (later - earlier).total_seconds()
+    except TypeError:
+        return None
+
+
+class GateStateMachine:
+    def __init__(self, resync_after: float = 300.0):
+        self.resync_after = resync_after
+        self.last_seq: Optional[int] = None
+        self.last_timestamp: Optional[datetime] = None
+        self.last_identity: Optional[tuple] = None
+        self.device_state: Optional[str] = None
+        self.accepted = 0
+        self.resyncs = 0
+        self.dropped: Counter = Counter()
+
+    def accept(self, state: str, event: DeviceEvent) -> Optional[str]:
+        """Проверяет событие; state — состояние калитки у бота.
+
+        state нужен, только пока устройство ещё ничего не прислало (или
+        перезагрузилось), дальше переход проверяется от device_state.
+        Возвращает причину из DROP_REASONS или None, если событие принято
+        (тогда оно становится последним для следующих проверок).
+        """
+        reason = self._check(state, event)
+        if reason:
+            self.dropped[reason] += 1
+            return reason
+        if event.seq is not None:
+            self.last_seq = event.seq
+        if event.timestamp is not None:
+            self.last_timestamp = event.timestamp
+        self.last_identity = event.identity
+        self.device_state = event.status
+        self.accepted += 1
+        return None
+
+    def _check(self, state: str, event: DeviceEvent) -> Optional[str]:
+        if event.status not in TRANSITIONS:
+            return "unknown"
+
+        ordered = False
+        if event.seq is not None and self.last_seq is not None:
+            if event.seq == self.last_seq:
+                return "duplicate"
+            if event.seq < self.last_seq:
+                if event.seq > 1:
+                    return "stale"
+                self._resync()
+            ordered = True
+        if not ordered and event.timestamp is not None and self.last_timestamp is not None:
+            delta = _seconds_between(self.last_timestamp, event.timestamp)
+            if delta is not None and delta < 0:
+                if -delta <= self.resync_after:
+                    return "stale"
+                self._resync()
+
+        state = self.device_state or state
+        if event.status == state:
+            # Тот же статус от другой команды (объединённое открытие) — не повтор
+            return "duplicate" if event.identity == self.last_identity else None
+        if event.status not in TRANSITIONS.get(state, TRANSITIONS["IDLE"]):
+            return "transition"
+        return None
+
+    def _resync(self):
+        self.resyncs += 1
+        self.last_seq = None
+        self.last_timestamp = None
+        self.device_state = None
+
+    def stats(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "resyncs": self.resyncs,
+            **{f"dropped_{reason}": self.dropped[reason] for reason in DROP_REASONS},
+        }
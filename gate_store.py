@@ -0,0 +1,252 @@
+"""Аренда калиток и общее состояние процессов бота в access.db.
+
+Активный пользователь калитки — это аренда (lease) в таблице gate_state:
+владелец-процесс (holder), срок (lease_until) и токен ограждения (fence).
+claim() берёт аренду одним upsert — если калитка свободна, срок прежней
+аренды вышел или аренда уже наша; fence растёт при каждой смене владельца.
+Пока пользователь активен, процесс продлевает аренду (renew) раз в треть
+срока и перед каждой публикацией команды: если аренду забрали, команда не
+уходит — процесс, который «проспал» свой срок, не откроет калитку второй
+раз. Упавший процесс ничего не продлевает, и через GATE_LEASE_TTL калитку
+может взять другой.
+
+LeaderLease — та же аренда для всего экземпляра бота (таблица leases):
+апдейты Telegram и статусы MQTT принимает только ведущий, резервный
+экземпляр ждёт, пока аренда ведущего не истечёт или не будет снята при
+остановке.
+
+Освобождает калитку статус IDLE от устройства (exec_gate_event) или сам
+процесс при таймауте. В gate_commands лежат команды в полёте режима
+воркеров: по request_id фронт находит воркер, который ждёт подтверждения.
+
+Хранилище включается в режиме воркеров и с STANDBY=1; один процесс без
+резерва держит активного пользователя только в памяти.
+"""
+
+import asyncio
+import sqlite3
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import access_db
+from access_db_async import get_pool
+
+
+@dataclass(frozen=True)
+class GateLease:
+    user_id: Optional[str]
+    holder: Optional[str]
+    fence: int
+    lease_until: Optional[float]
+    mine: bool
+
+
+class SQLiteGateStore:
+    def __init__(self, worker: int, holder: str, ttl: float = 10.0):
+        self.worker = worker
+        self.holder = holder
+        self.ttl = ttl
+        # Наши аренды: gate_id → GateLease
+        self._leases: Dict[str, GateLease] = {}
+        self.claims = 0
+        self.conflicts = 0
+        self.lost = 0
+        self.errors = 0
+
+    async def reset(self, stale_after: float) -> int:
+        """При запуске воркера: снять его старые команды (старше stale_after) и аренды."""
+        try:
+            return await get_pool().write(
+                access_db.exec_reset_worker, self.worker, self.holder, stale_after
+            )
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB gate_store reset error] {e}")
+            return 0
+
+    async def get(self, gate_id: str) -> Optional[dict]:
+        try:
+            return await get_pool().read(access_db.query_gate_state, gate_id)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB gate_store get error] {e}")
+            return None
+
+    async def claim(self, gate_id: str, user_id: str) -> Optional[GateLease]:
+        """Аренда калитки после попытки её взять; None — хранилище недоступно."""
+        try:
+            row = await get_pool().write(
+                access_db.exec_claim_gate, gate_id, user_id, self.worker, self.holder, self.ttl
+            )
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB gate_store claim error] {e}")
+            return None
+        if row is None:
+            return None
+        lease = GateLease(
+            user_id=row["active_user_id"],
+            holder=row["holder"],
+            fence=row["fence"],
+            lease_until=row["lease_until"],
+            mine=row["holder"] == self.holder and row["active_user_id"] == str(user_id),
+        )
+        if lease.mine:
+            self.claims += 1
+            self._leases[gate_id] = lease
+        else:
+            self.conflicts += 1
+        return lease
+
+    def fence(self, gate_id: str) -> Optional[int]:
+        lease = self._leases.get(gate_id)
+        return lease.fence if lease else None
+
+    async def renew(self, gate_id: str) -> Optional[bool]:
+        """Продлить нашу аренду: False — её забрали, None — не знаем (нет аренды, ошибка БД)."""
+        lease = self._leases.get(gate_id)
+        if lease is None:
+            return None
+        try:
+            held = await get_pool().write(
+                access_db.exec_renew_gate, gate_id, self.holder, lease.fence, self.ttl
+            )
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB gate_store renew error] {e}")
+            return None
+        if not held and self._leases.get(gate_id) is lease:
+            del self._leases[gate_id]
+            self.lost += 1
+        return held
+
+    async def release(self, gate_id: str, user_id: str) -> bool:
+        lease = self._leases.get(gate_id)
+        fence = None
+        if lease is not None and lease.user_id == str(user_id):
+            del self._leases[gate_id]
+            fence = lease.fence
+        try:
+            return await get_pool().write(access_db.exec_release_gate, gate_id, user_id, fence)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB gate_store release error] {e}")
+            return False
+
+    async def release_all(self):
+        """При остановке: снять свои аренды, чтобы резервный экземпляр не ждал срока."""
+        for gate_id, lease in list(self._leases.items()):
+            await self.release(gate_id, lease.user_id)
+
+    async def event(self, gate_id: str, state: str, user_id: Optional[str]):
+        """Статус устройства: состояние калитки; IDLE снимает аренду пользователя."""
+        lease = self._leases.get(gate_id)
+        if state == "IDLE" and lease is not None and lease.user_id == str(user_id):
+            del self._leases[gate_id]
+        try:
+            await get_pool().write(access_db.exec_gate_event, gate_id, state, user_id)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB gate_store event error] {e}")
+
+    async def add_command(self, request_id: str, gate_id: str, user_id: str, command: str):
+        try:
+            await get_pool().write(
+                access_db.exec_add_gate_command,
+                request_id,
+                gate_id,
+                user_id,
+                command,
+                self.worker,
+                self.holder,
+            )
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB gate_store add_command error] {e}")
+
+    async def remove_command(self, request_id: str):
+        try:
+            await get_pool().write(access_db.exec_remove_gate_command, request_id)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB gate_store remove_command error] {e}")
+
+    def stats(self) -> dict:
+        return {
+            "worker": self.worker,
+            "holder": self.holder,
+            "leases": len(self._leases),
+            "claims": self.claims,
+            "conflicts": self.conflicts,
+            "lost": self.lost,
+            "errors": self.errors,
+        }
+
+
+class LeaderLease:
+    def __init__(self, holder: str, ttl: float = 10.0, name: str = "bot"):
+        self.holder = holder
+        self.ttl = ttl
+        self.name = name
+        self.fence: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.renewals = 0
+        self.errors = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return self.fence is not None
+
+    async def acquire(self) -> Optional[bool]:
+        """Взять или продлить аренду; None — ошибка БД (прежнее состояние не меняется)."""
+        try:
+            fence = await get_pool().write(
+                access_db.exec_acquire_lease, self.name, self.holder, self.ttl
+            )
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB leader error] {e}")
+            return None
+        self.fence = fence
+        return fence is not None
+
+    async def wait(self, on_standby: Optional[Callable[[Optional[dict]], None]] = None):
+        """Ждёт аренды; on_standby(текущая аренда) — один раз, если ведущий уже есть."""
+        notified = False
+        while not await self.acquire():
+            if on_standby is not None and not notified:
+                notified = True
+                try:
+                    current = await get_pool().read(access_db.query_lease, self.name)
+                except sqlite3.Error:
+                    current = None
+                on_standby(current)
+            await asyncio.sleep(self.ttl / 3)
+
+    def keep(self, on_lost: Callable[[], None]):
+        """Продлевает аренду раз в треть срока; потеряли — on_lost() и стоп."""
+        self._task = asyncio.get_running_loop().create_task(self._keep(on_lost))
+
+    async def _keep(self, on_lost: Callable[[], None]):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            held = await self.acquire()
+            if held is False:
+                on_lost()
+                return
+            if held:
+                self.renewals += 1
+
+    async def release(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.fence is None:
+            return
+        self.fence = None
+        try:
+            await get_pool().write(access_db.exec_release_lease, self.name, self.holder)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"[DB leader error] {e}")
@@ -0,0 +1,153 @@
+"""Конфигурация калиток/шлагбаумов и их состояние.
+
+Калитки задаются переменной окружения GATES:
+    GATES="main:Калитка,barrier:Шлагбаум"
+или JSON-списком, если нужно переопределить топики:
+    GATES='[{"id": "main", "name": "Калитка",
+             "command_topic": "gate/command", "status_topic": "gate/status"}]'
+По умолчанию топики gate/<id>/command и gate/<id>/status, статусы всех
+калиток принимаются подпиской gate/+/status.
+
+Без GATES используется одна калитка "main" на старых топиках
+gate/command и gate/status — так работает текущая прошивка.
+
+У каждой калитки своё состояние, свой замок и свой активный пользователь,
+поэтому команды на разные калитки не ждут друг друга.
+"""
+
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from gate_queue import GateQueue
+from gate_state import GateStateMachine
+
+GATE_QUEUE_TTL = float(os.getenv("GATE_QUEUE_TTL", "120"))
+STATUS_WILDCARD = "gate/+/status"
+BUTTON_SEPARATOR = " · "
+
+
+@dataclass
+class Gate:
+    id: str
+    name: str
+    command_topic: str
+    status_topic: str
+    state: str = "IDLE"
+    active_user_id: Optional[str] = None
+    active_user_since: Optional[datetime] = None
+    last_status: Optional[dict] = None
+    # Пользователи, чья команда на этой калитке ждёт подтверждения
+    pending: set = field(default_factory=set)
+    queue: GateQueue = field(
+        default_factory=lambda: GateQueue(GATE_QUEUE_TTL), repr=False
+    )
+    # Отсев повторных и запоздавших событий устройства
+    machine: GateStateMachine = field(default_factory=GateStateMachine, repr=False)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    def set_active(self, user_id: Optional[str], since: Optional[datetime] = None):
+        self.active_user_id = user_id
+        self.active_user_since = since if user_id else None
+
+
+class GateRegistry:
+    def __init__(self, gates: List[Gate]):
+        if not gates:
+            raise ValueError("не задано ни одной калитки")
+        self._gates: Dict[str, Gate] = {}
+        self._by_status_topic: Dict[str, Gate] = {}
+        for gate in gates:
+            if gate.id in self._gates:
+                raise ValueError(f"калитка {gate.id!r} задана дважды")
+            self._gates[gate.id] = gate
+            self._by_status_topic[gate.status_topic] = gate
+        self.default = gates[0]
+
+    def __iter__(self):
+        return iter(self._gates.values())
+
+    def __len__(self):
+        return len(self._gates)
+
+    def get(self, gate_id: Optional[str]) -> Optional[Gate]:
+        if gate_id is None:
+            return self.default
+        return self._gates.get(gate_id)
+
+    def for_topic(self, topic: str) -> Optional[Gate]:
+        gate = self._by_status_topic.get(topic)
+        if gate:
+            return gate
+        gate_id = _wildcard_gate_id(topic)
+        return self._gates.get(gate_id) if gate_id else None
+
+    def subscriptions(self) -> List[str]:
+        topics = [STATUS_WILDCARD]
+        for gate in self:
+            if _wildcard_gate_id(gate.status_topic) is None:
+                topics.append(gate.status_topic)
+        return topics
+
+    def button(self, label: str, gate: Gate) -> str:
+        """Текст кнопки; при нескольких калитках к нему добавляется имя."""
+        if len(self) == 1:
+            return label
+        return f"{label}{BUTTON_SEPARATOR}{gate.name}"
+
+    def from_button(self, text: Optional[str]) -> Optional[Gate]:
+        """Калитка по тексту нажатой кнопки (без имени — калитка по умолчанию)."""
+        if not text or BUTTON_SEPARATOR not in text:
+            return self.default if len(self) == 1 else None
+        name = text.rsplit(BUTTON_SEPARATOR, 1)[1].strip()
+        for gate in self:
+            if gate.name == name:
+                return gate
+        return None
+
+    def queued_count(self) -> int:
+        return sum(len(gate.queue) for gate in self)
+
+    def pending_count(self) -> int:
+        return sum(len(gate.pending) for gate in self)
+
+
+def _wildcard_gate_id(topic: str) -> Optional[str]:
+    """id калитки, если топик попадает под gate/+/status."""
+    parts = topic.split("/")
+    if len(parts) == 3 and parts[0] == "gate" and parts[2] == "status":
+        return parts[1]
+    return None
+
+
+def _make_gate(item: dict) -> Gate:
+    gate_id = str(item["id"]).strip()
+    if not gate_id or "/" in gate_id or "+" in gate_id or "#" in gate_id:
+        raise ValueError(f"некорректный id калитки: {gate_id!r}")
+    return Gate(
+        id=gate_id,
+        name=str(item.get("name") or gate_id),
+        command_topic=item.get("command_topic") or f"gate/{gate_id}/command",
+        status_topic=item.get("status_topic") or f"gate/{gate_id}/status",
+    )
+
+
+def load_gates(spec: Optional[str] = None) -> GateRegistry:
+    spec = os.getenv("GATES", "") if spec is None else spec
+    spec = spec.strip()
+    if not spec:
+        return GateRegistry(
+            [Gate("main", "Калитка", "gate/command", "gate/status")]
+        )
+
+    if spec.startswith("["):
+        items = json.loads(spec)
+    else:
+        items = []
+        for part in spec.split(","):
+            gate_id, _, name = part.strip().partition(":")
+            items.append({"id": gate_id, "name": name.strip()})
+    return GateRegistry([_make_gate(item) for item in items])
@@ -0,0 +1,162 @@
+"""Готовые клавиатуры главного меню.
+
+Набор возможных меню мал: статус заявки (none/no/pending/yes) и, для
+одобренных, состояние кнопки каждой калитки (IDLE/OPENING/STOPPED/CLOSING).
+Все варианты строятся один раз при запуске и дальше только выдаются из
+неизменяемой таблицы — без создания списков и объектов на каждое сообщение.
+
+python-telegram-bot сериализует reply_markup через to_dict() при каждом
+запросе; у FrozenReplyKeyboardMarkup словарь и JSON посчитаны заранее.
+"""
+
+import itertools
+import json
+from types import MappingProxyType
+from typing import Dict, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+MENU_STATUSES = ("none", "no", "pending", "yes")
+GATE_STATES = ("IDLE", "OPENING", "STOPPED", "CLOSING")
+
+GATE_BUTTONS = {
+    "IDLE": "🚪 Открыть",
+    "OPENING": "⏹ Остановить",
+    "STOPPED": "🔒 Закрыть",
+    "CLOSING": "⏹ Остановить",
+}
+# Команда, которую отправляет кнопка в этом состоянии
+GATE_COMMANDS = {
+    "IDLE": "OPEN",
+    "OPENING": "STOP",
+    "STOPPED": "CLOSE",
+    "CLOSING": "STOP",
+}
+GATE_CALLBACK_PREFIX = "gate:"
+
+# Больше вариантов заранее не строим: остальные создаются при первом запросе
+MAX_PRECOMPUTED = 4096
+
+States = Tuple[str, ...]
+
+
+class FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    """ReplyKeyboardMarkup с заранее посчитанными to_dict() и to_json().
+
+    Возвращаемый словарь общий для всех запросов — изменять его нельзя.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self._unfrozen():
+            self._cached_dict = super().to_dict()
+            self._cached_json = json.dumps(self._cached_dict, ensure_ascii=False)
+
+    def to_dict(self, recursive: bool = True):
+        if recursive:
+            return self._cached_dict
+        return super().to_dict(recursive=False)
+
+    def to_json(self) -> str:
+        return self._cached_json
+
+
+def _markup(rows) -> FrozenReplyKeyboardMarkup:
+    return FrozenReplyKeyboardMarkup(rows, resize_keyboard=True)
+
+
+def effective_state(state: Optional[str]) -> str:
+    """Неизвестное состояние показываем как IDLE («Открыть»)."""
+    return state if state in GATE_BUTTONS else "IDLE"
+
+
+class KeyboardTable:
+    """Таблица (статус, состояния кнопок калиток) → клавиатура.
+
+    states — кортеж состояний в порядке калиток реестра; для одной калитки
+    ключ фактически (статус, состояние).
+    """
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._gates = tuple(registry)
+        self.idle_states: States = ("IDLE",) * len(self._gates)
+
+        static = {
+            "no": _markup([["🔄 Проверить статус", "ℹ️ Помощь", "🏁 Начало"]]),
+            "pending": _markup(
+                [["🔄 Проверить статус", "🔁 Изменить номер", "ℹ️ Помощь", "🏁 Начало"]]
+            ),
+            "none": _markup(
+                [
+                    ["📋 Зарегистрироваться"],
+                    ["🔄 Проверить статус", "ℹ️ Помощь", "🏁 Начало"],
+                ]
+            ),
+        }
+        self._static = MappingProxyType(static)
+
+        approved: Dict[States, FrozenReplyKeyboardMarkup] = {}
+        if len(GATE_STATES) ** len(self._gates) <= MAX_PRECOMPUTED:
+            for states in itertools.product(GATE_STATES, repeat=len(self._gates)):
+                approved[states] = self._build_approved(states)
+        else:
+            approved[self.idle_states] = self._build_approved(self.idle_states)
+        self._approved = approved
+
+        # Inline-кнопка у сообщения-статуса калитки: gate:<id>:<команда>
+        self._actions = MappingProxyType(
+            {
+                (gate.id, state): InlineKeyboardMarkup(
+                    [
+                        [
+                            InlineKeyboardButton(
+                                label,
+                                callback_data=f"{GATE_CALLBACK_PREFIX}{gate.id}:{GATE_COMMANDS[state]}",
+                            )
+                        ]
+                    ]
+                )
+                for gate in self._gates
+                for state, label in GATE_BUTTONS.items()
+            }
+        )
+
+    def _build_approved(self, states: States) -> FrozenReplyKeyboardMarkup:
+        row = [
+            self._registry.button(GATE_BUTTONS[state], gate)
+            for gate, state in zip(self._gates, states)
+        ]
+        return _markup([row, ["🔁 Изменить номер"], ["ℹ️ Помощь", "🏁 Начало"]])
+
+    def get(self, status: str, states: Optional[States] = None) -> FrozenReplyKeyboardMarkup:
+        if status != "yes":
+            return self._static.get(status, self._static["none"])
+        if states is None:
+            states = self.idle_states
+        markup = self._approved.get(states)
+        if markup is None:
+            states = tuple(effective_state(state) for state in states)
+            markup = self._approved.get(states)
+            if markup is None:
+                markup = self._approved[states] = self._build_approved(states)
+        return markup
+
+    def gate_actions(self, gate_id: str, state: Optional[str]) -> Optional[InlineKeyboardMarkup]:
+        return self._actions.get((gate_id, effective_state(state)))
+
+    def __len__(self):
+        return len(self._static) + len(self._approved)
+
+
+# Клавиатуры шагов регистрации и смены номера
+CONTACT_KEYBOARD = FrozenReplyKeyboardMarkup(
+    [[KeyboardButton("📱 Отправить номер", request_contact=True)], ["🏁 Начало"]],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
+NEW_CONTACT_KEYBOARD = FrozenReplyKeyboardMarkup(
+    [[KeyboardButton("📱 Отправить новый номер", request_contact=True)], ["🏁 Начало"]],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
@@ -0,0 +1,147 @@
+"""Фоновая запись логов в logs/<дд-мм-гггг>.log.
+
+write() только кладёт строку в ограниченную очередь и сразу возвращается:
+его можно звать и из event loop, и из потока paho. Отдельный поток-писатель
+забирает строки пачками, держит файл открытым и сбрасывает его раз в
+flush_interval. Файл ротируется при смене даты и при превышении max_bytes
+(<дата>.1.log, <дата>.2.log, ...). При переполнении очереди строки
+отбрасываются и считаются в dropped.
+"""
+
+import atexit
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Optional
+
+_STOP = object()
+
+
+class LogWriter:
+    def __init__(
+        self,
+        log_dir: str = "logs",
+        max_bytes: int = 10 * 1024 * 1024,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        echo: bool = True,
+    ):
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.echo = echo
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._date_str: Optional[str] = None
+        self._part = 0
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="log-writer", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def write(self, when: datetime, line: str):
+        if self.echo:
+            print(line)
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((when.strftime("%d-%m-%Y"), line))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            records = []
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                else:
+                    records.append(item)
+            self._write_batch(records)
+            if stop:
+                self._close()
+                return
+
+    def _write_batch(self, records):
+        try:
+            for date_str, line in records:
+                self._rotate(date_str)
+                self._file.write(line + "\n")
+                self.written += 1
+            if self._file:
+                self._file.flush()
+        except Exception as e:
+            self.errors += 1
+            print(f"[log error] {e}")
+            self._close()
+
+    def _path(self, date_str: str, part: int) -> str:
+        suffix = f".{part}" if part else ""
+        return os.path.join(self.log_dir, f"{date_str}{suffix}.log")
+
+    def _rotate(self, date_str: str):
+        if self._file and date_str == self._date_str:
+            if self._file.tell() < self.max_bytes:
+                return
+            self._close()
+            self._part += 1
+        elif self._file is None and date_str == self._date_str:
+            pass
+        else:
+            self._close()
+            self._date_str = date_str
+            self._part = 0
+            os.makedirs(self.log_dir, exist_ok=True)
+            # После перезапуска продолжаем с последней части за этот день
+            while os.path.exists(self._path(date_str, self._part + 1)):
+                self._part += 1
+        self._file = open(self._path(date_str, self._part), "a", encoding="utf-8")
+
+    def _close(self):
+        if self._file:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+
+    def stats(self) -> dict:
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "queued": self._queue.qsize(),
+        }
@@ -0,0 +1,100 @@
+"""Мост из сетевого потока paho в event loop бота.
+
+Колбэк on_message только кладёт разобранное сообщение в asyncio.Queue
+(через call_soon_threadsafe) и сразу возвращается. Отдельная задача-потребитель
+на event loop обрабатывает сообщения строго по порядку: меняет состояние
+и отправляет сообщения в Telegram. Поток paho никогда не ждёт Telegram.
+
+Если задан key (например, id калитки по топику), у каждого ключа своя очередь
+и свой потребитель: порядок сохраняется внутри ключа, а медленная обработка
+одной калитки не задерживает другие.
+
+Флаг owner передаётся обработчику как есть: в режиме нескольких процессов
+(workers.py) им помечаются события, чью команду отправил этот процесс.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+Handler = Callable[[str, dict, bool], Awaitable[None]]
+KeyFunc = Callable[[str], Hashable]
+
+
+class MqttBridge:
+    def __init__(
+        self, handler: Handler, maxsize: int = 1000, key: Optional[KeyFunc] = None
+    ):
+        self._handler = handler
+        self._maxsize = maxsize
+        self._key = key or (lambda topic: None)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: Dict[Hashable, asyncio.Queue] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._started = False
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        """Привязывает мост к текущему event loop; вызывать из кода на этом loop."""
+        if self._started:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._started = True
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._queues.clear()
+        self._started = False
+
+    @property
+    def backlog(self) -> int:
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def submit(self, topic: str, data: dict, owner: bool = True):
+        """Потокобезопасно: вызывается из сетевого потока paho."""
+        if not self._started or self._loop.is_closed():
+            self.dropped += 1
+            return
+        self.received += 1
+        self._loop.call_soon_threadsafe(self._enqueue, topic, data, owner)
+
+    def _enqueue(self, topic: str, data: dict, owner: bool):
+        key = self._key(topic)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue(maxsize=self._maxsize)
+            self._tasks[key] = self._loop.create_task(
+                self._consume(queue), name=f"mqtt-bridge:{key}"
+            )
+        try:
+            queue.put_nowait((topic, data, owner))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print(f"[MQTT bridge] очередь переполнена, сообщение отброшено: {topic}")
+
+    async def _consume(self, queue: asyncio.Queue):
+        while True:
+            topic, data, owner = await queue.get()
+            try:
+                await self._handler(topic, data, owner)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"[MQTT bridge] ошибка обработки {topic}: {e}")
+            finally:
+                queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "backlog": self.backlog,
+        }
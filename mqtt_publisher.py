@@ -0,0 +1,103 @@
+"""Публикация команд через одно долгоживущее MQTT-подключение.
+
+Вместо publish.single (connect/auth/disconnect на каждую команду) используется
+клиент, уже подключённый в init_mqtt. Публикация не блокирует event loop:
+для QoS 1 ждём PUBACK через asyncio.Future, которую завершает сетевой поток paho.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+
+EARLY_ACKS_LIMIT = 1024
+
+
+class PublishError(Exception):
+    pass
+
+
+class MqttPublisher:
+    def __init__(self, client: mqtt.Client, puback_timeout: float = 5.0):
+        self.client = client
+        self.puback_timeout = puback_timeout
+        self._lock = threading.Lock()
+        self._inflight = {}  # mid -> (future, started_at)
+        # PUBACK может прийти раньше, чем publish() зарегистрирует mid;
+        # сюда же попадают mid сообщений QoS 0, поэтому размер ограничен
+        self._early_acks = OrderedDict()
+        self.published = 0
+        self.failed = 0
+        self.puback_latencies = deque(maxlen=256)
+        client.on_publish = self._on_publish
+
+    def _on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        # Сетевой поток paho: только передаём результат в event loop
+        with self._lock:
+            item = self._inflight.pop(mid, None)
+            if item is None:
+                self._early_acks[mid] = None
+                if len(self._early_acks) > EARLY_ACKS_LIMIT:
+                    self._early_acks.popitem(last=False)
+                return
+        future, started_at = item
+        latency = time.perf_counter() - started_at
+        future.get_loop().call_soon_threadsafe(_resolve, future, latency)
+
+    async def publish(
+        self, topic: str, payload: str, qos: int = 0, retain: bool = False
+    ) -> Optional[float]:
+        """Публикует сообщение. Для QoS 1 возвращает задержку PUBACK в секундах."""
+        # Иначе paho поставит QoS 1 в очередь и отправит команду после
+        # переподключения — калитка откроется спустя минуты
+        if not self.client.is_connected():
+            self.failed += 1
+            raise PublishError("нет подключения к брокеру")
+
+        started_at = time.perf_counter()
+        future = asyncio.get_running_loop().create_future() if qos > 0 else None
+
+        info = self.client.publish(topic, payload=payload, qos=qos, retain=retain)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.failed += 1
+            raise PublishError(mqtt.error_string(info.rc))
+
+        if future is None:
+            self.published += 1
+            return None
+
+        with self._lock:
+            if self._early_acks.pop(info.mid, False) is None:
+                future.set_result(time.perf_counter() - started_at)
+            else:
+                self._inflight[info.mid] = (future, started_at)
+
+        try:
+            latency = await asyncio.wait_for(future, timeout=self.puback_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._inflight.pop(info.mid, None)
+            self.failed += 1
+            raise PublishError(f"PUBACK не получен за {self.puback_timeout} с")
+
+        self.published += 1
+        self.puback_latencies.append(latency)
+        return latency
+
+    def stats(self) -> dict:
+        latencies = sorted(self.puback_latencies)
+        return {
+            "published": self.published,
+            "failed": self.failed,
+            "inflight": len(self._inflight),
+            "puback_last": self.puback_latencies[-1] if latencies else None,
+            "puback_p50": latencies[len(latencies) // 2] if latencies else None,
+        }
+
+
+def _resolve(future: asyncio.Future, latency: float):
+    if not future.done():
+        future.set_result(latency)
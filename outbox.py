@@ -0,0 +1,365 @@
+"""Единая очередь исходящих сообщений Telegram.
+
+Все отправки бота проходят через Outbox:
+  * приоритеты — подтверждения команд калитки уходят раньше справки,
+    уведомлений и рассылок;
+  * темп — token bucket на весь бот (лимит Telegram ~30 сообщений/с) и на
+    каждый чат (~1 сообщение/с с небольшим запасом на серию);
+  * RetryAfter — отправка приостанавливается целиком на указанное время,
+    сообщение остаётся первым в своём чате;
+  * сетевые ошибки — повтор с экспоненциальной задержкой и случайным
+    разбросом (full jitter), без синхронных повторов одновременно у всех.
+
+Уведомления и рассылки не расходуют последние токены — ни чата, ни общего
+ведра: они остаются для ответа на нажатие кнопки, который иначе ждал бы
+пополнения вслед за рассылкой.
+
+Внутри чата сообщения уходят по одному и по приоритету, при равном
+приоритете — в порядке постановки. Выбор следующего чата — O(log n):
+готовые чаты лежат в куче по приоритету головного сообщения, ждущие токена
+или повтора — в куче таймеров.
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from rate_limit import RateLimiter, TokenBucket
+
+PRIORITY_GATE = 0  # подтверждения и статусы команды калитки
+PRIORITY_INTERACTIVE = 1  # ответы на действия пользователя
+PRIORITY_NOTICE = 2  # уведомления администратору и жителям
+PRIORITY_BULK = 3  # рассылки и состояние для подписчиков
+
+PRIORITY_NAMES = {
+    PRIORITY_GATE: "gate",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_NOTICE: "notice",
+    PRIORITY_BULK: "bulk",
+}
+
+Call = Callable[[], Awaitable]
+
+
+@dataclass(order=True)
+class Outgoing:
+    priority: int
+    seq: int
+    chat_id: int = field(compare=False)
+    call: Call = field(compare=False, repr=False)
+    future: asyncio.Future = field(compare=False, repr=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+    attempts: int = field(compare=False, default=0)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class Outbox:
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        global_burst: float = 5.0,
+        global_reserve: float = 2.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        chat_reserve: float = 1.0,
+        concurrency: int = 8,
+        max_attempts: int = 4,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+        observe: Optional[Callable[[str, float], None]] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.concurrency = max(1, concurrency)
+        self.chat_reserve = chat_reserve
+        self.global_reserve = global_reserve
+        self._observe = observe
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chat_limiter = RateLimiter(chat_rate, chat_burst)
+        self._seq = itertools.count()
+        self._random = random.Random()
+
+        self._chats: Dict[int, List[Outgoing]] = {}
+        self._ready: List[Tuple[int, int, int]] = []  # (priority, seq, chat_id)
+        self._timers: List[Tuple[float, int]] = []  # (когда, chat_id)
+        self._waiting: Set[int] = set()
+        self._in_flight: Set[int] = set()
+        self._blocked_until: Dict[int, float] = {}
+        self._paused_until = 0.0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.retry_after_events = 0
+
+    # --- постановка ---
+
+    def start(self):
+        """Привязывает очередь к текущему event loop; повторный вызов ничего не делает."""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = self._loop.create_task(self._dispatch(), name="outbox")
+
+    def share_global(self, share: float):
+        """Оставляет этой очереди долю share общего лимита бота (режим воркеров).
+
+        Лимит Telegram считается на токен бота, а не на процесс; чаты между
+        воркерами не пересекаются, поэтому лимит на чат остаётся прежним.
+        """
+        self.global_reserve *= share
+        # Ведро должно вмещать уведомление вместе с резервом, иначе они не уйдут никогда
+        burst = max(self._global.burst * share, 1.0 + self.global_reserve)
+        self._global = TokenBucket(self._global.rate * share, burst)
+
+    def submit(self, chat_id: int, call: Call, priority: int = PRIORITY_INTERACTIVE) -> asyncio.Future:
+        """Ставит вызов Bot API в очередь; Future завершится его результатом."""
+        self.start()
+        item = Outgoing(
+            priority=priority,
+            seq=next(self._seq),
+            chat_id=int(chat_id),
+            call=call,
+            future=self._loop.create_future(),
+        )
+        self._push(item)
+        return item.future
+
+    async def send(self, chat_id: int, call: Call, priority: int = PRIORITY_INTERACTIVE):
+        return await self.submit(chat_id, call, priority)
+
+    def _push(self, item: Outgoing):
+        queue = self._chats.setdefault(item.chat_id, [])
+        heapq.heappush(queue, item)
+        if item.chat_id in self._in_flight:
+            pass
+        elif item.chat_id not in self._waiting:
+            self._schedule_chat(item.chat_id)
+        elif queue[0] is item:
+            # Чат ждал токенов под рассылку, а срочному сообщению хватит и
+            # резерва — пересчитываем; старый таймер станет пустым пробуждением
+            self._waiting.discard(item.chat_id)
+            self._schedule_chat(item.chat_id)
+        self._wakeup.set()
+
+    def _schedule_chat(self, chat_id: int):
+        queue = self._chats.get(chat_id)
+        if not queue:
+            self._chats.pop(chat_id, None)
+            return
+        now = time.monotonic()
+        wait = max(
+            self._blocked_until.get(chat_id, 0.0) - now,
+            self._chat_wait(chat_id, queue[0].priority),
+        )
+        if wait > 0:
+            self._waiting.add(chat_id)
+            heapq.heappush(self._timers, (now + wait, chat_id))
+        else:
+            self._blocked_until.pop(chat_id, None)
+            head = queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+    def _chat_wait(self, chat_id: int, priority: int) -> float:
+        tokens = 1.0 if priority < PRIORITY_NOTICE else 1.0 + self.chat_reserve
+        return self._chat_limiter.bucket(chat_id).wait_time(tokens)
+
+    # --- диспетчер ---
+
+    def _promote_due(self, now: float):
+        while self._timers and self._timers[0][0] <= now:
+            _, chat_id = heapq.heappop(self._timers)
+            if chat_id in self._waiting:
+                self._waiting.discard(chat_id)
+                self._schedule_chat(chat_id)
+
+    def _pop_ready(self) -> Optional[int]:
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            queue = self._chats.get(chat_id)
+            # Устаревшая запись: при каждой смене головного сообщения готового
+            # чата в кучу кладётся новая, так что старую можно просто выбросить
+            if (
+                not queue
+                or chat_id in self._in_flight
+                or chat_id in self._waiting
+                or (queue[0].priority, queue[0].seq) != (priority, seq)
+            ):
+                continue
+            return chat_id
+        return None
+
+    async def _next_item(self) -> Outgoing:
+        while True:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self._global.wait_time())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            self._promote_due(now)
+            chat_id = self._pop_ready()
+            if chat_id is not None:
+                priority = self._chats[chat_id][0].priority
+                if priority >= PRIORITY_NOTICE:
+                    reserve_wait = self._global.wait_time(1.0 + self.global_reserve)
+                    if reserve_wait > 0:
+                        # Вернуть чат в готовые и подождать: срочное может прийти раньше
+                        heapq.heappush(self._ready, (priority, self._chats[chat_id][0].seq, chat_id))
+                        self._wakeup.clear()
+                        try:
+                            await asyncio.wait_for(self._wakeup.wait(), reserve_wait)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                retry_in = self._chat_wait(chat_id, priority)
+                if retry_in > 0:
+                    self._waiting.add(chat_id)
+                    heapq.heappush(self._timers, (now + retry_in, chat_id))
+                    continue
+                self._chat_limiter.try_acquire(chat_id)
+                self._global.try_acquire()
+                self._in_flight.add(chat_id)
+                return heapq.heappop(self._chats[chat_id])
+
+            timeout = self._timers[0][0] - now if self._timers else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                item = await self._next_item()
+            except BaseException:
+                self._slots.release()
+                raise
+            self._loop.create_task(self._deliver(item))
+
+    async def _deliver(self, item: Outgoing):
+        requeue_delay = None
+        try:
+            item.attempts += 1
+            if self._observe and item.attempts == 1:
+                self._observe(
+                    PRIORITY_NAMES.get(item.priority, str(item.priority)),
+                    time.monotonic() - item.enqueued_at,
+                )
+            try:
+                result = await item.call()
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                self.retry_after_events += 1
+                # Ограничение Telegram касается всего бота — ждут все
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                print(f"[outbox] RetryAfter {delay:.0f} с (чат {item.chat_id})")
+                requeue_delay = 0.0 if item.attempts < self.max_attempts else None
+                if requeue_delay is None:
+                    self._fail(item, e)
+            except (BadRequest, Forbidden) as e:
+                self._fail(item, e)
+            except NetworkError as e:
+                if item.attempts < self.max_attempts:
+                    requeue_delay = self._backoff(item.attempts)
+                    print(
+                        f"[outbox] {type(e).__name__} (чат {item.chat_id}, попытка "
+                        f"{item.attempts}/{self.max_attempts}), повтор через {requeue_delay:.1f} с"
+                    )
+                else:
+                    self._fail(item, e)
+            except Exception as e:
+                self._fail(item, e)
+            else:
+                self.sent += 1
+                if not item.future.done():
+                    item.future.set_result(result)
+        finally:
+            self._in_flight.discard(item.chat_id)
+            if requeue_delay is not None:
+                self.retried += 1
+                if requeue_delay > 0:
+                    self._blocked_until[item.chat_id] = time.monotonic() + requeue_delay
+                heapq.heappush(self._chats.setdefault(item.chat_id, []), item)
+            if item.chat_id not in self._waiting:
+                self._schedule_chat(item.chat_id)
+            self._slots.release()
+            self._wakeup.set()
+
+    def _backoff(self, attempt: int) -> float:
+        return self._random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def _fail(self, item: Outgoing, error: Exception):
+        self.failed += 1
+        if not item.future.done():
+            item.future.set_exception(error)
+
+    # --- остановка и статистика ---
+
+    async def stop(self, timeout: float = 5.0):
+        """Даёт очереди опустеть (не дольше timeout) и останавливает диспетчер."""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self.queued or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        for queue in self._chats.values():
+            for item in queue:
+                if not item.future.done():
+                    item.future.cancel()
+        self._chats.clear()
+        self._ready.clear()
+        self._timers.clear()
+        self._waiting.clear()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._chats.values())
+
+    def queued_by_priority(self) -> Dict[str, int]:
+        counts = {name: 0 for name in PRIORITY_NAMES.values()}
+        for queue in self._chats.values():
+            for item in queue:
+                name = PRIORITY_NAMES.get(item.priority, str(item.priority))
+                counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "in_flight": len(self._in_flight),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "retry_after_events": self.retry_after_events,
+            "paused_for": self.paused_for,
+        }
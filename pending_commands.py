@@ -0,0 +1,139 @@
+"""Реестр команд, ожидающих подтверждения от устройства.
+
+Каждая команда получает уникальный request_id, который уходит в MQTT-payload.
+Устройство возвращает его в статусе, и ответ сопоставляется с ожиданием за O(1),
+так что одновременные команды (в том числе на разных калитках) не подтверждают
+друг друга, а запоздавший статус не завершит чужое ожидание.
+
+Для прошивки, которая ещё не возвращает request_id, есть запасной путь:
+самая старая ожидающая команда того же пользователя на той же калитке.
+"""
+
+import asyncio
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass
+class PendingCommand:
+    request_id: str
+    gate_id: str
+    user_id: str
+    command: str
+    deadline: float
+    created_at: float = field(default_factory=time.monotonic)
+    # Для метрик и журнала: нажатие кнопки, отправка в MQTT, ответ устройства
+    started_at: Optional[float] = None
+    published_at: Optional[float] = None
+    confirmed_at: Optional[float] = None
+    future: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future(),
+        repr=False,
+    )
+
+
+class PendingCommands:
+    def __init__(self, sweep_interval: float = 1.0):
+        self.sweep_interval = sweep_interval
+        self._by_id: Dict[str, PendingCommand] = {}
+        self._by_gate_user: Dict[Tuple[str, str], "OrderedDict[str, None]"] = {}
+        self._next_sweep = 0.0
+        self.registered = 0
+        self.resolved = 0
+        self.expired = 0
+        self.unmatched = 0
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def register(
+        self, gate_id: str, user_id: str, command: str, timeout: float
+    ) -> PendingCommand:
+        self.expire()
+        request_id = secrets.token_hex(8)
+        while request_id in self._by_id:
+            request_id = secrets.token_hex(8)
+        pending = PendingCommand(
+            request_id=request_id,
+            gate_id=gate_id,
+            user_id=str(user_id),
+            command=command,
+            deadline=time.monotonic() + timeout,
+        )
+        self._by_id[request_id] = pending
+        self._by_gate_user.setdefault((gate_id, pending.user_id), OrderedDict())[
+            request_id
+        ] = None
+        self.registered += 1
+        return pending
+
+    def resolve(self, request_id: str, status: dict) -> Optional[PendingCommand]:
+        pending = self._pop(request_id)
+        if pending is None:
+            self.unmatched += 1
+            return None
+        pending.confirmed_at = time.monotonic()
+        if not pending.future.done():
+            pending.future.set_result(status)
+        self.resolved += 1
+        return pending
+
+    def resolve_legacy(
+        self, gate_id: str, user_id: str, status: dict
+    ) -> Optional[PendingCommand]:
+        """Ответ без request_id: самая старая команда пользователя на калитке."""
+        ids = self._by_gate_user.get((gate_id, str(user_id)))
+        if not ids:
+            self.unmatched += 1
+            return None
+        return self.resolve(next(iter(ids)), status)
+
+    def discard(self, request_id: str):
+        self._pop(request_id)
+
+    def timeout(self, request_id: str) -> Optional[PendingCommand]:
+        """Срок ожидания вышел: снимает запись, ожидающий получит TimeoutError."""
+        pending = self._pop(request_id)
+        if pending is None:
+            return None
+        if not pending.future.done():
+            pending.future.set_exception(asyncio.TimeoutError())
+        self.expired += 1
+        return pending
+
+    def expire(self, now: Optional[float] = None) -> List[PendingCommand]:
+        now = time.monotonic() if now is None else now
+        if now < self._next_sweep:
+            return []
+        self._next_sweep = now + self.sweep_interval
+        stale = [p for p in self._by_id.values() if p.deadline <= now]
+        for pending in stale:
+            self._pop(pending.request_id)
+            if not pending.future.done():
+                pending.future.set_exception(asyncio.TimeoutError())
+            self.expired += 1
+        return stale
+
+    def _pop(self, request_id: str) -> Optional[PendingCommand]:
+        pending = self._by_id.pop(request_id, None)
+        if pending is None:
+            return None
+        key = (pending.gate_id, pending.user_id)
+        ids = self._by_gate_user.get(key)
+        if ids is not None:
+            ids.pop(request_id, None)
+            if not ids:
+                del self._by_gate_user[key]
+        return pending
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._by_id),
+            "registered": self.registered,
+            "resolved": self.resolved,
+            "expired": self.expired,
+            "unmatched": self.unmatched,
+        }
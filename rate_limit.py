@@ -0,0 +1,123 @@
+"""Ограничение частоты команд: token bucket на монотонных часах.
+
+Ведро ёмкостью burst пополняется со скоростью rate токенов в секунду.
+Проверка — несколько арифметических операций без I/O, поэтому её делают
+до обращений к БД и MQTT.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated_at", "_clock")
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._clock = clock
+        self.updated_at = clock()
+
+    def _refill(self, now: float):
+        if now > self.updated_at:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> Tuple[bool, float]:
+        """(разрешено, через сколько секунд появится нужное число токенов)."""
+        self._refill(self._clock())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True, 0.0
+        if self.rate <= 0:
+            return False, float("inf")
+        return False, (tokens - self.tokens) / self.rate
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Сколько ждать до появления токенов (0 — можно сейчас)."""
+        self._refill(self._clock())
+        if self.tokens >= tokens:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (tokens - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(self._clock())
+        return self.tokens >= self.burst
+
+
+class RateLimiter:
+    """Набор вёдер по ключу (пользователь, калитка) с ограниченным числом ключей."""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_keys: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # Место освобождаем до вставки, чтобы не выкинуть новое (полное) ведро
+            if len(self._buckets) >= self.max_keys:
+                self._evict()
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, self._clock)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self):
+        # Сначала выкидываем полные вёдра — их сброс ничего не меняет
+        for key in [k for k, b in self._buckets.items() if b.is_full()]:
+            del self._buckets[key]
+        while self._buckets and len(self._buckets) >= self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def try_acquire(self, key: Hashable, tokens: float = 1.0) -> Tuple[bool, float]:
+        allowed, retry_after = self.bucket(key).try_acquire(tokens)
+        if allowed:
+            self.allowed += 1
+        else:
+            self.rejected += 1
+        return allowed, retry_after
+
+    def refund(self, key: Hashable, tokens: float = 1.0):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(bucket.burst, bucket.tokens + tokens)
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
+
+
+def rate_from_interval(interval_seconds: float) -> float:
+    """Скорость пополнения «один токен за interval_seconds»; 0 — без ограничения."""
+    return 1.0 / interval_seconds if interval_seconds > 0 else 1e9
+
+
+def format_retry(retry_after: Optional[float]) -> int:
+    """Секунды ожидания для сообщения пользователю (не меньше 1)."""
+    if not retry_after or retry_after == float("inf"):
+        return 1
+    return max(1, int(retry_after + 0.999))
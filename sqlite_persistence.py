@@ -0,0 +1,210 @@
+"""Хранение user_data, bot_data и состояний ConversationHandler в access.db.
+
+В отличие от PicklePersistence, которая каждый раз переписывает весь файл,
+здесь у каждого пользователя (и у каждого ключа разговора) своя строка в
+таблице bot_persistence, и записываются только изменившиеся строки:
+update_*() сериализует данные и сравнивает отпечаток с последним записанным.
+Изменения копятся и уходят одной транзакцией через flush_delay секунд —
+PTB зовёт update_*() для всех затронутых пользователей раз в update_interval,
+и весь такой проход попадает в одну запись.
+
+user_data загружается лениво: при запуске ничего не читается, данные
+пользователя подтягиваются одним запросом по ключу в refresh_user_data(),
+перед первым апдейтом от него. Время запуска не растёт с числом жителей.
+Параллельные апдейты одного пользователя ждут одно и то же чтение, а
+загруженным он считается только после того, как данные легли в user_data.
+
+bot_data — одна строка на процесс: в режиме воркеров у каждого свой
+bot_data_key, иначе воркеры затирали бы общую строку друг друга.
+"""
+
+import asyncio
+import hashlib
+import json
+import pickle
+import sqlite3
+from typing import Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import access_db
+from access_db_async import get_pool
+
+KIND_USER = "user"
+KIND_BOT = "bot"
+KIND_CONVERSATION = "conv:"
+
+RowKey = Tuple[str, str]
+
+
+def _fingerprint(blob: Optional[bytes]) -> Optional[bytes]:
+    return None if blob is None else hashlib.blake2b(blob, digest_size=16).digest()
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval: float = 30.0, flush_delay: float = 1.0):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=True, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.flush_delay = flush_delay
+        self.bot_data_key = ""
+        self._written: Dict[RowKey, bytes] = {}  # отпечатки того, что лежит в БД
+        self._staged: Dict[RowKey, Optional[bytes]] = {}  # None — удалить строку
+        self._loaded_users: Set[int] = set()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self._flush_lock = asyncio.Lock()
+        self.rows_written = 0
+        self.rows_skipped = 0
+        self.flushes = 0
+        self.lazy_loads = 0
+
+    # --- чтение ---
+
+    async def _read_kind(self, kind: str) -> Dict[str, bytes]:
+        rows = await get_pool().read(access_db.query_persistence_kind, kind)
+        for key, blob in rows:
+            self._written[(kind, key)] = _fingerprint(blob)
+        return dict(rows)
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}  # лениво, см. refresh_user_data
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        rows = await self._read_kind(KIND_BOT)
+        blob = rows.get(self.bot_data_key)
+        return pickle.loads(blob) if blob is not None else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await self._read_kind(KIND_CONVERSATION + name)
+        return {tuple(json.loads(key)): pickle.loads(blob) for key, blob in rows.items()}
+
+    async def _load_user(self, user_id: int, user_data: dict):
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._read_user(user_id, user_data))
+            self._loading[user_id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        # Отмена одного апдейта не должна прерывать чтение для остальных
+        await asyncio.shield(loading)
+
+    async def _read_user(self, user_id: int, user_data: dict):
+        blob = await get_pool().read(access_db.query_persistence_row, KIND_USER, str(user_id))
+        if user_id in self._loaded_users:
+            return  # drop_user_data() во время чтения — сохранённое уже не нужно
+        if blob is not None:
+            self.lazy_loads += 1
+            self._written[(KIND_USER, str(user_id))] = _fingerprint(blob)
+            # То, что уже успели записать в памяти, новее сохранённого
+            for key, value in pickle.loads(blob).items():
+                user_data.setdefault(key, value)
+        self._loaded_users.add(user_id)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id not in self._loaded_users:
+            await self._load_user(user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # --- запись ---
+
+    def _stage(self, kind: str, key: str, value, force: bool = False):
+        row = (kind, key)
+        blob = None if value is None else pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if not force and _fingerprint(blob) == self._written.get(row):
+            self._staged.pop(row, None)
+            self.rows_skipped += 1
+            return
+        self._staged[row] = blob
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.flush_delay, self._flush_later
+            )
+
+    def _flush_later(self):
+        self._flush_handle = None
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        if user_id not in self._loaded_users:
+            # Данные меняли в обход апдейта (application.user_data[...]) —
+            # сначала дочитываем сохранённое, чтобы не затереть его частичной копией
+            await self._load_user(user_id, data)
+        self._stage(KIND_USER, str(user_id), data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded_users.add(user_id)
+        # Строку пользователя могли ни разу не читать: отсутствие в _written
+        # не значит, что её нет в БД
+        self._stage(KIND_USER, str(user_id), None, force=True)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._stage(KIND_BOT, self.bot_data_key, data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        self._stage(KIND_CONVERSATION + name, json.dumps(list(key)), new_state)
+
+    async def flush(self) -> None:
+        """Пишет накопленные изменения одной транзакцией."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self._flush_lock:
+            if not self._staged:
+                return
+            staged, self._staged = self._staged, {}
+            rows = [(kind, key, blob) for (kind, key), blob in staged.items()]
+            try:
+                await get_pool().write(access_db.exec_persistence_write, rows)
+            except sqlite3.Error as e:
+                # Вернуть в очередь, если за это время не появилось более новых данных
+                for row, blob in staged.items():
+                    self._staged.setdefault(row, blob)
+                print(f"[DB persistence error] {e}")
+                return
+            for row, blob in staged.items():
+                if blob is None:
+                    self._written.pop(row, None)
+                else:
+                    self._written[row] = _fingerprint(blob)
+            self.rows_written += len(rows)
+            self.flushes += 1
+
+    @property
+    def staged(self) -> int:
+        return len(self._staged)
+
+    def stats(self) -> dict:
+        return {
+            "loaded_users": len(self._loaded_users),
+            "lazy_loads": self.lazy_loads,
+            "staged": self.staged,
+            "rows_written": self.rows_written,
+            "rows_skipped": self.rows_skipped,
+            "flushes": self.flushes,
+        }
@@ -0,0 +1,167 @@
+"""Рассылка состояния калиток подписавшимся жителям.
+
+Событие от устройства не рассылается в цикле по подписчикам: publish() только
+запоминает последнее состояние калитки для каждого подписчика и ставит его
+в очередь. Ограниченное число задач-воркеров отправляет сообщения параллельно.
+Если подписчик не успевает получать обновления (медленная отправка, 429),
+промежуточные состояния перезаписываются — он получит только самое новое.
+
+Каждый подписчик в каждый момент обрабатывается одним воркером, поэтому
+сообщения одному человеку не обгоняют друг друга.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+Sender = Callable[[str, str, str], Awaitable[None]]
+
+
+class StateFanout:
+    def __init__(
+        self,
+        concurrency: int = 16,
+        observe: Optional[Callable[[float], None]] = None,
+    ):
+        self.concurrency = max(1, concurrency)
+        self._observe = observe
+        self._send: Optional[Sender] = None
+        self._subscribers: Dict[str, Set[str]] = {}
+        # user_id -> {gate_id: (state, published_at)} — ещё не отправленное
+        self._latest: Dict[str, Dict[str, Tuple[str, float]]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._busy: Set[str] = set()
+        self._workers: list = []
+        self.published = 0
+        self.enqueued = 0
+        self.superseded = 0
+        self.sent = 0
+        self.failed = 0
+
+    # --- подписки ---
+
+    def subscribe(self, user_id: str, gate_id: str) -> bool:
+        users = self._subscribers.setdefault(gate_id, set())
+        if str(user_id) in users:
+            return False
+        users.add(str(user_id))
+        return True
+
+    def unsubscribe(self, user_id: str, gate_id: Optional[str] = None) -> int:
+        """Отписка от одной калитки или (gate_id=None) от всех; сколько снято."""
+        user_id = str(user_id)
+        gate_ids = [gate_id] if gate_id is not None else list(self._subscribers)
+        removed = 0
+        for gid in gate_ids:
+            users = self._subscribers.get(gid)
+            if users and user_id in users:
+                users.discard(user_id)
+                removed += 1
+        pending = self._latest.get(user_id)
+        if pending:
+            for gid in gate_ids:
+                pending.pop(gid, None)
+            if not pending:
+                del self._latest[user_id]
+        return removed
+
+    def load(self, pairs: Iterable[Tuple[str, str]]):
+        for user_id, gate_id in pairs:
+            self.subscribe(user_id, gate_id)
+
+    def subscriptions(self, user_id: str) -> Set[str]:
+        user_id = str(user_id)
+        return {gid for gid, users in self._subscribers.items() if user_id in users}
+
+    def subscriber_count(self, gate_id: Optional[str] = None) -> int:
+        if gate_id is not None:
+            return len(self._subscribers.get(gate_id, ()))
+        return len(set().union(*self._subscribers.values())) if self._subscribers else 0
+
+    # --- рассылка ---
+
+    def start(self, send: Sender):
+        """Привязывает отправку и event loop; вызывать из кода на этом loop."""
+        self._send = send
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._workers = [
+            loop.create_task(self._worker(), name=f"state-fanout:{idx}")
+            for idx in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def publish(self, gate_id: str, state: str, exclude: Iterable[str] = ()):
+        """Не ждёт отправки: O(число подписчиков калитки) операций со словарями."""
+        users = self._subscribers.get(gate_id)
+        if not users or self._ready is None:
+            return
+        self.published += 1
+        excluded = {str(user_id) for user_id in exclude}
+        now = time.monotonic()
+        for user_id in users:
+            if user_id in excluded:
+                continue
+            pending = self._latest.setdefault(user_id, {})
+            if gate_id in pending:
+                self.superseded += 1
+            pending[gate_id] = (state, now)
+            self.enqueued += 1
+            self._schedule(user_id)
+
+    def _schedule(self, user_id: str):
+        if user_id in self._queued or user_id in self._busy:
+            return
+        self._queued.add(user_id)
+        self._ready.put_nowait(user_id)
+
+    async def _worker(self):
+        while True:
+            user_id = await self._ready.get()
+            self._queued.discard(user_id)
+            self._busy.add(user_id)
+            try:
+                pending = self._latest.pop(user_id, None) or {}
+                for gate_id, (state, published_at) in pending.items():
+                    await self._deliver(user_id, gate_id, state, published_at)
+            finally:
+                self._busy.discard(user_id)
+                # Пока отправляли, могло прийти новое состояние
+                if user_id in self._latest:
+                    self._schedule(user_id)
+
+    async def _deliver(self, user_id: str, gate_id: str, state: str, published_at: float):
+        try:
+            await self._send(user_id, gate_id, state)
+            self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            print(f"[fanout] ошибка отправки {user_id} [{gate_id}] {state}: {e}")
+            return
+        if self._observe:
+            self._observe(time.monotonic() - published_at)
+
+    @property
+    def backlog(self) -> int:
+        return sum(len(pending) for pending in self._latest.values())
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscriber_count(),
+            "backlog": self.backlog,
+            "published": self.published,
+            "enqueued": self.enqueued,
+            "superseded": self.superseded,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
@@ -0,0 +1,227 @@
+"""Сообщение о состоянии калитки, которое правится на месте.
+
+У каждого пользователя на каждую калитку одно сообщение-статус: новые
+состояния не отправляются отдельными сообщениями, а заменяют его текст
+через editMessageText. Новое сообщение отправляется, только если правки
+ещё не было (или после reset() — пользователь написал в чат, и старый
+статус ушёл вверх), либо если править нельзя: сообщение удалено, слишком
+старое и т. п.
+
+Состояния, которые приходят подряд, схлопываются: show() с delay ждёт
+столько секунд, и показывается только последнее состояние; пока идёт
+отправка или правка, следующие состояния тоже копятся и уходят одной
+правкой. Промежуточное «Команда отправлена» с задержкой заменяется ответом
+устройства, если тот пришёл раньше, — цикл калитки обходится одной
+отправкой и одной правкой вместо трёх-четырёх сообщений.
+
+Кнопки у статуса — только inline: обычную клавиатуру (ReplyKeyboardMarkup)
+к правке не приложить.
+
+Помнятся не больше max_views статусов (LRU): давно не показанный статус
+забывается, и следующий показ уйдёт новым сообщением.
+"""
+
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, TelegramError
+
+from timers import TimerScheduler
+
+Render = Tuple[str, Optional[InlineKeyboardMarkup]]
+# send(chat_id, text, markup, priority) → Message; edit(chat_id, message_id, text, markup, priority)
+Sender = Callable[[int, str, Optional[InlineKeyboardMarkup], int], Awaitable]
+Editor = Callable[[int, int, str, Optional[InlineKeyboardMarkup], int], Awaitable]
+ErrorHandler = Callable[[int, Hashable, Exception], Awaitable[None]]
+
+Key = Tuple[int, Hashable]
+
+
+@dataclass
+class StatusView:
+    message_id: Optional[int] = None
+    rendered: Optional[Render] = None
+    desired: Optional[Render] = None
+    priority: int = 0
+    due: Optional[float] = None  # время запланированного показа (loop.time())
+    rendering: bool = False
+    waiters: List[asyncio.Future] = field(default_factory=list)
+
+
+def _not_modified(error: BadRequest) -> bool:
+    return "not modified" in str(error).lower()
+
+
+class StatusRenderer:
+    def __init__(self, timers: TimerScheduler, debounce: float = 0.5, max_views: int = 1000):
+        self.timers = timers
+        self.debounce = debounce
+        self.max_views = max_views
+        self._send: Optional[Sender] = None
+        self._edit: Optional[Editor] = None
+        self._on_error: Optional[ErrorHandler] = None
+        self._views: "OrderedDict[Key, StatusView]" = OrderedDict()
+        self._tasks: set = set()
+        self.sent = 0
+        self.edited = 0
+        self.fallbacks = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.evicted = 0
+
+    def start(self, send: Sender, edit: Editor, on_error: Optional[ErrorHandler] = None):
+        self._send = send
+        self._edit = edit
+        self._on_error = on_error
+
+    def show(
+        self,
+        chat_id: int,
+        gate_id: Hashable,
+        text: str,
+        markup: Optional[InlineKeyboardMarkup] = None,
+        priority: int = 0,
+        delay: Optional[float] = None,
+    ) -> asyncio.Future:
+        """Показать состояние не позже чем через delay секунд (по умолчанию debounce).
+
+        Future завершается (True/False), когда это или более новое состояние
+        показано; ждать его не обязательно. Вызывать на event loop.
+        """
+        loop = asyncio.get_running_loop()
+        key = (int(chat_id), gate_id)
+        view = self._view(key)
+        if view.desired is not None and view.desired != view.rendered:
+            self.coalesced += 1
+        view.desired = (text, markup)
+        view.priority = priority
+        waiter = loop.create_future()
+        view.waiters.append(waiter)
+        if view.rendering:
+            return waiter  # покажется сразу после текущей отправки
+
+        due = loop.time() + (self.debounce if delay is None else max(delay, 0.0))
+        if view.due is not None and view.due <= due:
+            return waiter
+        view.due = due
+        self.timers.schedule(("status", key), due - loop.time(), self._render_soon, key)
+        return waiter
+
+    def attach(self, chat_id: int, gate_id: Hashable, message_id: int):
+        """Следующий показ правит message_id (нажата inline-кнопка этого статуса)."""
+        view = self._view((int(chat_id), gate_id))
+        if view.message_id != message_id:
+            view.message_id = message_id
+            view.rendered = None
+
+    def reset(self, chat_id: int, gate_id: Hashable):
+        """Следующий показ — новым сообщением внизу чата."""
+        view = self._views.get((int(chat_id), gate_id))
+        if view is not None and not view.rendering:
+            view.message_id = None
+            view.rendered = None
+
+    def _view(self, key: Key) -> StatusView:
+        view = self._views.get(key)
+        if view is None:
+            view = self._views[key] = StatusView()
+            self._evict(keep=key)
+        else:
+            self._views.move_to_end(key)
+        return view
+
+    def _evict(self, keep: Key):
+        """Забыть самые старые статусы сверх max_views; занятые отправкой не трогаем."""
+        excess = len(self._views) - self.max_views
+        if excess <= 0:
+            return
+        idle = []
+        for key, view in self._views.items():
+            if len(idle) >= excess:
+                break
+            if key != keep and not view.rendering and not view.waiters and view.due is None:
+                idle.append(key)
+        for key in idle:
+            del self._views[key]
+        self.evicted += len(idle)
+
+    def _render_soon(self, key: Key):
+        task = asyncio.get_running_loop().create_task(self._render(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _render(self, key: Key):
+        view = self._views.get(key)
+        if view is None or view.rendering:
+            return
+        view.due = None
+        waiters, view.waiters = view.waiters, []
+        desired = view.desired
+        ok = True
+        if desired is not None and desired != view.rendered:
+            view.rendering = True
+            try:
+                ok = await self._deliver(key, view, desired)
+            finally:
+                view.rendering = False
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(ok)
+        if view.waiters and view.desired != view.rendered:
+            self.timers.schedule(("status", key), 0, self._render_soon, key)
+            view.due = asyncio.get_running_loop().time()
+        else:
+            for waiter in view.waiters:
+                if not waiter.done():
+                    waiter.set_result(ok)
+            view.waiters = []
+
+    async def _deliver(self, key: Key, view: StatusView, desired: Render) -> bool:
+        chat_id, gate_id = key
+        text, markup = desired
+        try:
+            if view.message_id is not None:
+                try:
+                    await self._edit(chat_id, view.message_id, text, markup, view.priority)
+                    self.edited += 1
+                    view.rendered = desired
+                    return True
+                except BadRequest as e:
+                    if _not_modified(e):
+                        view.rendered = desired
+                        return True
+                    # Сообщение удалено или слишком старое — отправляем новое
+                    self.fallbacks += 1
+            message = await self._send(chat_id, text, markup, view.priority)
+            self.sent += 1
+            view.message_id = getattr(message, "message_id", None)
+            view.rendered = desired
+            return True
+        except TelegramError as e:
+            self.failed += 1
+            if self._on_error is not None:
+                await self._on_error(chat_id, gate_id, e)
+            else:
+                print(f"[status] не удалось показать статус {chat_id} [{gate_id}]: {e}")
+            return False
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def __len__(self):
+        return len(self._views)
+
+    def stats(self) -> dict:
+        return {
+            "views": len(self._views),
+            "sent": self.sent,
+            "edited": self.edited,
+            "fallbacks": self.fallbacks,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import access_db  # noqa: E402
+import access_schema  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "access.db")
+
+
+@pytest.fixture
+def conn(db_path):
+    """access.db со всеми миграциями; соединение как у access_db.connect()."""
+    connection = access_db.connect(db_path)
+    access_schema.migrate(connection)
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Подменяет time.time() для access_db: clock[0] — текущее время."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(access_db.time, "time", lambda: now[0])
+    return now
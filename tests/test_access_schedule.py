@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import pytest
+import pytz
+
+from access_schedule import MOSCOW, ScheduleError, compile_schedule, get_schedule
+
+
+def at(day: int, hour: int, minute: int = 0) -> datetime:
+    """День недели 0–6 (пн–вс) недели, начинающейся с понедельника 2024-01-01."""
+    return MOSCOW.localize(datetime(2024, 1, 1 + day, hour, minute))
+
+
+MON, TUE, WED, THU, FRI, SAT, SUN = range(7)
+
+
+def test_always():
+    schedule = compile_schedule(" Always ")
+    assert schedule.always
+    assert schedule.allows(at(SUN, 3))
+
+
+def test_simple_range_bounds_inclusive():
+    schedule = compile_schedule("mon-fri 08:00-20:00")
+    assert schedule.allows(at(MON, 8, 0))
+    assert schedule.allows(at(FRI, 20, 0))
+    assert not schedule.allows(at(FRI, 20, 1))
+    assert not schedule.allows(at(MON, 7, 59))
+    assert not schedule.allows(at(SAT, 12))
+
+
+def test_overnight_range():
+    schedule = compile_schedule("mon 22:00-06:00")
+    assert schedule.allows(at(MON, 22))
+    assert schedule.allows(at(MON, 23, 59))
+    assert schedule.allows(at(TUE, 0, 0))
+    assert schedule.allows(at(TUE, 6, 0))
+    assert not schedule.allows(at(TUE, 6, 1))
+    assert not schedule.allows(at(MON, 3))
+    assert not schedule.allows(at(TUE, 22))
+
+
+def test_overnight_wraps_sunday_into_monday():
+    schedule = compile_schedule("sun 23:00-01:00")
+    assert schedule.allows(at(SUN, 23, 30))
+    assert schedule.allows(at(MON, 0, 30))
+    assert not schedule.allows(at(MON, 1, 1))
+
+
+def test_wrapped_day_range():
+    schedule = compile_schedule("fri-mon 10:00-12:00")
+    for day in (FRI, SAT, SUN, MON):
+        assert schedule.allows(at(day, 11)), day
+    for day in (TUE, WED, THU):
+        assert not schedule.allows(at(day, 11)), day
+
+
+def test_rules_joined_with_semicolon():
+    schedule = compile_schedule("weekdays 08:00-09:00; sat 10:00-14:00;")
+    assert schedule.allows(at(WED, 8, 30))
+    assert schedule.allows(at(SAT, 12))
+    assert not schedule.allows(at(SAT, 8, 30))
+    assert not schedule.allows(at(SUN, 12))
+
+
+def test_timezone_aware_time_is_converted():
+    schedule = compile_schedule("mon 10:00-10:00")
+    utc = at(MON, 10).astimezone(pytz.utc)
+    assert schedule.allows(utc)
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "",
+        ";",
+        "mon",
+        "mon 8:00",
+        "mon 08:00-20",
+        "mon 24:00-25:00",
+        "mon 08:60-09:00",
+        "funday 08:00-09:00",
+        "mon-xyz 08:00-09:00",
+        "mon 08:00-09:00 extra",
+    ],
+)
+def test_malformed_rejected(source):
+    with pytest.raises(ScheduleError):
+        compile_schedule(source)
+    assert get_schedule(source) is None
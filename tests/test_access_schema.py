@@ -0,0 +1,62 @@
+import sqlite3
+
+import access_db
+import access_schema
+
+
+def columns(conn, table):
+    return {row[1]: row for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def test_fresh_database(db_path):
+    conn = access_db.connect(db_path)
+    assert access_schema.migrate(conn) == access_schema.SCHEMA_VERSION
+
+    access_control = columns(conn, "access_control")
+    assert access_control["user_id"][5]  # PRIMARY KEY
+    assert "phone_norm" in access_control
+    for table in ("gate_subscriptions", "access_events", "bot_persistence", "gate_state", "leases"):
+        assert columns(conn, table), table
+    assert {"holder", "fence", "lease_until"} <= set(columns(conn, "gate_state"))
+    assert "holder" in columns(conn, "gate_commands")
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_migrate_is_idempotent(db_path):
+    conn = access_db.connect(db_path)
+    access_schema.migrate(conn)
+    assert access_schema.migrate(conn) == access_schema.SCHEMA_VERSION
+
+
+def test_legacy_table_without_key(db_path):
+    legacy = sqlite3.connect(db_path)
+    legacy.execute(
+        "CREATE TABLE access_control (user_id TEXT, username TEXT, fio TEXT, phone TEXT,"
+        " aprove TEXT, access_time TEXT, updated_at TEXT, telegram_link TEXT, note TEXT)"
+    )
+    legacy.executemany(
+        "INSERT INTO access_control (user_id, fio, phone, aprove, note) VALUES (?, ?, ?, ?, ?)",
+        [
+            ("1", "Старая", "+7 (900) 111-22-33", "pending", "a"),
+            ("2", "Вторая", "89002223344", "yes", "b"),
+            ("1", "Новая", "89001112233", "yes", "c"),
+            ("", "Пустой", "", "yes", "d"),
+        ],
+    )
+    legacy.commit()
+    legacy.close()
+
+    conn = access_db.connect(db_path)
+    assert access_schema.migrate(conn) == access_schema.SCHEMA_VERSION
+
+    assert columns(conn, "access_control")["user_id"][5]
+    rows = {
+        row["user_id"]: dict(row)
+        for row in conn.execute("SELECT * FROM access_control ORDER BY user_id")
+    }
+    assert set(rows) == {"1", "2"}
+    # Из дубликатов остаётся последняя строка, лишняя колонка сохраняется
+    assert rows["1"]["fio"] == "Новая"
+    assert rows["1"]["note"] == "c"
+    assert rows["1"]["phone_norm"] == "9001112233"
+    assert rows["2"]["phone_norm"] == "9002223344"
@@ -0,0 +1,123 @@
+import asyncio
+import importlib
+
+import pytest
+
+import access_db
+import access_schema
+from bench.fake_telegram import FakeTelegramAPI
+
+BOT_TOKEN = "100000:test-token"
+ADMIN_ID = 1
+RESIDENTS = ["11", "12", "13"]
+
+
+@pytest.fixture
+def bot_module(tmp_path, monkeypatch):
+    """OpenGateBot с окружением как у бенчмарка; access.db и логи — во временном каталоге."""
+    env = {
+        "BOT_TOKEN": BOT_TOKEN,
+        "user_mosquitto": "test",
+        "password_mosquitto": "test",
+        "HOST": "127.0.0.1",
+        "ADMIN_CHAT_ID": str(ADMIN_ID),
+        "METRICS_PORT": "0",
+        "LOG_ECHO": "0",
+    }
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.chdir(tmp_path)
+
+    conn = access_db.connect(str(tmp_path / "access.db"))
+    access_schema.migrate(conn)
+    with conn:
+        for user_id in RESIDENTS:
+            access_db.exec_insert_new_user(
+                conn, user_id, f"user{user_id}", f"Житель {user_id}", "", "yes", "always", "", ""
+            )
+        access_db.exec_insert_new_user(conn, "20", "user20", "Ожидает", "", "pending", "always", "", "")
+    conn.close()
+
+    module = importlib.import_module("OpenGateBot")
+    monkeypatch.setattr(module.log_writer, "log_dir", str(tmp_path / "logs"))
+    return module
+
+
+def make_update(bot, chat_id: int, text: str):
+    from telegram import Update
+
+    return Update.de_json(
+        {
+            "update_id": 1,
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Admin"},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len("/broadcast")}],
+            },
+        },
+        bot,
+    )
+
+
+async def run_command(bot_module, chat_id: int, text: str, api: FakeTelegramAPI, wait_for=None):
+    from telegram.ext import ApplicationBuilder
+
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(api.base_url)
+        .updater(None)
+        .build()
+    )
+    bot_module.register_handlers(app)
+    await bot_module.init_db_pool()
+    await app.initialize()
+    try:
+        await app.process_update(make_update(app.bot, chat_id, text))
+        # Отчёт администратору уходит фоновой задачей после доставки рассылки
+        for _ in range(100 if wait_for else 0):
+            if any(wait_for in m[2] for m in api.messages.get(ADMIN_ID, ())):
+                break
+            await asyncio.sleep(0.02)
+    finally:
+        await bot_module.on_stop(app)
+        await app.shutdown()
+        await bot_module.on_shutdown(app)
+
+
+def test_broadcast_reaches_approved_users_and_reports(bot_module):
+    async def scenario():
+        api = FakeTelegramAPI()
+        await api.start()
+        try:
+            await run_command(
+                bot_module, ADMIN_ID, "/broadcast Плановые работы", api, wait_for="Рассылка завершена"
+            )
+        finally:
+            await api.stop()
+        return api
+
+    api = asyncio.run(scenario())
+    for user_id in RESIDENTS:
+        assert [m[2] for m in api.messages[int(user_id)]] == ["Плановые работы"]
+    assert 20 not in api.messages
+    admin_texts = [m[2] for m in api.messages[ADMIN_ID]]
+    assert admin_texts[0].startswith("📣 Рассылка поставлена в очередь: 3")
+    assert admin_texts[-1] == "📣 Рассылка завершена: доставлено 3, ошибок 0"
+
+
+def test_broadcast_ignored_outside_admin_chat(bot_module):
+    async def scenario():
+        api = FakeTelegramAPI()
+        await api.start()
+        try:
+            await run_command(bot_module, 11, "/broadcast Плановые работы", api)
+        finally:
+            await api.stop()
+        return api
+
+    api = asyncio.run(scenario())
+    assert not any(api.messages.values())
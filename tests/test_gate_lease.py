@@ -0,0 +1,124 @@
+import access_db
+
+TTL = 10.0
+
+
+def claim(conn, user_id, holder, worker=0, gate_id="main"):
+    with conn:
+        return access_db.exec_claim_gate(conn, gate_id, user_id, worker, holder, TTL)
+
+
+def test_claim_free_gate(conn, clock):
+    lease = claim(conn, "1", "A")
+    assert lease["active_user_id"] == "1"
+    assert lease["holder"] == "A"
+    assert lease["fence"] == 1
+    assert lease["lease_until"] == clock[0] + TTL
+
+
+def test_live_lease_refuses_second_holder(conn, clock):
+    claim(conn, "1", "A")
+    clock[0] += TTL - 1
+    lease = claim(conn, "2", "B")
+    assert (lease["active_user_id"], lease["holder"], lease["fence"]) == ("1", "A", 1)
+    # Тот же пользователь через другой процесс — тоже отказ
+    lease = claim(conn, "1", "B")
+    assert lease["holder"] == "A"
+
+
+def test_own_lease_is_extended_without_new_fence(conn, clock):
+    claim(conn, "1", "A")
+    clock[0] += 5
+    lease = claim(conn, "1", "A")
+    assert lease["fence"] == 1
+    assert lease["lease_until"] == clock[0] + TTL
+
+
+def test_expired_lease_is_taken_over_with_new_fence(conn, clock):
+    claim(conn, "1", "A")
+    clock[0] += TTL
+    lease = claim(conn, "2", "B")
+    assert (lease["active_user_id"], lease["holder"], lease["fence"]) == ("2", "B", 2)
+
+
+def test_fence_grows_after_release(conn, clock):
+    claim(conn, "1", "A")
+    with conn:
+        assert access_db.exec_release_gate(conn, "main", "1", 1)
+    lease = claim(conn, "1", "A")
+    assert lease["fence"] == 2
+
+
+def test_renew(conn, clock):
+    claim(conn, "1", "A")
+    clock[0] += 5
+    with conn:
+        assert access_db.exec_renew_gate(conn, "main", "A", 1, TTL)
+    row = access_db.query_gate_state(conn, "main")
+    assert row["lease_until"] == clock[0] + TTL
+
+
+def test_renew_with_old_fence_fails(conn, clock):
+    claim(conn, "1", "A")
+    clock[0] += TTL + 1
+    claim(conn, "2", "B")
+    with conn:
+        assert not access_db.exec_renew_gate(conn, "main", "A", 1, TTL)
+        # Совпадение holder без актуального fence не помогает
+        assert not access_db.exec_renew_gate(conn, "main", "B", 1, TTL)
+        assert access_db.exec_renew_gate(conn, "main", "B", 2, TTL)
+
+
+def test_release_with_old_fence_keeps_new_lease(conn, clock):
+    claim(conn, "1", "A")
+    clock[0] += TTL
+    claim(conn, "1", "B")
+    with conn:
+        assert not access_db.exec_release_gate(conn, "main", "1", 1)
+    assert access_db.query_gate_state(conn, "main")["holder"] == "B"
+
+
+def test_idle_event_releases_active_user(conn, clock):
+    claim(conn, "1", "A")
+    with conn:
+        access_db.exec_gate_event(conn, "main", "IDLE", "2")
+    assert access_db.query_gate_state(conn, "main")["active_user_id"] == "1"
+    with conn:
+        access_db.exec_gate_event(conn, "main", "IDLE", "1")
+    row = access_db.query_gate_state(conn, "main")
+    assert row["state"] == "IDLE"
+    assert row["active_user_id"] is None and row["holder"] is None
+
+
+def test_reset_worker_keeps_live_lease_of_other_instance(conn, clock):
+    claim(conn, "1", "A", worker=0, gate_id="g1")
+    claim(conn, "2", "B", worker=0, gate_id="g2")
+    claim(conn, "3", "C", worker=0, gate_id="g3")
+    with conn:
+        access_db.exec_add_gate_command(conn, "r1", "g1", "1", "OPEN", 0, "A")
+        access_db.exec_add_gate_command(conn, "r3", "g3", "3", "OPEN", 0, "C")
+    clock[0] += 5
+    claim(conn, "2", "B", worker=0, gate_id="g2")  # B продлевает, A и C — нет
+    clock[0] += 6
+
+    with conn:
+        access_db.exec_reset_worker(conn, 0, "C", stale_after=20)
+
+    holders = {
+        row["gate_id"]: row["holder"]
+        for row in conn.execute("SELECT gate_id, holder FROM gate_state")
+    }
+    assert holders == {"g1": None, "g2": "B", "g3": None}
+    commands = [row[0] for row in conn.execute("SELECT request_id FROM gate_commands")]
+    assert commands == ["r1"]
+
+
+def test_leader_lease(conn, clock):
+    with conn:
+        assert access_db.exec_acquire_lease(conn, "bot", "A", TTL) == 1
+        assert access_db.exec_acquire_lease(conn, "bot", "B", TTL) is None
+    clock[0] += TTL
+    with conn:
+        assert access_db.exec_acquire_lease(conn, "bot", "B", TTL) == 2
+        assert access_db.exec_release_lease(conn, "bot", "B")
+        assert access_db.exec_acquire_lease(conn, "bot", "A", TTL) == 3
@@ -0,0 +1,60 @@
+from gate_queue import GateQueue
+
+
+def test_fifo_order():
+    queue = GateQueue()
+    assert queue.enqueue("1", "a", "OPEN") == (1, False)
+    assert queue.enqueue("2", "b", "CLOSE") == (2, False)
+    first, expired = queue.pop_next()
+    second, _ = queue.pop_next()
+    assert (first.user_id, second.user_id) == ("1", "2")
+    assert expired == []
+    assert queue.pop_next() == (None, [])
+
+
+def test_same_command_coalesced_into_last_ticket():
+    queue = GateQueue()
+    queue.enqueue("1", "a", "OPEN")
+    assert queue.enqueue("2", "b", "OPEN") == (1, True)
+    assert queue.enqueue("3", "c", "OPEN") == (1, True)
+    assert len(queue) == 1
+    ticket, _ = queue.pop_next()
+    assert ticket.user_ids() == ["1", "2", "3"]
+    assert queue.stats()["coalesced"] == 2
+
+
+def test_repeat_request_keeps_position():
+    queue = GateQueue()
+    queue.enqueue("1", "a", "OPEN")
+    queue.enqueue("2", "b", "CLOSE")
+    queue.enqueue("3", "c", "CLOSE")
+    assert queue.enqueue("3", "c", "CLOSE") == (2, True)
+    assert queue.position("3") == 2
+    assert queue.position("4") is None
+    assert queue.stats()["enqueued"] == 2
+
+
+def test_expired_tickets_skipped():
+    queue = GateQueue(ttl=60)
+    queue.enqueue("1", "a", "OPEN")
+    queue.enqueue("2", "b", "CLOSE")
+    queue.enqueue("3", "c", "OPEN")
+    for ticket in list(queue._waiting)[:2]:
+        ticket.created_at -= 61
+
+    ticket, expired = queue.pop_next()
+    assert ticket.user_id == "3"
+    assert [t.user_id for t in expired] == ["1", "2"]
+    assert queue.stats()["expired"] == 2
+
+
+def test_push_front_returns_ticket_first():
+    queue = GateQueue()
+    queue.enqueue("1", "a", "OPEN")
+    queue.enqueue("2", "b", "CLOSE")
+    ticket, _ = queue.pop_next()
+    queue.push_front(ticket)
+    assert queue.position("1") == 1
+    assert queue.stats()["dispatched"] == 0
+    again, _ = queue.pop_next()
+    assert again is ticket
@@ -0,0 +1,101 @@
+import pytest
+
+from gate_state import DeviceEvent, GateStateMachine
+
+
+def event(status, seq=None, timestamp=None, request_id=None, user_id="1"):
+    data = {"user_id": user_id, "request_id": request_id, "seq": seq, "timestamp": timestamp}
+    return DeviceEvent.from_payload(status, data)
+
+
+@pytest.fixture
+def machine():
+    return GateStateMachine(resync_after=300)
+
+
+def test_normal_cycle_accepted(machine):
+    assert machine.accept("IDLE", event("OPENING", seq=1)) is None
+    assert machine.accept("OPENING", event("IDLE", seq=2)) is None
+    assert machine.stats()["accepted"] == 2
+
+
+def test_unknown_status(machine):
+    assert machine.accept("IDLE", event("OPEN")) == "unknown"
+    assert machine.accept("IDLE", event("garbage")) == "unknown"
+
+
+def test_status_is_normalized(machine):
+    assert machine.accept("IDLE", event(" opening ", seq=1)) is None
+
+
+def test_duplicate_seq(machine):
+    machine.accept("IDLE", event("OPENING", seq=5))
+    assert machine.accept("OPENING", event("IDLE", seq=5)) == "duplicate"
+
+
+def test_duplicate_identity_without_seq(machine):
+    machine.accept("IDLE", event("OPENING", request_id="r1"))
+    assert machine.accept("OPENING", event("OPENING", request_id="r1")) == "duplicate"
+    # Тот же статус от другой команды (объединённое открытие) — не повтор
+    assert machine.accept("OPENING", event("OPENING", request_id="r2")) is None
+
+
+def test_stale_seq(machine):
+    machine.accept("IDLE", event("OPENING", seq=10))
+    assert machine.accept("OPENING", event("IDLE", seq=9)) == "stale"
+    assert machine.dropped["stale"] == 1
+
+
+def test_stale_timestamp(machine):
+    machine.accept("IDLE", event("OPENING", timestamp="2024-01-01T10:00:30+03:00"))
+    late = event("IDLE", timestamp="2024-01-01T10:00:10+03:00")
+    assert machine.accept("OPENING", late) == "stale"
+
+
+def test_seq_reset_is_resync(machine):
+    machine.accept("IDLE", event("OPENING", seq=40))
+    assert machine.accept("OPENING", event("IDLE", seq=1)) is None
+    assert machine.resyncs == 1
+    assert machine.accept("IDLE", event("OPENING", seq=2)) is None
+
+
+def test_clock_jump_back_is_resync(machine):
+    machine.accept("IDLE", event("OPENING", timestamp="2024-01-01T12:00:00+03:00"))
+    rebooted = event("IDLE", timestamp="2024-01-01T11:00:00+03:00")
+    assert machine.accept("OPENING", rebooted) is None
+    assert machine.resyncs == 1
+
+
+def test_seq_takes_priority_over_timestamp(machine):
+    machine.accept("IDLE", event("OPENING", seq=1, timestamp="2024-01-01T10:00:30+03:00"))
+    newer = event("IDLE", seq=2, timestamp="2024-01-01T10:00:10+03:00")
+    assert machine.accept("OPENING", newer) is None
+
+
+def test_impossible_transition(machine):
+    # Остановить стоящую калитку нельзя
+    assert machine.accept("IDLE", event("STOPPED")) == "transition"
+    assert machine.dropped["transition"] == 1
+    assert machine.accept("OPENING", event("STOPPED")) is None
+
+
+def test_dropped_event_does_not_move_cursor(machine):
+    machine.accept("IDLE", event("OPENING", seq=3))
+    assert machine.accept("OPENING", event("IDLE", seq=2)) == "stale"
+    assert machine.last_seq == 3
+
+
+def test_transition_checked_against_device_state(machine):
+    assert machine.accept("IDLE", event("OPENING", seq=1)) is None
+    # Бот сбросил калитку в IDLE по таймауту, устройство ещё открывается
+    assert machine.accept("IDLE", event("STOPPED", seq=2)) is None
+    assert machine.accept("IDLE", event("IDLE", seq=3)) is None
+    assert machine.device_state == "IDLE"
+    assert machine.accept("IDLE", event("STOPPED", seq=4)) == "transition"
+
+
+def test_resync_falls_back_to_bot_state(machine):
+    machine.accept("IDLE", event("OPENING", seq=40))
+    assert machine.accept("IDLE", event("STOPPED", seq=1)) == "transition"
+    assert machine.device_state is None
+    assert machine.accept("IDLE", event("IDLE", seq=1)) is None
@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+from telegram.error import Forbidden, NetworkError, RetryAfter
+
+from outbox import PRIORITY_BULK, PRIORITY_GATE, PRIORITY_INTERACTIVE, PRIORITY_NOTICE, Outbox
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def fast_outbox(**kwargs) -> Outbox:
+    options = dict(global_rate=1000, global_burst=100, chat_rate=1000, chat_burst=100, backoff_base=0.001)
+    options.update(kwargs)
+    return Outbox(**options)
+
+
+def recorder(sent, label, result=None):
+    async def call():
+        sent.append(label)
+        return result
+
+    return call
+
+
+def test_send_returns_result():
+    async def scenario():
+        outbox = fast_outbox()
+        sent = []
+        result = await outbox.send(1, recorder(sent, "a", result="ok"))
+        await outbox.stop()
+        return result, sent, outbox
+
+    result, sent, outbox = run(scenario())
+    assert (result, sent) == ("ok", ["a"])
+    assert outbox.stats()["sent"] == 1
+
+
+def test_priority_order_within_chat():
+    async def scenario():
+        outbox = fast_outbox(concurrency=1)
+        sent = []
+        futures = [
+            outbox.submit(1, recorder(sent, "bulk"), PRIORITY_BULK),
+            outbox.submit(1, recorder(sent, "notice"), PRIORITY_NOTICE),
+            outbox.submit(1, recorder(sent, "interactive"), PRIORITY_INTERACTIVE),
+            outbox.submit(1, recorder(sent, "gate"), PRIORITY_GATE),
+            outbox.submit(1, recorder(sent, "interactive-2"), PRIORITY_INTERACTIVE),
+        ]
+        await asyncio.gather(*futures)
+        await outbox.stop()
+        return sent
+
+    assert run(scenario()) == ["gate", "interactive", "interactive-2", "notice", "bulk"]
+
+
+def test_chat_rate_spaces_messages():
+    async def scenario():
+        outbox = fast_outbox(chat_rate=20, chat_burst=1, chat_reserve=0)
+        loop = asyncio.get_running_loop()
+        times = []
+
+        async def call():
+            times.append(loop.time())
+
+        await asyncio.gather(*(outbox.submit(1, call) for _ in range(3)))
+        await outbox.stop()
+        return times
+
+    times = run(scenario())
+    assert times[2] - times[0] >= 2 / 20 * 0.9
+
+
+def test_bulk_leaves_reserve_for_interactive():
+    async def scenario():
+        outbox = fast_outbox(chat_rate=0.001, chat_burst=2, chat_reserve=1)
+        sent = []
+        bulk = [outbox.submit(1, recorder(sent, f"bulk{i}"), PRIORITY_BULK) for i in range(2)]
+        await asyncio.sleep(0.05)
+        reply = await asyncio.wait_for(outbox.send(1, recorder(sent, "reply", result="ok")), 1)
+        await outbox.stop(timeout=0)
+        return sent, reply, bulk
+
+    sent, reply, bulk = run(scenario())
+    # Первая рассылка забирает один токен, последний остаётся для ответа
+    assert sent == ["bulk0", "reply"]
+    assert reply == "ok"
+    assert bulk[1].cancelled()
+
+
+def test_retry_after_pauses_and_retries():
+    async def scenario():
+        outbox = fast_outbox()
+        attempts = []
+
+        async def call():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RetryAfter(0)
+            return "ok"
+
+        result = await outbox.send(1, call)
+        await outbox.stop()
+        return result, attempts, outbox
+
+    result, attempts, outbox = run(scenario())
+    assert result == "ok"
+    assert len(attempts) == 2
+    assert outbox.retry_after_events == 1 and outbox.retried == 1
+
+
+def test_network_error_retried_then_fails():
+    async def scenario():
+        outbox = fast_outbox(max_attempts=3)
+        attempts = []
+
+        async def call():
+            attempts.append(1)
+            raise NetworkError("timeout")
+
+        with pytest.raises(NetworkError):
+            await outbox.send(1, call)
+        await outbox.stop()
+        return attempts, outbox
+
+    attempts, outbox = run(scenario())
+    assert len(attempts) == 3
+    assert outbox.failed == 1 and outbox.retried == 2
+
+
+def test_forbidden_is_not_retried_and_chat_continues():
+    async def scenario():
+        outbox = fast_outbox()
+        sent = []
+        attempts = []
+
+        async def blocked():
+            attempts.append(1)
+            raise Forbidden("bot was blocked by the user")
+
+        first = outbox.submit(1, blocked)
+        second = outbox.submit(1, recorder(sent, "next"))
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        await outbox.stop()
+        return results, attempts, sent
+
+    results, attempts, sent = run(scenario())
+    assert isinstance(results[0], Forbidden)
+    assert len(attempts) == 1
+    assert sent == ["next"]
+
+
+def test_stop_cancels_undelivered():
+    async def scenario():
+        outbox = fast_outbox(chat_rate=0.001, chat_burst=1, chat_reserve=0)
+        sent = []
+        first = outbox.submit(1, recorder(sent, "first"))
+        second = outbox.submit(1, recorder(sent, "second"))
+        await first
+        await outbox.stop(timeout=0)
+        return second, sent, outbox
+
+    second, sent, outbox = run(scenario())
+    assert sent == ["first"]
+    assert second.cancelled()
+    assert outbox.queued == 0
+
+
+def test_share_global_splits_rate_and_reserve():
+    outbox = Outbox(global_rate=30, global_burst=6, global_reserve=2)
+    outbox.share_global(1 / 3)
+    assert outbox._global.rate == pytest.approx(10)
+    assert outbox._global.burst == pytest.approx(2)
+    assert outbox.global_reserve == pytest.approx(2 / 3)
+
+
+def test_share_global_leaves_room_for_notices():
+    async def scenario():
+        outbox = fast_outbox(global_rate=30, global_burst=5, global_reserve=2)
+        outbox.share_global(1 / 4)
+        sent = []
+        await asyncio.wait_for(outbox.send(1, recorder(sent, "notice"), PRIORITY_NOTICE), 1)
+        await outbox.stop()
+        return sent
+
+    assert run(scenario()) == ["notice"]
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from pending_commands import PendingCommands
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_resolve_by_request_id():
+    async def scenario():
+        commands = PendingCommands()
+        first = commands.register("main", "1", "OPEN", timeout=10)
+        second = commands.register("main", "1", "OPEN", timeout=10)
+        assert first.request_id != second.request_id
+        # Ответ на вторую команду не подтверждает первую
+        assert commands.resolve(second.request_id, {"status": "OPENING"}) is second
+        return first, second, commands
+
+    first, second, commands = run(scenario())
+    assert second.future.result() == {"status": "OPENING"}
+    assert second.confirmed_at is not None
+    assert not first.future.done()
+    assert len(commands) == 1
+
+
+def test_late_or_unknown_status_is_unmatched():
+    async def scenario():
+        commands = PendingCommands()
+        pending = commands.register("main", "1", "OPEN", timeout=10)
+        commands.discard(pending.request_id)
+        assert commands.resolve(pending.request_id, {}) is None
+        assert commands.resolve("missing", {}) is None
+        return commands
+
+    stats = run(scenario()).stats()
+    assert stats["unmatched"] == 2
+    assert stats["in_flight"] == 0
+
+
+def test_legacy_resolves_oldest_of_same_user_and_gate():
+    async def scenario():
+        commands = PendingCommands()
+        older = commands.register("main", "1", "OPEN", timeout=10)
+        other_gate = commands.register("g2", "1", "OPEN", timeout=10)
+        newer = commands.register("main", "1", "STOP", timeout=10)
+        assert commands.resolve_legacy("main", "1", {}) is older
+        assert commands.resolve_legacy("main", "1", {}) is newer
+        assert commands.resolve_legacy("main", "1", {}) is None
+        assert commands.resolve_legacy("main", "2", {}) is None
+        return other_gate, commands
+
+    other_gate, commands = run(scenario())
+    assert not other_gate.future.done()
+    assert commands.stats()["unmatched"] == 2
+
+
+def test_timeout_fails_waiter():
+    async def scenario():
+        commands = PendingCommands()
+        pending = commands.register("main", "1", "OPEN", timeout=10)
+        assert commands.timeout(pending.request_id) is pending
+        assert commands.timeout(pending.request_id) is None
+        with pytest.raises(asyncio.TimeoutError):
+            await pending.future
+        return commands
+
+    assert run(scenario()).stats()["expired"] == 1
+
+
+def test_expire_sweeps_past_deadline():
+    async def scenario():
+        commands = PendingCommands(sweep_interval=5)
+        stale = commands.register("main", "1", "OPEN", timeout=1)
+        fresh = commands.register("main", "2", "OPEN", timeout=100)
+        # register() сам запускает проход, следующий — через sweep_interval
+        now = stale.deadline + commands.sweep_interval
+        assert commands.expire(now) == [stale]
+        # Следующий проход — не раньше sweep_interval
+        assert commands.expire(now + 1) == []
+        return stale, fresh, commands
+
+    stale, fresh, commands = run(scenario())
+    assert isinstance(stale.future.exception(), asyncio.TimeoutError)
+    assert not fresh.future.done()
+    assert len(commands) == 1
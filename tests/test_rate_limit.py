@@ -0,0 +1,98 @@
+import pytest
+
+from rate_limit import RateLimiter, TokenBucket, format_retry, rate_from_interval
+
+
+@pytest.fixture
+def now():
+    """Монотонные часы для вёдер: now[0] — текущее время."""
+    return [100.0]
+
+
+def test_bucket_burst_then_refill(now):
+    bucket = TokenBucket(rate=2, burst=3, clock=lambda: now[0])
+    assert [bucket.try_acquire()[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = bucket.try_acquire()
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.try_acquire() == (True, 0.0)
+
+
+def test_bucket_never_exceeds_burst(now):
+    bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0])
+    now[0] += 100
+    assert bucket.is_full()
+    assert bucket.tokens == 2
+    assert bucket.wait_time(3) == pytest.approx(0.1)
+
+
+def test_zero_rate_waits_forever(now):
+    bucket = TokenBucket(rate=0, burst=1, clock=lambda: now[0])
+    bucket.try_acquire()
+    assert bucket.try_acquire() == (False, float("inf"))
+    assert bucket.wait_time() == float("inf")
+
+
+def test_limiter_keys_are_independent(now):
+    limiter = RateLimiter(rate=1, burst=1, clock=lambda: now[0])
+    assert limiter.try_acquire("a")[0]
+    assert not limiter.try_acquire("a")[0]
+    assert limiter.try_acquire("b")[0]
+    assert limiter.stats() == {"keys": 2, "allowed": 2, "rejected": 1}
+
+
+def test_refund_returns_token(now):
+    limiter = RateLimiter(rate=1, burst=1, clock=lambda: now[0])
+    limiter.try_acquire("a")
+    limiter.refund("a")
+    assert limiter.try_acquire("a")[0]
+    # Возврат не поднимает ведро выше burst и не создаёт ключ
+    limiter.refund("a", 5)
+    assert limiter.bucket("a").tokens == 1
+    limiter.refund("missing")
+    assert limiter.stats()["keys"] == 1
+
+
+def test_eviction_keeps_new_key(now):
+    limiter = RateLimiter(rate=1, burst=1, max_keys=2, clock=lambda: now[0])
+    limiter.try_acquire("a")
+    limiter.try_acquire("b")
+    # Новое ведро полное, но выкинуть его сразу после вставки нельзя
+    bucket = limiter.bucket("c")
+    assert limiter.bucket("c") is bucket
+    assert limiter.stats()["keys"] == 2
+    assert not limiter.try_acquire("b")[0]
+
+
+def test_eviction_prefers_full_buckets(now):
+    limiter = RateLimiter(rate=1, burst=1, max_keys=3, clock=lambda: now[0])
+    limiter.bucket("idle")  # полное ведро
+    limiter.try_acquire("busy1")
+    limiter.try_acquire("busy2")
+    limiter.try_acquire("new")
+    assert set(limiter._buckets) == {"busy1", "busy2", "new"}
+    # Исчерпанное ведро не сбросилось вытеснением
+    assert not limiter.try_acquire("busy1")[0]
+
+
+def test_eviction_falls_back_to_least_recent(now):
+    limiter = RateLimiter(rate=1, burst=1, max_keys=2, clock=lambda: now[0])
+    limiter.try_acquire("a")
+    limiter.try_acquire("b")
+    limiter.bucket("a")  # «a» использовано недавно
+    limiter.try_acquire("c")
+    assert list(limiter._buckets) == ["a", "c"]
+
+
+def test_rate_from_interval():
+    assert rate_from_interval(4) == 0.25
+    assert rate_from_interval(0) > 1e6
+
+
+@pytest.mark.parametrize(
+    "retry_after, seconds",
+    [(None, 1), (0, 1), (0.2, 1), (1.0, 1), (1.01, 2), (float("inf"), 1)],
+)
+def test_format_retry(retry_after, seconds):
+    assert format_retry(retry_after) == seconds
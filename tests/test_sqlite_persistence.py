@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+import access_db
+import access_db_async
+from sqlite_persistence import SQLitePersistence
+
+
+@pytest.fixture
+def pool(db_path, monkeypatch):
+    """Отдельный пул на временную access.db вместо общего пула бота."""
+    pool = access_db_async.ConnectionPool(db_path)
+    monkeypatch.setattr(access_db_async, "_pool", pool)
+    return pool
+
+
+@pytest.fixture
+def row_reads(pool, monkeypatch):
+    """Считает чтения строк user_data из БД."""
+    reads = []
+    read = pool.read
+
+    async def counting_read(fn, *args):
+        if fn is access_db.query_persistence_row:
+            reads.append(args)
+        return await read(fn, *args)
+
+    monkeypatch.setattr(pool, "read", counting_read)
+    return reads
+
+
+def run(pool, scenario):
+    async def wrapper():
+        await pool.open()
+        try:
+            return await scenario()
+        finally:
+            await pool.close()
+
+    return asyncio.run(wrapper())
+
+
+async def save_user(user_id: int, data: dict):
+    persistence = SQLitePersistence(flush_delay=0)
+    await persistence.update_user_data(user_id, data)
+    await persistence.flush()
+
+
+def test_user_data_round_trip(pool):
+    async def scenario():
+        await save_user(1, {"phone": "9001112233"})
+        persistence = SQLitePersistence()
+        user_data = {"step": "menu"}
+        await persistence.refresh_user_data(1, user_data)
+        return user_data, persistence
+
+    user_data, persistence = run(pool, scenario)
+    # Записанное в памяти до загрузки новее сохранённого и не затирается
+    assert user_data == {"phone": "9001112233", "step": "menu"}
+    assert persistence.stats()["lazy_loads"] == 1
+
+
+def test_concurrent_refresh_waits_for_one_load(pool, row_reads):
+    async def scenario():
+        await save_user(1, {"phone": "9001112233"})
+        persistence = SQLitePersistence()
+        user_data = {}
+        seen = []
+
+        async def update():
+            await persistence.refresh_user_data(1, user_data)
+            seen.append(dict(user_data))
+
+        await asyncio.gather(update(), update(), update())
+        return seen
+
+    seen = run(pool, scenario)
+    assert seen == [{"phone": "9001112233"}] * 3
+    assert len(row_reads) == 2  # save_user дочитывает перед записью + одна общая загрузка
+
+
+def test_unchanged_data_is_not_rewritten(pool):
+    async def scenario():
+        persistence = SQLitePersistence(flush_delay=0)
+        await persistence.update_user_data(1, {"a": 1})
+        await persistence.flush()
+        await persistence.update_user_data(1, {"a": 1})
+        await persistence.update_bot_data({})
+        await persistence.flush()
+        return persistence.stats()
+
+    stats = run(pool, scenario)
+    assert stats["rows_written"] == 2
+    assert stats["rows_skipped"] == 1
+
+
+def test_bot_data_is_per_key(pool):
+    async def scenario():
+        first = SQLitePersistence(flush_delay=0)
+        first.bot_data_key = "worker0"
+        await first.update_bot_data({"owner": 0})
+        await first.flush()
+        second = SQLitePersistence(flush_delay=0)
+        second.bot_data_key = "worker1"
+        await second.update_bot_data({"owner": 1})
+        await second.flush()
+
+        reader = SQLitePersistence()
+        reader.bot_data_key = "worker0"
+        return await reader.get_bot_data()
+
+    assert run(pool, scenario) == {"owner": 0}
+
+
+def test_drop_during_load_keeps_data_empty(pool):
+    async def scenario():
+        await save_user(1, {"phone": "9001112233"})
+        persistence = SQLitePersistence(flush_delay=0)
+        user_data = {}
+        load = asyncio.ensure_future(persistence.refresh_user_data(1, user_data))
+        await asyncio.sleep(0)
+        await persistence.drop_user_data(1)
+        await load
+        await persistence.flush()
+
+        reloaded = {}
+        await SQLitePersistence().refresh_user_data(1, reloaded)
+        return user_data, reloaded
+
+    user_data, reloaded = run(pool, scenario)
+    assert user_data == {}
+    assert reloaded == {}
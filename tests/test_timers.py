@@ -0,0 +1,129 @@
+import asyncio
+
+from timers import COMPACT_MIN_SIZE, TimerScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_fires_in_deadline_order():
+    async def scenario():
+        timers = TimerScheduler()
+        fired = []
+        timers.schedule("b", 0.02, fired.append, "b")
+        timers.schedule("a", 0.01, fired.append, "a")
+        await asyncio.sleep(0.05)
+        return fired, timers
+
+    fired, timers = run(scenario())
+    assert fired == ["a", "b"]
+    assert timers.pending == 0
+    assert timers.stats()["fired"] == 2
+
+
+def test_cancel():
+    async def scenario():
+        timers = TimerScheduler()
+        fired = []
+        timers.schedule("a", 0.01, fired.append, "a")
+        assert "a" in timers
+        assert timers.cancel("a")
+        assert not timers.cancel("a")
+        await asyncio.sleep(0.03)
+        return fired, timers
+
+    fired, timers = run(scenario())
+    assert fired == []
+    assert timers.cancelled == 1
+    assert timers.pending == 0
+
+
+def test_reschedule_replaces_timer():
+    async def scenario():
+        timers = TimerScheduler()
+        fired = []
+        timers.schedule("k", 0.01, fired.append, "first")
+        timers.schedule("k", 0.03, fired.append, "second")
+        await asyncio.sleep(0.02)
+        early = list(fired)
+        await asyncio.sleep(0.03)
+        return early, fired, timers
+
+    early, fired, timers = run(scenario())
+    assert early == []
+    assert fired == ["second"]
+    assert timers.pending == 0
+
+
+def test_reschedule_earlier_rearms():
+    async def scenario():
+        timers = TimerScheduler()
+        fired = []
+        timers.schedule("k", 10, fired.append, "late")
+        timers.schedule("k", 0.01, fired.append, "early")
+        await asyncio.sleep(0.03)
+        await timers.stop()
+        return fired
+
+    assert run(scenario()) == ["early"]
+
+
+def test_async_callback_runs_as_task():
+    async def scenario():
+        timers = TimerScheduler()
+        done = asyncio.Event()
+
+        async def callback():
+            done.set()
+
+        timers.schedule("k", 0, callback)
+        await asyncio.wait_for(done.wait(), 1)
+        await timers.stop()
+        return timers
+
+    assert run(scenario()).failed == 0
+
+
+def test_failing_callback_is_counted():
+    async def scenario():
+        timers = TimerScheduler()
+        timers.schedule("k", 0, lambda: 1 / 0)
+        timers.schedule("ok", 0.01, lambda: None)
+        await asyncio.sleep(0.03)
+        return timers
+
+    timers = run(scenario())
+    assert timers.failed == 1
+    assert timers.fired == 2
+
+
+def test_mass_cancel_compacts_heap():
+    async def scenario():
+        timers = TimerScheduler()
+        count = COMPACT_MIN_SIZE * 4
+        for i in range(count):
+            timers.schedule(i, 60, lambda: None)
+        for i in range(count - 1):
+            timers.cancel(i)
+        stats = timers.stats()
+        await timers.stop()
+        return stats
+
+    stats = run(scenario())
+    assert stats["pending"] == 1
+    assert stats["heap"] <= COMPACT_MIN_SIZE * 2
+
+
+def test_stop_cancels_pending():
+    async def scenario():
+        timers = TimerScheduler()
+        fired = []
+        timers.schedule("a", 0.01, fired.append, "a")
+        await timers.stop()
+        await asyncio.sleep(0.03)
+        return fired, timers
+
+    fired, timers = run(scenario())
+    assert fired == []
+    assert timers.pending == 0
@@ -0,0 +1,154 @@
+"""Общий планировщик отложенных действий: резервный сброс калитки, таймауты подтверждения.
+
+Вместо задачи со sleep() на каждую команду — одна куча сроков и один
+loop.call_at() на ближайший из них. У таймера есть ключ (например
+("idle", gate_id)); повторный schedule() с тем же ключом заменяет старый
+таймер, cancel() снимает его за O(1): запись в куче только помечается и
+выбрасывается, когда дойдёт до вершины или при уплотнении кучи. Таймер,
+который не сработал, ничего не стоит — ни задачи, ни пробуждения.
+
+Колбэк вызывается на event loop; если он возвращает корутину, она
+запускается отдельной задачей.
+"""
+
+import asyncio
+import heapq
+import itertools
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# Куча пересобирается, когда отменённых записей в ней больше половины
+COMPACT_MIN_SIZE = 64
+
+
+class Timer:
+    __slots__ = ("key", "deadline", "callback", "args", "cancelled")
+
+    def __init__(self, key: Hashable, deadline: float, callback: Callable, args: tuple):
+        self.key = key
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Timer]] = []
+        self._timers: Dict[Hashable, Timer] = {}
+        self._seq = itertools.count()
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._armed_at: Optional[float] = None
+        self._stale = 0  # отменённые записи, ещё лежащие в куче
+        self._tasks: set = set()
+        self.scheduled = 0
+        self.fired = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable, *args) -> Timer:
+        """callback(*args) через delay секунд; таймер с тем же ключом заменяется."""
+        loop = asyncio.get_running_loop()
+        self._drop(key)
+        timer = Timer(key, loop.time() + max(delay, 0.0), callback, args)
+        self._timers[key] = timer
+        heapq.heappush(self._heap, (timer.deadline, next(self._seq), timer))
+        self.scheduled += 1
+        if self._armed_at is None or timer.deadline < self._armed_at:
+            self._arm(loop)
+        return timer
+
+    def cancel(self, key: Hashable) -> bool:
+        if self._drop(key):
+            self.cancelled += 1
+            return True
+        return False
+
+    def _drop(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        timer.cancelled = True
+        self._stale += 1
+        if len(self._heap) > COMPACT_MIN_SIZE and self._stale * 2 > len(self._heap):
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+            self._stale = 0
+        return True
+
+    def _arm(self, loop: asyncio.AbstractEventLoop):
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+            self._stale -= 1
+        deadline = self._heap[0][0] if self._heap else None
+        if deadline == self._armed_at:
+            return
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._armed_at = deadline
+        if deadline is not None:
+            self._handle = loop.call_at(deadline, self._fire)
+
+    def _fire(self):
+        loop = asyncio.get_running_loop()
+        self._handle = None
+        self._armed_at = None
+        now = loop.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, timer = heapq.heappop(self._heap)
+            if timer.cancelled:
+                self._stale -= 1
+                continue
+            del self._timers[timer.key]
+            self.fired += 1
+            self._run(loop, timer)
+        self._arm(loop)
+
+    def _run(self, loop: asyncio.AbstractEventLoop, timer: Timer):
+        try:
+            result = timer.callback(*timer.args)
+        except Exception as e:
+            self.failed += 1
+            print(f"[timers] ошибка таймера {timer.key!r}: {e}")
+            return
+        if asyncio.iscoroutine(result):
+            task = loop.create_task(result)
+            self._tasks.add(task)
+            task.add_done_callback(lambda t, key=timer.key: self._done(t, key))
+
+    def _done(self, task: asyncio.Task, key: Hashable):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+            print(f"[timers] ошибка таймера {key!r}: {task.exception()}")
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    @property
+    def pending(self) -> int:
+        return len(self._timers)
+
+    async def stop(self):
+        """Снимает все таймеры и дожидается уже запущенных колбэков."""
+        for timer in self._timers.values():
+            timer.cancelled = True
+        self._timers.clear()
+        self._heap.clear()
+        self._stale = 0
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._armed_at = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "heap": len(self._heap),
+            "scheduled": self.scheduled,
+            "fired": self.fired,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+        }
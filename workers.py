@@ -0,0 +1,234 @@
+"""Режим нескольких процессов: фронт принимает вебхук и MQTT, воркеры обрабатывают.
+
+Фронт (основной процесс) слушает вебхук Telegram и раздаёт апдейты
+воркерам по user_id: один и тот же пользователь всегда попадает в один
+процесс, поэтому его user_data, шаги регистрации и ожидающие команды
+остаются в памяти этого процесса. Воркеры — отдельные процессы
+(multiprocessing, spawn) со своим event loop и своим Application без
+Updater; апдейты приходят им через multiprocessing.Queue.
+
+MQTT-статусы принимает только фронт. Он отсеивает повторы
+(GateStateMachine), записывает состояние калитки в общее хранилище
+(gate_store) и рассылает событие всем воркерам: у каждого свои
+подписчики и своя очередь калитки. Владельцем события помечается воркер,
+отправивший команду (по request_id из gate_commands, для старой прошивки —
+по user_id): только он сопоставляет подтверждение и пишет пользователю.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import queue
+import sqlite3
+import ssl
+import zlib
+from typing import Callable, List, Optional
+
+import access_db
+from access_db_async import get_pool
+from gate_state import DeviceEvent
+
+# Сообщения воркеру: ("update", dict) и ("event", topic, dict, owner: bool); None — стоп
+UPDATE_KEYS = (
+    "message",
+    "edited_message",
+    "callback_query",
+    "my_chat_member",
+    "chat_member",
+    "inline_query",
+    "chosen_inline_result",
+    "pre_checkout_query",
+    "shipping_query",
+)
+
+
+def worker_for(user_id, count: int) -> int:
+    """Номер воркера пользователя; для апдейтов без пользователя — 0."""
+    if count <= 1 or user_id is None:
+        return 0
+    user_id = str(user_id)
+    if user_id.isdigit():
+        return int(user_id) % count
+    return zlib.crc32(user_id.encode()) % count
+
+
+def update_user_id(update: dict) -> Optional[int]:
+    """from.id из JSON апдейта Telegram."""
+    for key in UPDATE_KEYS:
+        body = update.get(key)
+        if isinstance(body, dict):
+            sender = body.get("from") or {}
+            return sender.get("id")
+    return None
+
+
+class WorkerPool:
+    def __init__(self, count: int, target: Callable, queue_size: int = 10000):
+        """target(index, count, inbox) — функция из главного модуля (для spawn)."""
+        self.count = count
+        self._target = target
+        self._context = multiprocessing.get_context("spawn")
+        self._inboxes = [self._context.Queue(maxsize=queue_size) for _ in range(count)]
+        self._processes: List[multiprocessing.Process] = []
+        self.sent = [0] * count
+        self.dropped = 0
+
+    def start(self):
+        for index, inbox in enumerate(self._inboxes):
+            process = self._context.Process(
+                target=self._target, args=(index, self.count, inbox), name=f"gate-worker-{index}"
+            )
+            process.start()
+            self._processes.append(process)
+
+    def send(self, index: int, message) -> bool:
+        """Потокобезопасно; при переполненной очереди воркера сообщение отбрасывается."""
+        try:
+            self._inboxes[index].put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.sent[index] += 1
+        return True
+
+    def dispatch_update(self, update: dict) -> bool:
+        return self.send(worker_for(update_user_id(update), self.count), ("update", update))
+
+    def stop(self, timeout: float = 10.0):
+        for inbox in self._inboxes:
+            try:
+                inbox.put(None, timeout=1)
+            except queue.Full:
+                pass
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes.clear()
+
+    def alive(self) -> int:
+        return sum(process.is_alive() for process in self._processes)
+
+    def stats(self) -> dict:
+        return {"workers": self.count, "alive": self.alive(), "sent": self.sent, "dropped": self.dropped}
+
+
+class EventRouter:
+    """MQTT-статусы → воркеры; handler MqttBridge фронта (event loop, по порядку на калитку)."""
+
+    def __init__(self, pool: WorkerPool, registry):
+        self.pool = pool
+        self.registry = registry
+        self.routed = 0
+        self.dropped = 0
+
+    async def _owner(self, event: DeviceEvent) -> int:
+        if event.request_id:
+            try:
+                worker = await get_pool().read(
+                    access_db.query_gate_command_worker, event.request_id
+                )
+            except sqlite3.Error as e:
+                print(f"[DB router error] {e}")
+                worker = None
+            if worker is not None and 0 <= worker < self.pool.count:
+                return worker
+        return worker_for(event.user_id, self.pool.count)
+
+    async def route(self, topic: str, data: dict, owner: bool = True):
+        gate = self.registry.for_topic(topic)
+        payload = data.get("status") or data.get("command")
+        if gate is None or not payload:
+            return
+        event = DeviceEvent.from_payload(payload, data)
+        if gate.machine.accept(gate.state, event):
+            self.dropped += 1
+            return
+        gate.state = event.status
+        try:
+            await get_pool().write(access_db.exec_gate_event, gate.id, event.status, event.user_id)
+        except sqlite3.Error as e:
+            print(f"[DB router error] {e}")
+
+        owner = await self._owner(event)
+        for index in range(self.pool.count):
+            self.pool.send(index, ("event", topic, data, index == owner))
+        self.routed += 1
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+    if not request_line:
+        return None
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout=10)
+        if not line or line in (b"\r\n", b"\n"):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0") or 0)
+    body = await reader.readexactly(length) if length else b""
+    parts = request_line.decode("latin-1").split()
+    return (parts[0] if parts else ""), (parts[1] if len(parts) > 1 else "/"), headers, body
+
+
+async def _handle_webhook(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    path: str,
+    secret: Optional[str],
+    on_update: Callable[[dict], bool],
+):
+    try:
+        while True:
+            request = await _read_request(reader)
+            if request is None:
+                break
+            method, target, headers, body = request
+            if method != "POST" or target.split("?")[0] != path:
+                status = "404 Not Found"
+            elif secret and headers.get("x-telegram-bot-api-secret-token") != secret:
+                status = "403 Forbidden"
+            else:
+                try:
+                    update = json.loads(body)
+                except ValueError:
+                    update = None
+                if not isinstance(update, dict):
+                    status = "400 Bad Request"
+                elif on_update(update):
+                    status = "200 OK"
+                else:
+                    # Telegram повторит апдейт позже
+                    status = "503 Service Unavailable"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_webhook_listener(
+    host: str,
+    port: int,
+    path: str,
+    on_update: Callable[[dict], bool],
+    cert: Optional[str] = None,
+    key: Optional[str] = None,
+    secret: Optional[str] = None,
+) -> asyncio.AbstractServer:
+    """Приём вебхука на фронте: только разбор JSON и передача в on_update."""
+    context = None
+    if cert:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+    return await asyncio.start_server(
+        lambda r, w: _handle_webhook(r, w, path, secret, on_update),
+        host=host,
+        port=port,
+        ssl=context,
+    )